@@ -40,6 +40,7 @@ from config import (
     NOTIFS_INTERVAL_SECS,
 )
 from database import Database
+from transport import get_transport
 from waitlist import Waitlist
 
 log = logging.getLogger("werkzeug")
@@ -670,6 +671,18 @@ def get_usage_summary():
     return jsonify({"data": _db.get_usage_summary()})
 
 
+@app.route("/get_performance_summary", methods=["POST"])
+def get_performance_summary():
+    netid = _cas.authenticate()
+    try:
+        if not is_admin(netid, _db):
+            return redirect("/")
+    except:
+        return redirect("/")
+
+    return jsonify({"data": _db.get_performance_summary(get_transport().get_stats())})
+
+
 @app.route("/get_all_subscriptions", methods=["POST"])
 def get_all_subscriptions():
     netid = _cas.authenticate()
@@ -0,0 +1,135 @@
+# ----------------------------------------------------------------------
+# bench_course_view.py
+# Benchmarks assembling the course page data (app_helper.pull_course())
+# of a course with many sections:
+#
+#   legacy:    get_course() plus get_class_enrollment() per section, then
+#              get_class_waitlist_size(), get_time_of_last_notif(),
+#              get_class_waitlist() and get_users() per section
+#   aggregate: Database.get_course_view(), a single $lookup aggregation
+#
+# and reports the time and the number of MongoDB round-trips of each.
+# Runs against a synthetic dataset in a scratch database (see
+# bench_utils.py), in which every section of the benchmarked course has
+# N_SUBS subscribers.
+#
+# Example: python benchmarks/bench_course_view.py 50 20
+#          (a course with 50 sections and 20 subscribers per section)
+# ----------------------------------------------------------------------
+
+from datetime import datetime
+from random import Random
+from sys import argv
+
+from bench_utils import (
+    connect_bench_db,
+    drop_bench_db,
+    fmt_durations,
+    median,
+    populate_synthetic_term,
+    time_runs,
+)
+from cycletrace import DB_COMMAND_COUNTER
+
+
+# the per-section course page loader that pull_course() used before
+# get_course_view(). returns {classid: class data shown on the page}
+def legacy_course_view(db, courseid):
+    course = db.get_course(courseid)
+    res = {}
+    for key in course.keys():
+        if not key.startswith("class_"):
+            continue
+        classid = course[key]["classid"]
+        enrollment = db.get_class_enrollment(classid)
+        try:
+            wl_size = db.get_class_waitlist_size(classid)
+        except Exception:
+            wl_size = 0
+        subscribers = {}
+        waitlist = db.get_class_waitlist(classid)
+        if waitlist and waitlist.get("waitlist"):
+            for user in db.get_users(waitlist["waitlist"]):
+                if "year" in user:
+                    subscribers.setdefault(user["year"] or "Other", []).append(
+                        user["netid"]
+                    )
+        res[classid] = (
+            enrollment["enrollment"],
+            enrollment["capacity"],
+            wl_size,
+            db.get_time_of_last_notif(classid),
+            {year: sorted(netids) for year, netids in subscribers.items()},
+        )
+    return res
+
+
+def aggregate_course_view(db, courseid):
+    course = db.get_course_view(courseid)
+    return {
+        course[key]["classid"]: (
+            course[key]["enrollment"],
+            course[key]["capacity"],
+            course[key]["wl_size"],
+            course[key]["time_of_last_notif"],
+            {
+                year: sorted(netids)
+                for year, netids in course[key]["subscribers"].items()
+            },
+        )
+        for key in course
+        if key.startswith("class_")
+    }
+
+
+# returns the result of fn() and the number of MongoDB commands it sent
+def count_commands(fn):
+    n = DB_COMMAND_COUNTER.n_commands
+    res = fn()
+    return res, DB_COMMAND_COUNTER.n_commands - n
+
+
+if __name__ == "__main__":
+    n_sections = int(argv[1]) if len(argv) > 1 else 50
+    n_subs = int(argv[2]) if len(argv) > 2 else 20
+
+    db = connect_bench_db()
+    try:
+        data = populate_synthetic_term(
+            db,
+            n_courses=20,
+            n_sections=n_sections,
+            subscribed_frac=0,
+            n_users=max(2000, n_subs * 2),
+        )
+        courseid = data["courseids"][0]
+        classids = data["classids"][:n_sections]
+
+        # every section of the course is subscribed to by n_subs users and
+        # was last notified some time ago
+        rand = Random(0)
+        for classid in classids:
+            subs = rand.sample(data["netids"], n_subs)
+            db._db.waitlists.insert_one({"classid": classid, "waitlist": subs})
+            db._db.users.update_many(
+                {"netid": {"$in": subs}}, {"$push": {"waitlists": classid}}
+            )
+            db._db.enrollments.update_one(
+                {"classid": classid},
+                {"$set": {"last_notif": datetime(2024, 1, rand.randint(1, 28))}},
+            )
+        print(f"1 course with {n_sections} sections, {n_subs} subscribers each")
+
+        legacy, n_legacy = count_commands(lambda: legacy_course_view(db, courseid))
+        agg, n_agg = count_commands(lambda: aggregate_course_view(db, courseid))
+        if legacy != agg:
+            raise SystemExit("results differ between legacy and aggregate loaders")
+
+        _, legacy_times = time_runs(lambda: legacy_course_view(db, courseid), n_runs=5)
+        _, agg_times = time_runs(lambda: aggregate_course_view(db, courseid), n_runs=20)
+
+        print(f"legacy:    {fmt_durations(legacy_times)}, {n_legacy} round-trips")
+        print(f"aggregate: {fmt_durations(agg_times)}, {n_agg} round-trips")
+        print(f"speedup:   {median(legacy_times) / median(agg_times):.1f}x")
+    finally:
+        drop_bench_db(db)
@@ -0,0 +1,156 @@
+# ----------------------------------------------------------------------
+# bench_notif_delivery.py
+# Benchmarks the notification send path: pushes synthetic notification
+# emails (1-4 recipients per SendGrid request) and text messages (1 in
+# 5) through a DeliveryExecutor, i.e. send_email()/send_text() with the
+# pooled, rate-limited provider clients, and reports the messages sent
+# per second and the p50/p95/p99 time from queueing a message to its
+# being sent.
+#
+# Runs against local fake SendGrid and Twilio servers with LATENCY_MS of
+# latency per request, ERROR_RATE of failed requests, and, if given,
+# RATE_LIMIT requests per second before they respond 429 (see
+# fake_provider_servers.py). The client-side rate limits, pool sizes,
+# and throttling settings are read from config as usual (e.g. set
+# SENDGRID_RATE_PER_SEC=0 to disable the client-side limit).
+#
+# Example: python benchmarks/bench_notif_delivery.py 5 50 0.01 200
+#          (5000 notifications, 50 ms per request, 1% errors, 429s
+#          beyond 200 requests per second)
+# ----------------------------------------------------------------------
+
+from sys import path
+
+path.append("src")  # noqa
+
+from os import environ
+from sys import argv
+
+from fake_provider_servers import FakeSendGridServer, FakeTwilioServer
+
+n_msgs = int(float(argv[1]) * 1000) if len(argv) > 1 else 2000
+latency_ms = float(argv[2]) if len(argv) > 2 else 50
+error_rate = float(argv[3]) if len(argv) > 3 else 0.01
+rate_limit = int(argv[4]) if len(argv) > 4 else None
+
+# the fake servers must be up (and the base URLs set) before config is
+# imported through delivery
+servers = {
+    "sendgrid": FakeSendGridServer(
+        latency_secs=latency_ms / 1000,
+        error_rate=error_rate,
+        rate_limit_per_sec=rate_limit,
+    ).start(),
+    "twilio": FakeTwilioServer(
+        latency_secs=latency_ms / 1000,
+        error_rate=error_rate,
+        rate_limit_per_sec=rate_limit,
+    ).start(),
+}
+environ["SENDGRID_BASE_URL"] = servers["sendgrid"].base_url
+environ["TWILIO_BASE_URL"] = servers["twilio"].base_url
+
+from time import perf_counter  # noqa: E402
+
+from config import (  # noqa: E402
+    EMAIL_MAX_WORKERS,
+    SENDGRID_RATE_PER_SEC,
+    SMS_MAX_WORKERS,
+    TWILIO_RATE_PER_SEC,
+)
+from delivery import DeliveryExecutor, count_sent  # noqa: E402
+from providers import get_provider_stats  # noqa: E402
+
+
+# returns the channel and send_email()/send_text() arguments of the i-th
+# synthetic notification
+def synthetic_message(i):
+    if i % 5 == 0:
+        return "sms", [
+            f"609555{i % 10000:04d}",
+            f"COS 333 L01 has 1 open spot(s)! ({i})",
+        ]
+    personalizations = [
+        {
+            "to": [{"email": f"user{i}_{j}@princeton.edu"}],
+            "dynamic_template_data": {"netid": f"user{i}_{j}", "n_open_spots": 1},
+        }
+        for j in range(i % 4 + 1)
+    ]
+    return "email", [
+        {
+            "from": {"email": "tigersnatch@princeton.edu", "name": "TigerSnatch"},
+            "template_id": "d-2607514c41ef48cdb649bad3d4f0c660",
+            "personalizations": personalizations,
+        }
+    ]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(p / 100 * len(values)), len(values) - 1)]
+
+
+def fmt_latencies(latencies):
+    return (
+        ", ".join(
+            f"p{p} {percentile(latencies, p) * 1000:.1f} ms" for p in (50, 95, 99)
+        )
+        + f", max {max(latencies) * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    executor = DeliveryExecutor()
+    try:
+        print(
+            f"{n_msgs} notifications, {latency_ms:g} ms per request, {error_rate:.1%} errors, "
+            + (
+                f"429s beyond {rate_limit} requests/s"
+                if rate_limit
+                else "no server rate limit"
+            )
+        )
+        print(
+            f"{EMAIL_MAX_WORKERS} email / {SMS_MAX_WORKERS} SMS sender threads, client rate limits: "
+            f"SendGrid {SENDGRID_RATE_PER_SEC:g}/s, Twilio {TWILIO_RATE_PER_SEC:g}/s (0 = none)"
+        )
+
+        latencies = {"email": [], "sms": []}
+        futures = {"email": [], "sms": []}
+        tic = perf_counter()
+        for i in range(n_msgs):
+            channel, args = synthetic_message(i)
+            future = executor.submit(channel, args)
+            future.add_done_callback(
+                lambda _, channel=channel, queued=perf_counter(): latencies[
+                    channel
+                ].append(perf_counter() - queued)
+            )
+            futures[channel].append(future)
+        results = {
+            channel: [future.result() for future in channel_futures]
+            for channel, channel_futures in futures.items()
+        }
+        duration = perf_counter() - tic
+
+        for channel, label in (("email", "emails"), ("sms", "texts")):
+            n_sent = count_sent(results[channel])
+            n_recipients = sum(len(res) for res in results[channel])
+            print(
+                f"{label}: {len(results[channel])} requests, {n_sent}/{n_recipients} recipients sent, "
+                f"{len(results[channel]) / duration:.1f} requests/s, {fmt_latencies(latencies[channel])}"
+            )
+        print(
+            f"total:  {n_msgs / duration:.1f} notifications/s ({duration:.2f} s), "
+            f"{fmt_latencies(latencies['email'] + latencies['sms'])}"
+        )
+        for name, stats in sorted(get_provider_stats().items()):
+            print(
+                f"{name}: {stats['calls']} calls, {stats['failures']} failed, {stats['throttled']} throttled "
+                f"(server saw {servers[name].stats['requests']} requests)"
+            )
+    finally:
+        executor.shutdown()
+        for server in servers.values():
+            server.stop()
@@ -0,0 +1,105 @@
+# ----------------------------------------------------------------------
+# bench_notifs_cycle.py
+# Benchmarks finding open spots in all waited-on classes, the
+# MobileApp-bound part of every notifications cycle:
+#
+#   sync:  Monitor.get_classes_with_changed_enrollments() with MobileApp
+#          (SEATS_MAX_WORKERS chunk requests in flight)
+#   async: Monitor.get_classes_with_changed_enrollments_async() with
+#          AsyncMobileApp (SEATS_MAX_IN_FLIGHT chunk requests in flight,
+#          database queries overlapped with the requests)
+#
+# Runs against a synthetic dataset in a scratch database (see
+# bench_utils.py) and a local fake OIT server with LATENCY_MS of latency
+# per courses/seats request (see fake_oit_server.py).
+#
+# Example: python benchmarks/bench_notifs_cycle.py 1000 6 100
+#          (1000 courses with 6 sections each, 100 ms per request)
+# ----------------------------------------------------------------------
+
+from os import environ
+from sys import argv
+
+from fake_oit_server import FakeOITServer, load_seats_from_db
+
+n_courses = int(argv[1]) if len(argv) > 1 else 500
+n_sections = int(argv[2]) if len(argv) > 2 else 6
+latency_ms = float(argv[3]) if len(argv) > 3 else 100
+
+# the fake server must be up (and OIT_BASE_URL set) before config is
+# imported through bench_utils
+server = FakeOITServer(latency_secs=latency_ms / 1000).start()
+environ["OIT_BASE_URL"] = server.base_url
+
+import asyncio  # noqa: E402
+
+from bench_utils import (  # noqa: E402
+    connect_bench_db,
+    drop_bench_db,
+    fmt_durations,
+    median,
+    populate_synthetic_term,
+    time_runs,
+)
+
+from asyncmobileapp import AsyncMobileApp  # noqa: E402
+from mobileapp import MobileApp  # noqa: E402
+from monitor import Monitor  # noqa: E402
+
+
+# forgets all seats fingerprints so that every run does the same work
+def reset_fingerprints(db):
+    db._db.enrollments.update_many(
+        {}, {"$unset": {"seats_fingerprint": "", "seats_fingerprint_time": ""}}
+    )
+
+
+def run_sync(db, api):
+    reset_fingerprints(db)
+    return Monitor(db, api=api).get_classes_with_changed_enrollments()
+
+
+def run_async(db, api, loop):
+    reset_fingerprints(db)
+    return loop.run_until_complete(
+        Monitor(db).get_classes_with_changed_enrollments_async(api)
+    )
+
+
+if __name__ == "__main__":
+    db = connect_bench_db()
+    loop = asyncio.new_event_loop()
+    async_api = None
+    try:
+        populate_synthetic_term(db, n_courses=n_courses, n_sections=n_sections)
+        load_seats_from_db(server, db)
+        n_waited = db._db.waitlists.count_documents({})
+        print(
+            f"{n_courses} courses, {n_waited} subscribed sections, {latency_ms:g} ms per seats request"
+        )
+
+        sync_api = MobileApp(db=db)
+        async_api = AsyncMobileApp(db=db)
+
+        # warm up connections and the access token
+        run_sync(db, sync_api)
+        run_async(db, async_api, loop)
+
+        sync_res, sync_times = time_runs(lambda: run_sync(db, sync_api), n_runs=5)
+        async_res, async_times = time_runs(
+            lambda: run_async(db, async_api, loop), n_runs=5
+        )
+
+        if sync_res != async_res:
+            raise SystemExit("open spots differ between sync and async cycles")
+
+        print(f"open spots: {len(sync_res[0])} sections")
+        print(f"sync:    {fmt_durations(sync_times)}")
+        print(f"async:   {fmt_durations(async_times)}")
+        print(f"speedup: {median(sync_times) / median(async_times):.1f}x")
+    finally:
+        if async_api is not None:
+            loop.run_until_complete(async_api.close())
+        loop.close()
+        drop_bench_db(db)
+        server.stop()
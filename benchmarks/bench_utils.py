@@ -0,0 +1,188 @@
+# ----------------------------------------------------------------------
+# bench_utils.py
+# Shared helpers for the benchmark scripts in this directory: connects
+# to a scratch MongoDB database and fills it with synthetic TigerSnatch
+# data.
+#
+# All benchmarks use DB_CONNECTION_STR (like the rest of the app) but
+# write ONLY to the database named by BENCH_DB_NAME (default:
+# tigersnatch_bench), which is dropped before and after every run.
+# Point DB_CONNECTION_STR at a local or staging cluster - never prod.
+# ----------------------------------------------------------------------
+
+from sys import path
+
+path.append("src")  # noqa
+
+from datetime import datetime
+from os import getenv
+from random import Random
+from time import perf_counter
+
+import certifi
+from pymongo import MongoClient
+
+from config import DB_CONNECTION_STR
+from cycletrace import DB_COMMAND_COUNTER
+from database import Database
+from indexes import ensure_indexes
+
+BENCH_DB_NAME = getenv("BENCH_DB_NAME", "tigersnatch_bench")
+
+
+# returns a Database whose queries run against the scratch database
+# BENCH_DB_NAME, with the same indexes as production and its commands
+# counted by DB_COMMAND_COUNTER (skips the collection integrity check,
+# since the scratch database starts out empty)
+def connect_bench_db():
+    if BENCH_DB_NAME == "tigersnatch":
+        raise RuntimeError("BENCH_DB_NAME must not be the production database")
+
+    client = MongoClient(
+        DB_CONNECTION_STR,
+        serverSelectionTimeoutMS=5000,
+        tlsCAFile=certifi.where(),
+        event_listeners=[DB_COMMAND_COUNTER],
+    )
+    client.drop_database(BENCH_DB_NAME)
+
+    db = Database.__new__(Database)
+    db._db = client[BENCH_DB_NAME]
+    ensure_indexes(db._db)
+    return db
+
+
+def drop_bench_db(db):
+    db._db.client.drop_database(BENCH_DB_NAME)
+
+
+# inserts a synthetic term: n_courses courses with n_sections sections
+# each, of which subscribed_frac are subscribed to by 1-n_subs_max users.
+# returns a dictionary with the generated courseids, classids, and netids
+def populate_synthetic_term(
+    db,
+    n_courses=500,
+    n_sections=6,
+    subscribed_frac=0.5,
+    n_subs_max=20,
+    n_users=2000,
+    n_disabled=5,
+    seed=0,
+):
+    rand = Random(seed)
+    netids = [f"user{i:05d}" for i in range(n_users)]
+    years = ["2025", "2026", "2027", "2028", "Grad", None]
+
+    courses, mappings, enrollments, waitlists = [], [], [], []
+    user_waitlists = {netid: [] for netid in netids}
+    notifs = {netid: {"netid": netid} for netid in netids}
+    courseids, classids = [], []
+
+    for c in range(n_courses):
+        courseid = f"{c:06d}"
+        displayname = f"DPT{c % 900 + 100}/XLS{c % 900 + 100}"
+        course = {
+            "courseid": courseid,
+            "displayname": displayname,
+            "displayname_whitespace": displayname.replace("DPT", "DPT "),
+            "title": f"Synthetic Course {c}",
+            "has_reserved_seats": rand.random() < 0.1,
+        }
+        mappings.append(dict(course, time=0))
+        courseids.append(courseid)
+
+        for s in range(n_sections):
+            classid = f"{c * n_sections + s + 10000}"
+            capacity = rand.randint(10, 200)
+            enrollment = rand.randint(capacity // 2, capacity)
+            course[f"class_{classid}"] = {
+                "classid": classid,
+                "section": "L01" if s == 0 else f"P{s:02d}",
+                "type_name": "Lecture" if s == 0 else "Precept",
+                "start_time": "10:00 AM",
+                "end_time": "10:50 AM",
+                "days": "M W",
+                "enrollment": enrollment,
+                "capacity": capacity,
+                "status_is_open": rand.random() < 0.7,
+            }
+            enrollments.append(
+                {
+                    "classid": classid,
+                    "courseid": courseid,
+                    "section": course[f"class_{classid}"]["section"],
+                    "enrollment": enrollment,
+                    "capacity": capacity,
+                }
+            )
+            classids.append(classid)
+
+            if rand.random() >= subscribed_frac:
+                continue
+            subs = rand.sample(netids, rand.randint(1, n_subs_max))
+            waitlists.append({"classid": classid, "waitlist": subs})
+            for netid in subs:
+                user_waitlists[netid].append(classid)
+                notifs[netid][classid] = {
+                    "n_open_spots": 0,
+                    "last_notif": datetime(2020, 1, 1),
+                    "num_notifs": 0,
+                }
+
+        courses.append(course)
+
+    users = [
+        {
+            "netid": netid,
+            "email": f"{netid}@princeton.edu",
+            "phone": "" if rand.random() < 0.7 else "6095550100",
+            "waitlists": user_waitlists[netid],
+            "auto_resub": rand.random() < 0.3,
+            "year": rand.choice(years),
+        }
+        for netid in netids
+    ]
+
+    db._db.courses.insert_many(courses)
+    db._db.mappings.insert_many(mappings)
+    db._db.enrollments.insert_many(enrollments)
+    if waitlists:
+        db._db.waitlists.insert_many(waitlists)
+    db._db.users.insert_many(users)
+    db._db.notifs.insert_many(list(notifs.values()))
+    db._db.logs.insert_many([{"netid": netid, "waitlist_log": []} for netid in netids])
+    db._db.admin.insert_one(
+        {
+            "admins": [],
+            "blacklist": [],
+            "disabled_courses": rand.sample(courseids, n_disabled),
+            "logs": [],
+            "notifs_status": "on",
+            "live_notifs_status": {"state": "inactive", "description": ""},
+            "current_term_code": "1234",
+            "current_term_name": "Synthetic Term",
+        }
+    )
+
+    return {"courseids": courseids, "classids": classids, "netids": netids}
+
+
+# runs fn n_runs times and returns (result of last run, list of durations
+# in seconds)
+def time_runs(fn, n_runs=5):
+    durations = []
+    res = None
+    for _ in range(n_runs):
+        tic = perf_counter()
+        res = fn()
+        durations.append(perf_counter() - tic)
+    return res, durations
+
+
+def median(durations):
+    return sorted(durations)[len(durations) // 2]
+
+
+def fmt_durations(durations):
+    durations = sorted(durations)
+    return f"median {median(durations) * 1000:.1f} ms (min {durations[0] * 1000:.1f} ms, max {durations[-1] * 1000:.1f} ms)"
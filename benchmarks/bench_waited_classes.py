@@ -0,0 +1,74 @@
+# ----------------------------------------------------------------------
+# bench_waited_classes.py
+# Benchmarks loading the waited-on classes snapshot used at the start of
+# every notifications cycle (Monitor._construct_waited_classes()):
+#
+#   legacy:    one classid_to_course_info() call (2 find_one round-trips)
+#              per subscribed section
+#   aggregate: Database.get_waited_classes_by_course(), a single
+#              $lookup aggregation
+#
+# Runs against a synthetic dataset in a scratch database (see
+# bench_utils.py).
+#
+# Example: python benchmarks/bench_waited_classes.py 1000 6
+#          (1000 courses with 6 sections each)
+# ----------------------------------------------------------------------
+
+from sys import argv
+
+from bench_utils import (
+    connect_bench_db,
+    drop_bench_db,
+    fmt_durations,
+    median,
+    populate_synthetic_term,
+    time_runs,
+)
+
+
+# the per-section loader that Monitor._construct_waited_classes() used
+# before get_waited_classes_by_course()
+def legacy_waited_classes(db):
+    disabled_courses = db.get_disabled_courses()
+    data = {}
+    for class_ in db.get_waited_classes():
+        classid = class_["classid"]
+        try:
+            deptnum, courseid = db.classid_to_course_info(classid)
+        except:
+            continue
+        if courseid in disabled_courses:
+            continue
+        if courseid in data:
+            data[courseid].append(classid)
+        else:
+            data[courseid] = [deptnum, classid]
+    return data
+
+
+def normalize(data):
+    return {k: (v[0], sorted(v[1:])) for k, v in data.items()}
+
+
+if __name__ == "__main__":
+    n_courses = int(argv[1]) if len(argv) > 1 else 500
+    n_sections = int(argv[2]) if len(argv) > 2 else 6
+
+    db = connect_bench_db()
+    try:
+        populate_synthetic_term(db, n_courses=n_courses, n_sections=n_sections)
+        n_waited = db._db.waitlists.count_documents({})
+        print(f"{n_courses} courses, {n_waited} subscribed sections")
+
+        legacy, legacy_times = time_runs(lambda: legacy_waited_classes(db), n_runs=3)
+        agg, agg_times = time_runs(db.get_waited_classes_by_course, n_runs=10)
+
+        if normalize(legacy) != normalize(agg):
+            raise SystemExit("results differ between legacy and aggregate loaders")
+
+        print(f"legacy:    {fmt_durations(legacy_times)}")
+        print(f"aggregate: {fmt_durations(agg_times)}")
+        print(f"speedup:   {median(legacy_times) / median(agg_times):.1f}x")
+    finally:
+        drop_bench_db(db)
@@ -0,0 +1,120 @@
+# ----------------------------------------------------------------------
+# fake_oit_server.py
+# A local stand-in for the Princeton OIT APIs used by the benchmarks.
+# Serves the token endpoint and the MobileApp courses/seats endpoint for
+# the courses in FakeOITServer.seats, with a fixed artificial latency per
+# request to mimic the real API.
+#
+# Point the app at it by setting OIT_BASE_URL to FakeOITServer.base_url
+# BEFORE importing config (see bench_notifs_cycle.py).
+# ----------------------------------------------------------------------
+
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from urllib.parse import parse_qs, urlparse
+
+SEATS_PATH = "/student-app/1.0.3/courses/seats"
+TOKEN_PATH = "/token"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep connections alive like the real API does
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlparse(self.path).path != TOKEN_PATH:
+            return self._send(404, {"error": "not found"})
+        self._send(200, {"access_token": "fake-token", "expires_in": 3600})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != SEATS_PATH:
+            return self._send(404, {"error": "not found"})
+
+        sleep(self.server.latency_secs)
+        self.server.n_seats_requests += 1
+        courseids = parse_qs(url.query).get("course_ids", [""])[0].split(",")
+        self._send(
+            200,
+            {
+                "course": [
+                    {"course_id": courseid, "classes": self.server.seats[courseid]}
+                    for courseid in courseids
+                    if courseid in self.server.seats
+                ]
+            },
+        )
+
+    def _send(self, status, body):
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOITServer:
+    # latency_secs is added to every courses/seats request. port 0 picks
+    # a free port
+
+    def __init__(self, latency_secs=0.1, port=0):
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.latency_secs = latency_secs
+        self._server.n_seats_requests = 0
+        # courseid -> list of classes in the courses/seats format:
+        # {"class_number", "enrollment", "capacity", "pu_calc_status"}
+        self._server.seats = {}
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def seats(self):
+        return self._server.seats
+
+    @property
+    def n_seats_requests(self):
+        return self._server.n_seats_requests
+
+    def start(self):
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# fills server.seats from the enrollments collection of db, marking
+# roughly open_frac of the sections Open with enrollment below capacity
+def load_seats_from_db(server, db, open_frac=0.5):
+    server.seats.clear()
+    for i, enrollment in enumerate(db._db.enrollments.find({}, {"_id": 0})):
+        is_open = i % 100 < open_frac * 100
+        capacity = enrollment["capacity"]
+        server.seats.setdefault(enrollment["courseid"], []).append(
+            {
+                "class_number": enrollment["classid"],
+                "enrollment": str(
+                    max(capacity - (i % 3 + 1), 0) if is_open else capacity
+                ),
+                "capacity": str(capacity),
+                "pu_calc_status": "Open" if is_open else "Closed",
+            }
+        )
+
+
+if __name__ == "__main__":
+    server = FakeOITServer(port=8765).start()
+    print(f"fake OIT server (no courses) listening on {server.base_url}")
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
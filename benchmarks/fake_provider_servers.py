@@ -0,0 +1,179 @@
+# ----------------------------------------------------------------------
+# fake_provider_servers.py
+# Local stand-ins for the notification providers used by the
+# benchmarks: FakeSendGridServer serves the SendGrid v3 mail send
+# endpoint and FakeTwilioServer the Twilio create message endpoint.
+# Every request gets a fixed artificial latency, a random error_rate of
+# them fail, and requests beyond rate_limit_per_sec in a second are
+# throttled (429 Too Many Requests, with a Retry-After of
+# retry_after_secs for SendGrid) like the real providers do.
+#
+# Point the app at them by setting SENDGRID_BASE_URL and TWILIO_BASE_URL
+# to their base_url BEFORE importing config (see
+# bench_notif_delivery.py).
+# ----------------------------------------------------------------------
+
+import json
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from threading import Lock, Thread
+from time import monotonic, sleep
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+MAIL_SEND_PATH = "/v3/mail/send"
+MESSAGES_PATH = re.compile(r"^/2010-04-01/Accounts/([^/]+)/Messages\.json$")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep connections alive like the real APIs do
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = urlparse(self.path).path
+
+        sleep(self.server.latency_secs)
+        outcome = self.server.fake.next_outcome()
+        self.server.fake.handle(self, path, body, outcome)
+
+    def send(self, status, body=None, headers=None):
+        body = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _FakeProviderServer:
+    # latency_secs is added to every request, error_rate of the requests
+    # fail, and the requests beyond rate_limit_per_sec (None for no limit)
+    # in any second are throttled. port 0 picks a free port
+
+    def __init__(
+        self,
+        latency_secs=0.05,
+        error_rate=0.0,
+        rate_limit_per_sec=None,
+        retry_after_secs=1,
+        port=0,
+        seed=0,
+    ):
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.latency_secs = latency_secs
+        self._server.fake = self
+        self.error_rate = error_rate
+        self.rate_limit_per_sec = rate_limit_per_sec
+        self.retry_after_secs = retry_after_secs
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0, "recipients": 0}
+        self._random = Random(seed)
+        self._window = (0, 0)
+        self._lock = Lock()
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    # returns "throttled", "error", or "ok" for the next request
+
+    def next_outcome(self):
+        with self._lock:
+            self.stats["requests"] += 1
+            second, n = self._window
+            now = int(monotonic())
+            n = n + 1 if second == now else 1
+            self._window = (now, n)
+            if self.rate_limit_per_sec is not None and n > self.rate_limit_per_sec:
+                self.stats["throttled"] += 1
+                return "throttled"
+            if self._random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return "error"
+            return "ok"
+
+    def count_recipients(self, n):
+        with self._lock:
+            self.stats["recipients"] += n
+
+    # answers the request for path with body given outcome (see
+    # next_outcome()) through handler
+
+    def handle(self, handler, path, body, outcome):
+        raise NotImplementedError
+
+    def start(self):
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeSendGridServer(_FakeProviderServer):
+    def handle(self, handler, path, body, outcome):
+        if path != MAIL_SEND_PATH:
+            return handler.send(404, {"errors": [{"message": "not found"}]})
+        if outcome == "throttled":
+            return handler.send(
+                429,
+                {"errors": [{"message": "too many requests"}]},
+                {"Retry-After": str(self.retry_after_secs)},
+            )
+        if outcome == "error":
+            return handler.send(500, {"errors": [{"message": "internal error"}]})
+
+        self.count_recipients(len(json.loads(body)["personalizations"]))
+        handler.send(202, headers={"X-Message-Id": uuid4().hex})
+
+
+class FakeTwilioServer(_FakeProviderServer):
+    def handle(self, handler, path, body, outcome):
+        match = MESSAGES_PATH.match(path)
+        if match is None:
+            return handler.send(
+                404, {"code": 20404, "message": "not found", "status": 404}
+            )
+        if outcome == "throttled":
+            return handler.send(
+                429, {"code": 20429, "message": "Too Many Requests", "status": 429}
+            )
+        if outcome == "error":
+            return handler.send(
+                400,
+                {"code": 21211, "message": "Invalid 'To' Phone Number", "status": 400},
+            )
+
+        self.count_recipients(1)
+        form = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+        handler.send(
+            201,
+            {
+                "sid": f"SM{uuid4().hex}",
+                "account_sid": match.group(1),
+                "to": form.get("To"),
+                "from": form.get("From"),
+                "body": form.get("Body"),
+                "status": "queued",
+                "num_segments": "1",
+            },
+        )
+
+
+if __name__ == "__main__":
+    sendgrid = FakeSendGridServer(port=8766).start()
+    twilio = FakeTwilioServer(port=8767).start()
+    print(f"fake SendGrid server listening on {sendgrid.base_url}")
+    print(f"fake Twilio server listening on {twilio.base_url}")
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        sendgrid.stop()
+        twilio.stop()
@@ -30,6 +30,23 @@ from log_utils import *
 from send_notifs import *
 
 
+_notifs_engine = None
+
+
+# returns the NotificationEngine shared by all notifs jobs in this
+# process, creating it on first use
+def _get_notifs_engine():
+    global _notifs_engine
+    if _notifs_engine is None:
+        _notifs_engine = NotificationEngine()
+    return _notifs_engine
+
+
+# runs one notifications cycle on the shared NotificationEngine
+def _run_notifs_cycle(end_time):
+    _get_notifs_engine().run_cycle(end_time)
+
+
 def _should_notify_admins_of_schedule_change(times):
     return AUTO_GENERATE_NOTIF_SCHEDULE and len(times) > 0
 
@@ -96,7 +113,7 @@ def _build_scheduler(times):
         start, end = time[0], time[1]
         log_cron(f"Adding notifs job between {start} and {end}")
         sched.add_job(
-            cronjob,
+            _run_notifs_cycle,
             "interval",
             start_date=start,
             end_date=end
@@ -0,0 +1,44 @@
+# ----------------------------------------------------------------------
+# send_outbox_worker.py
+# Sends the notifications stored in the outbox collection by the notifs
+# dyno (see outbox.py). Run as many outbox dynos as needed and set
+# OUTBOX_INLINE_DELIVERY to false so that the notifs dyno only finds open
+# spots and stores notifications.
+#
+# Set polling interval in config:       OUTBOX_POLL_SECS
+# ----------------------------------------------------------------------
+
+from sys import path
+
+path.append("src")  # noqa
+
+from sys import stderr
+from time import sleep
+
+from config import OUTBOX_POLL_SECS
+from delivery import count_sent
+from log_utils import *
+from outbox import OutboxWorker
+from systemlog import flush_system_logs
+
+if __name__ == "__main__":
+    worker = OutboxWorker()
+    log_info("Outbox worker started")
+    try:
+        while True:
+            try:
+                emails_res, texts_res = worker.drain()
+            except Exception as e:
+                log_error("Failed to drain notification outbox")
+                print(e, file=stderr)
+                emails_res, texts_res = [], []
+
+            if len(emails_res) + len(texts_res) > 0:
+                log_notifs(
+                    f"Sent {count_sent(emails_res)} emails and {count_sent(texts_res)} texts from the outbox"
+                )
+            else:
+                sleep(OUTBOX_POLL_SECS)
+    finally:
+        worker.close()
+        flush_system_logs()
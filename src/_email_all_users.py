@@ -19,18 +19,27 @@
 #    Specify one of the following flags:
 #       --test <email1> <email2> ... : Send to 1+ specific emails.
 # 	    --all: Send to ALL user emails.
+#    and optionally:
+#       --dry-run: Only report the number of SendGrid requests to send.
 #
 #    Example: python _email_all_users.py --test x@x.com y@y.com
+#    Example: python _email_all_users.py --all --dry-run
 #    Example: python _email_all_users.py --all
+#
+# Emails are sent in batches of recipients per SendGrid request, several
+# requests at once (see broadcast.py). The progress of --all is saved in
+# the database: if sending is interrupted, run the same command again
+# (with the same SUBJECT and MESSAGE) to send to the users not yet sent
+# to, including any who signed up in the meantime.
 # ----------------------------------------------------------------------
 
 from sys import argv, exit
 
-from sendgrid import SendGridAPIClient
-
-from config import SENDGRID_API_KEY, TS_EMAIL
+from broadcast import send_broadcast
+from config import TS_EMAIL
 from database import Database
 from log_utils import *
+from providers import get_provider
 
 CLASS_YEARS = ["2024", "2025", "2026", None]
 
@@ -41,9 +50,14 @@ if __name__ == "__main__":
             print("specify one of the following flags:")
             print("\t--test <email1> <email2> ...: send to 1+ specific emails")
             print("\t--all: send to ALL user emails")
+            print("and optionally:")
+            print("\t--dry-run: only report the number of requests to send")
             exit(2)
         return argv[1] == "--all"
 
+    dry_run = "--dry-run" in argv
+    argv = [arg for arg in argv if arg != "--dry-run"]
+
     DIR = "/".join(__file__.split("/")[:-1])
     SUBJECT_FILEPATH = f"{DIR}/SUBJECT"
     MESSAGE_FILEPATH = f"{DIR}/MESSAGE"
@@ -90,7 +104,8 @@ if __name__ == "__main__":
     print("---------------")
     print()
     if (
-        input(
+        not dry_run
+        and input(
             f"Send the above email to {'ALL users' if send_to_all_users else argv[2:]} ({len(emails)} in total)? (y/n) "
         )
         != "y"
@@ -98,31 +113,24 @@ if __name__ == "__main__":
         print("Exiting...")
         exit(0)
 
-    print("Sending...")
+    print("Dry run..." if dry_run else "Sending...")
 
-    n = len(emails)
-    for i, email in enumerate(emails):
-        print(f"({i+1}/{n}) Sending to {email}", end="...")
-        data = {
-            "personalizations": [
-                {
-                    "to": [{"email": email}],
-                    "dynamic_template_data": {"subject": SUBJECT, "message": MESSAGE},
-                }
-            ],
-            "from": {"email": TS_EMAIL, "name": "TigerSnatch"},
-            "template_id": "d-e688d68d1bac424382aa8535026d6f36",
-        }
-
-        try:
-            SendGridAPIClient(SENDGRID_API_KEY).client.mail.send.post(request_body=data)
-            print("success")
-        except Exception as e:
-            print("failed with exception:")
-            print(e)
+    # only sending to all users is checkpointed, so that test emails can
+    # be sent again
+    n_sent, failed = send_broadcast(
+        SUBJECT,
+        MESSAGE,
+        emails,
+        db=Database() if send_to_all_users else None,
+        dry_run=dry_run,
+    )
+    if dry_run:
+        exit(0)
 
+    for email in failed:
+        log_warning(f"Failed to send email to {email}")
     log_info(
-        f"Sent email to {'ALL users' if send_to_all_users else argv[2:]} ({len(emails)} in total)."
+        f"Sent email to {'ALL users' if send_to_all_users else argv[2:]} ({n_sent} sent in this run, {len(emails)} in total)."
     )
 
 
@@ -166,7 +174,7 @@ def notify_admins_of_schedule_change(schedule):
         }
 
         try:
-            SendGridAPIClient(SENDGRID_API_KEY).client.mail.send.post(request_body=data)
+            get_provider("sendgrid").send(data)
         except Exception as e:
             print(e)
 
@@ -0,0 +1,69 @@
+# ----------------------------------------------------------------------
+# _ensure_indexes.py
+# Creates the indexes of the TigerSnatch database declared in indexes.py
+# that are missing (safe to run any time: existing indexes are left
+# alone), then checks that every hot-path query uses an index. Before
+# that, duplicate waitlists are merged and a non-unique waitlists classid
+# index is replaced with a unique one (see migrate_waitlists_index()).
+# Exits with status 1 if any declared index could not be created or any
+# hot-path query scans a whole collection (COLLSCAN). Run as the release
+# step of every deploy (see Procfile), before any dyno starts, so that
+# no web or notifications process builds indexes while serving.
+#
+# Optionally specify the following flag:
+#   --verify: only check the hot-path queries, without creating indexes
+#
+# Example: python _ensure_indexes.py
+# Example: python _ensure_indexes.py --verify
+# ----------------------------------------------------------------------
+
+from sys import argv, exit, stderr
+
+from database import Database
+from indexes import (
+    HOT_QUERIES,
+    INDEXES,
+    ensure_indexes,
+    migrate_waitlists_index,
+    verify_indexes,
+)
+from log_utils import *
+
+if __name__ == "__main__":
+
+    def process_args():
+        if len(argv) > 2 or (len(argv) == 2 and argv[1] != "--verify"):
+            print("optionally specify the following flag:")
+            print("\t--verify: only check that the hot-path queries use an index")
+            exit(2)
+        return len(argv) == 2
+
+    verify_only = process_args()
+
+    db = Database()._db
+    failed = False
+    if not verify_only:
+        try:
+            migrate_waitlists_index(db)
+        except Exception as e:
+            log_error("Failed to make the waitlists classid index unique")
+            print(e, file=stderr)
+            failed = True
+
+        names = ensure_indexes(db)
+        log_info(f"Ensured {len(names)} indexes: {', '.join(names)}")
+        if len(names) < len(INDEXES):
+            log_error(
+                f"{len(INDEXES) - len(names)}/{len(INDEXES)} indexes could not be created"
+            )
+            failed = True
+
+    collscans = verify_indexes(db)
+    if len(collscans) > 0:
+        log_error(f"{len(collscans)}/{len(HOT_QUERIES)} hot-path queries do a COLLSCAN")
+        failed = True
+    else:
+        log_info(f"All {len(HOT_QUERIES)} hot-path queries use an index")
+
+    if failed:
+        exit(1)
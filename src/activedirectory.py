@@ -5,18 +5,17 @@
 # Adapted from https://github.com/vr2amesh/COS333-API-Code-Examples
 # ----------------------------------------------------------------------
 
-import base64
 import json
 from time import time
 
-import requests
-
-from config import CONSUMER_KEY, CONSUMER_SECRET
+from config import OIT_BASE_URL
+from tokencache import REFRESH_TOKEN_URL, TokenCache
+from transport import Transport, get_transport
 
 
 class ActiveDirectory:
     def __init__(self, db):
-        self.configs = Configs()
+        self.configs = Configs(db=db)
         self._db = db
 
     # wrapper function for _getJSON with the users endpoint.
@@ -35,10 +34,12 @@ class ActiveDirectory:
 
     def _getJSON(self, endpoint, **kwargs):
         tic = time()
-        req = requests.get(
+        access_token = self.configs.ACCESS_TOKEN
+        req = self.configs._transport.get(
             self.configs.BASE_URL + endpoint,
+            endpoint=endpoint,
             params=kwargs if "kwargs" not in kwargs else kwargs["kwargs"],
-            headers={"Authorization": "Bearer " + self.configs.ACCESS_TOKEN},
+            headers={"Authorization": "Bearer " + access_token},
         )
         text = req.text
 
@@ -54,7 +55,7 @@ class ActiveDirectory:
         )
 
         # Check to see if the response failed due to invalid credentials
-        text = self._updateConfigs(text, endpoint, **kwargs)
+        text = self._updateConfigs(text, endpoint, access_token, **kwargs)
 
         # Handle empty or invalid JSON responses from the API
         if not text or not text.strip():
@@ -65,13 +66,14 @@ class ActiveDirectory:
         except json.JSONDecodeError:
             return None
 
-    def _updateConfigs(self, text, endpoint, **kwargs):
+    def _updateConfigs(self, text, endpoint, rejected_token, **kwargs):
         if text.startswith("<ams:fault"):
-            self.configs._refreshToken(grant_type="client_credentials")
+            self.configs._refreshToken(rejected_token)
 
             # Redo the request with the new access token
-            req = requests.get(
+            req = self.configs._transport.get(
                 self.configs.BASE_URL + endpoint,
+                endpoint=endpoint,
                 params=kwargs if "kwargs" not in kwargs else kwargs["kwargs"],
                 headers={"Authorization": "Bearer " + self.configs.ACCESS_TOKEN},
             )
@@ -81,28 +83,28 @@ class ActiveDirectory:
 
 
 class Configs:
-    def __init__(self):
-        self.CONSUMER_KEY = CONSUMER_KEY
-        self.CONSUMER_SECRET = CONSUMER_SECRET
-        self.BASE_URL = "https://api.princeton.edu:443/active-directory/1.0.5"
+    # access tokens are requested over transport (this process's shared
+    # Transport if not given) and shared with other processes through db
+    # (see TokenCache)
+
+    def __init__(self, transport: Transport = None, db=None):
+        self._transport = transport if transport is not None else get_transport()
+        self.BASE_URL = OIT_BASE_URL + "/active-directory/1.0.5"
         self.USERS = "/users"
-        self.REFRESH_TOKEN_URL = "https://api.princeton.edu:443/token"
-        self._refreshToken(grant_type="client_credentials")
-
-    def _refreshToken(self, **kwargs):
-        req = requests.post(
-            self.REFRESH_TOKEN_URL,
-            data=kwargs,
-            headers={
-                "Authorization": "Basic "
-                + base64.b64encode(
-                    bytes(self.CONSUMER_KEY + ":" + self.CONSUMER_SECRET, "utf-8")
-                ).decode("utf-8")
-            },
-        )
-        text = req.text
-        response = json.loads(text)
-        self.ACCESS_TOKEN = response["access_token"]
+        self.REFRESH_TOKEN_URL = REFRESH_TOKEN_URL
+        self._tokens = TokenCache(db, self._transport, self.REFRESH_TOKEN_URL)
+
+    # the current access token (see TokenCache.get_token())
+
+    @property
+    def ACCESS_TOKEN(self):
+        return self._tokens.get_token()
+
+    # discards access token rejected_token after the API rejected it, so
+    # that ACCESS_TOKEN returns a new token
+
+    def _refreshToken(self, rejected_token):
+        self._tokens.invalidate(rejected_token)
 
 
 if __name__ == "__main__":
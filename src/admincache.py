@@ -0,0 +1,209 @@
+# ----------------------------------------------------------------------
+# admincache.py
+# Contains AdminCache, an in-process snapshot of the single admin
+# document (without its logs and live notifications status) that the admin-backed Database methods
+# (is_admin(), is_course_disabled(), get_current_term_code(), ...) read
+# instead of each querying the admin collection. A snapshot is kept for
+# up to ADMIN_CACHE_TTL_SECS seconds, is dropped by the admin writes of
+# this process, and, if ADMIN_CACHE_WATCH, is dropped as soon as any
+# process writes a cached field of the admin document (watched through a
+# change stream).
+# Key functions: get_admin_cache(), get_admin_cache_stats()
+# ----------------------------------------------------------------------
+
+import re
+from copy import deepcopy
+from os import getpid
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+from pymongo.errors import OperationFailure
+
+from config import ADMIN_CACHE_TTL_SECS, ADMIN_CACHE_WATCH
+from log_utils import *
+
+# admin document fields left out of the snapshot: the logs (only the
+# admin panel reads them) and the live notifications status (written
+# every second during a notifications window). writes to only these
+# fields do not drop the snapshot
+UNCACHED_FIELDS = ["logs", "live_notifs_status"]
+
+# error code of opening a change stream on a standalone server (no
+# replica set)
+CHANGE_STREAM_UNSUPPORTED_CODE = 40573
+
+# seconds to wait before watching the admin collection again after the
+# change stream failed
+WATCH_RETRY_SECS = 10
+
+
+class AdminCache:
+    # caches the admin document of the pymongo collection coll for up to
+    # ttl_secs seconds, and watches coll for changes if watch
+
+    def __init__(self, coll, ttl_secs=ADMIN_CACHE_TTL_SECS, watch=ADMIN_CACHE_WATCH):
+        self._coll = coll
+        self._ttl_secs = ttl_secs
+        self._watch = watch
+        self._doc = None
+        self._loaded_at = 0
+        self._generation = 0
+        self._lock = Lock()
+        self._stats = {"hits": 0, "reads": 0, "invalidations": 0}
+        self._watcher = None
+
+    # returns a copy of the admin document (without UNCACHED_FIELDS),
+    # reading it only if the snapshot is missing or expired
+
+    def get(self):
+        with self._lock:
+            if self._doc is not None and monotonic() - self._loaded_at < self._ttl_secs:
+                self._stats["hits"] += 1
+                return deepcopy(self._doc)
+            generation = self._generation
+            if self._watch and self._watcher is None:
+                self._watcher = Thread(
+                    target=self._run_watcher, name="admin-cache-watcher", daemon=True
+                )
+                self._watcher.start()
+
+        doc = self._coll.find_one({}, {"_id": 0, **{f: 0 for f in UNCACHED_FIELDS}})
+        with self._lock:
+            self._stats["reads"] += 1
+            # a snapshot read while the document was being changed may
+            # miss the change, so it is not kept
+            if generation == self._generation:
+                self._doc, self._loaded_at = doc, monotonic()
+        return deepcopy(doc)
+
+    # drops the snapshot, so that the next get() reads the document again
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._doc = None
+            self._stats["invalidations"] += 1
+
+    # returns {"hits", "reads", "invalidations"} counts and whether the
+    # admin collection is being watched
+
+    def get_stats(self):
+        with self._lock:
+            return {**self._stats, "watching": self._watcher is not None}
+
+    def _run_watcher(self):
+        while True:
+            try:
+                with self._coll.watch(watch_pipeline()) as stream:
+                    # changes made before the stream was opened are not
+                    # seen through it
+                    self.invalidate()
+                    for _ in stream:
+                        self.invalidate()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED_CODE:
+                    log_info(
+                        f"Admin document changes cannot be watched - cached for up to {self._ttl_secs:g}s"
+                    )
+                    with self._lock:
+                        self._watcher = None
+                        self._watch = False
+                    return
+                log_error(f"Failed to watch admin document changes: {e}")
+            except Exception as e:
+                log_error(f"Failed to watch admin document changes: {e}")
+            self.invalidate()
+            sleep(WATCH_RETRY_SECS)
+
+
+# returns the change stream pipeline of AdminCache, which leaves out the
+# updates that change only UNCACHED_FIELDS (or fields within them)
+def watch_pipeline():
+    uncached = "^(" + "|".join(re.escape(f) for f in UNCACHED_FIELDS) + ")(\\.|$)"
+    description = "$updateDescription"
+    changed_fields = {
+        "$concatArrays": [
+            {
+                "$map": {
+                    "input": {
+                        "$objectToArray": {
+                            "$ifNull": [f"{description}.updatedFields", {}]
+                        }
+                    },
+                    "in": "$$this.k",
+                }
+            },
+            {"$ifNull": [f"{description}.removedFields", []]},
+            {
+                "$map": {
+                    "input": {"$ifNull": [f"{description}.truncatedArrays", []]},
+                    "in": "$$this.field",
+                }
+            },
+        ]
+    }
+    return [
+        {
+            "$match": {
+                "$or": [
+                    {"operationType": {"$ne": "update"}},
+                    {
+                        "$expr": {
+                            "$gt": [
+                                {
+                                    "$size": {
+                                        "$filter": {
+                                            "input": changed_fields,
+                                            "cond": {
+                                                "$eq": [
+                                                    {
+                                                        "$regexMatch": {
+                                                            "input": "$$this",
+                                                            "regex": uncached,
+                                                        }
+                                                    },
+                                                    False,
+                                                ]
+                                            },
+                                        }
+                                    }
+                                },
+                                0,
+                            ]
+                        }
+                    },
+                ]
+            }
+        }
+    ]
+
+
+_caches = {}
+_caches_lock = Lock()
+_caches_pid = None
+
+
+# returns the AdminCache of this process for the pymongo collection coll,
+# creating it on first use (a forked process gets its own, since the
+# watcher thread does not survive a fork)
+def get_admin_cache(coll):
+    global _caches_pid
+    with _caches_lock:
+        if _caches_pid != getpid():
+            _caches.clear()
+            _caches_pid = getpid()
+        if coll.full_name not in _caches:
+            _caches[coll.full_name] = AdminCache(coll)
+        return _caches[coll.full_name]
+
+
+# returns the summed stats (see AdminCache.get_stats()) of all
+# AdminCaches of this process
+def get_admin_cache_stats():
+    res = {"hits": 0, "reads": 0, "invalidations": 0}
+    with _caches_lock:
+        caches = list(_caches.values()) if _caches_pid == getpid() else []
+    for cache in caches:
+        for key in res:
+            res[key] += cache.get_stats()[key]
+    return res
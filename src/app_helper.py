@@ -61,37 +61,16 @@ def update_user_settings(netid, request):
 # pulls most recent course info and returns dictionary with
 # course details and list with class info
 def pull_course(courseid, db: Database):
-    def generate_subs_stats_string(classid):
+    def generate_subs_stats_string(wl_size, subscribers):
         # "|" represents a newline character
-        waitlist_obj = db.get_class_waitlist(classid)
-
-        if not waitlist_obj or not waitlist_obj.get("waitlist"):
+        if wl_size == 0:
             fail_msg = "Failed to get data"
             return fail_msg, fail_msg
 
-        netids = waitlist_obj.get("waitlist")
-        users = db.get_users(netids)
-
-        netids = {}
-        for user in users:
-            try:
-                year = user["year"]
-                netid = user["netid"]
-            except:
-                continue
-
-            if not year:
-                year = "Other"
-
-            if year not in netids:
-                netids[year] = []
-
-            netids[year].append(netid)
-
-        years_fmt = [f"{year}: {len(users)}" for year, users in netids.items()]
+        years_fmt = [f"{year}: {len(users)}" for year, users in subscribers.items()]
         years_fmt_admin = [
             f"{year}: {len(users)} ({', '.join(users)})"
-            for year, users in netids.items()
+            for year, users in subscribers.items()
         ]
 
         years_fmt.sort()
@@ -103,12 +82,14 @@ def pull_course(courseid, db: Database):
 
         return "|".join(years_fmt), "|".join(years_fmt_admin)
 
-    if courseid is None or courseid == "" or db.get_course(courseid) is None:
+    if courseid is None or courseid == "":
         return None, None
 
     # updates course info if it has been 2 minutes since last update
     Monitor(db).pull_course_updates(courseid)
-    course = db.get_course_with_enrollment(courseid)
+    course = db.get_course_view(courseid)
+    if course is None:
+        return None, None
 
     # split course data into basic course details, and list of classes
     # with enrollmemnt data
@@ -117,23 +98,14 @@ def pull_course(courseid, db: Database):
     for key in course.keys():
         if key.startswith("class_"):
             curr_class = course[key]
-            classid = curr_class["classid"]
-            try:
-                waitlist_count = db.get_class_waitlist_size(classid)
-            except Exception:
-                waitlist_count = 0
-            try:
-                time_of_last_notif = db.get_time_of_last_notif(classid)
-            except Exception:
-                time_of_last_notif = None
-            curr_class["wl_size"] = waitlist_count
-            curr_class["time_of_last_notif"] = (
-                time_of_last_notif if time_of_last_notif is not None else "-"
-            )
+            if curr_class["time_of_last_notif"] is None:
+                curr_class["time_of_last_notif"] = "-"
             (
                 curr_class["subs_stats"],
                 curr_class["subs_stats_admin"],
-            ) = generate_subs_stats_string(classid)
+            ) = generate_subs_stats_string(
+                curr_class["wl_size"], curr_class.pop("subscribers")
+            )
             classes_list.append(curr_class)
         else:
             course_details[key] = course[key]
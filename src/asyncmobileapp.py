@@ -0,0 +1,134 @@
+# ----------------------------------------------------------------------
+# asyncmobileapp.py
+# Contains AsyncMobileApp, an asyncio variant of MobileApp used by the
+# notifications cycle to keep many MobileApp API requests in flight at
+# once. It shares the access token (TokenCache) and the circuit breaker,
+# retry policy, and stats (Transport) of the sync client, which remains
+# the client used by the web app.
+# ----------------------------------------------------------------------
+
+import asyncio
+import json
+from time import time
+
+import aiohttp
+
+from config import OIT_POOL_MAXSIZE
+from database import Database
+from mobileapp import Configs
+from transport import get_timeout, get_transport
+
+
+class AsyncMobileApp:
+    # db is the Database used for logging (a new one if not given). the
+    # aiohttp session is created on first use and must be closed with
+    # close() from the same event loop
+
+    def __init__(self, db: Database = None):
+        self._transport = get_transport()
+        self._db = db if db is not None else Database()
+        self.configs = Configs(self._transport, self._db)
+        self._session = None
+
+    # async version of MobileApp.get_seats()
+
+    async def get_seats(self, **kwargs):
+        kwargs["fmt"] = "json"
+        return await self._getJSON(self.configs.COURSE_SEATS, **kwargs)
+
+    # async version of MobileApp.get_courses()
+
+    async def get_courses(self, **kwargs):
+        kwargs["fmt"] = "json"
+        return await self._getJSON(self.configs.COURSE_COURSES, **kwargs)
+
+    # async version of MobileApp.get_terms()
+
+    async def get_terms(self):
+        return await self._getJSON(self.configs.COURSE_TERMS, fmt="json")
+
+    # closes the aiohttp session (and its pooled connections)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # async version of MobileApp._getJSON(). the access token is fetched
+    # and the system log is written in worker threads so that they do not
+    # block the event loop
+
+    async def _getJSON(self, endpoint, **kwargs):
+        params = kwargs if "kwargs" not in kwargs else kwargs["kwargs"]
+        tic = time()
+        access_token = await asyncio.to_thread(lambda: self.configs.ACCESS_TOKEN)
+        text = await self._get(endpoint, params, access_token)
+
+        await asyncio.to_thread(
+            self._db._add_system_log,
+            "mobileapp",
+            {
+                "message": "MobileApp API query",
+                "response_time": time() - tic,
+                "endpoint": endpoint,
+                "args": kwargs,
+            },
+            print_=False,
+        )
+
+        # Check to see if the response failed due to invalid credentials
+        if text.startswith("<ams:fault"):
+            await asyncio.to_thread(self.configs._refreshToken, access_token)
+
+            # Redo the request with the new access token
+            access_token = await asyncio.to_thread(lambda: self.configs.ACCESS_TOKEN)
+            text = await self._get(endpoint, params, access_token)
+
+        return json.loads(text)
+
+    # sends a GET request to endpoint and returns the response text,
+    # following the same timeout, retry, and circuit breaker rules as
+    # Transport.request() (see Transport.after_attempt())
+
+    async def _get(self, endpoint, params, access_token):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=OIT_POOL_MAXSIZE)
+            )
+        connect_timeout, read_timeout = get_timeout(endpoint)
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self._transport.before_request()
+
+        attempt = 0
+        while True:
+            tic = time()
+            status, retry_after, error = None, None, None
+            try:
+                async with self._session.get(
+                    self.configs.BASE_URL + endpoint,
+                    params=params,
+                    headers={"Authorization": "Bearer " + access_token},
+                    timeout=timeout,
+                ) as res:
+                    status = res.status
+                    retry_after = res.headers.get("Retry-After")
+                    text = await res.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            delay = self._transport.after_attempt(
+                endpoint,
+                attempt,
+                time() - tic,
+                status=status,
+                retry_after=retry_after,
+                error=error,
+            )
+            if delay is None:
+                if error is not None:
+                    raise error
+                return text
+
+            attempt += 1
+            await asyncio.sleep(delay)
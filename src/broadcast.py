@@ -0,0 +1,110 @@
+# ----------------------------------------------------------------------
+# broadcast.py
+# Sends an announcement email (see _email_all_users.py) to many users:
+# recipients are batched BROADCAST_BATCH_SIZE at a time into one
+# SendGrid request (a personalization per recipient, so that they do not
+# see each other), and up to BROADCAST_MAX_WORKERS batches are sent at
+# once through the rate-limited SendGrid client (see providers.py). The
+# recipients sent to are checkpointed in the broadcasts collection, so
+# sending the same announcement (subject and message) again resumes an
+# interrupted run with the recipients not yet sent to.
+# Key function: send_broadcast()
+# ----------------------------------------------------------------------
+
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from hashlib import sha1
+
+from config import BROADCAST_BATCH_SIZE, BROADCAST_MAX_WORKERS, TS_EMAIL
+from database import Database
+from log_utils import *
+from notify import send_email
+
+BROADCAST_TEMPLATE_ID = "d-e688d68d1bac424382aa8535026d6f36"
+
+
+# returns the send_email() request data of each batch of at most
+# batch_size of emails
+def broadcast_batches(subject, message, emails, batch_size=BROADCAST_BATCH_SIZE):
+    return [
+        {
+            "personalizations": [
+                {
+                    "to": [{"email": email}],
+                    "dynamic_template_data": {"subject": subject, "message": message},
+                }
+                for email in emails[i : i + batch_size]
+            ],
+            "from": {"email": TS_EMAIL, "name": "TigerSnatch"},
+            "template_id": BROADCAST_TEMPLATE_ID,
+        }
+        for i in range(0, len(emails), batch_size)
+    ]
+
+
+# returns the id of the broadcast of subject and message, under which its
+# progress is checkpointed
+def broadcast_id(subject, message):
+    return sha1(json.dumps([subject, message]).encode()).hexdigest()
+
+
+# sends the announcement subject and message to emails, skipping the
+# recipients it was already sent to by an earlier run if db is given (and
+# checkpointing the recipients sent to in it). if dry_run, only reports
+# the requests that would be sent. returns the number of emails sent (or
+# that would be sent) and the list of emails that could not be sent
+def send_broadcast(
+    subject,
+    message,
+    emails,
+    db: Database = None,
+    dry_run=False,
+    batch_size=BROADCAST_BATCH_SIZE,
+    max_workers=BROADCAST_MAX_WORKERS,
+):
+    emails = sorted(set(emails))
+    id_ = broadcast_id(subject, message)
+
+    done = set()
+    if db is not None:
+        checkpoint = db.get_broadcast(id_)
+        if checkpoint is not None:
+            done = set(checkpoint["sent_emails"])
+    # batches are built from the remaining recipients only, so users added
+    # or removed since the interrupted run do not shift them
+    pending = [email for email in emails if email not in done]
+    batches = broadcast_batches(subject, message, pending, batch_size)
+
+    log_info(
+        f"Broadcast {id_[:8]}: {len(emails)} recipients, {len(emails) - len(pending)} already sent, {len(pending)} to send in {len(batches)} requests of up to {batch_size} with {max_workers} at once"
+    )
+    if dry_run:
+        return len(pending), []
+
+    if db is not None:
+        db.start_broadcast(id_, subject, len(emails))
+
+    n_sent, failed = 0, []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(send_email, batch): i for i, batch in enumerate(batches)}
+        for future in as_completed(futures):
+            i = futures[future]
+            recipients = [p["to"][0]["email"] for p in batches[i]["personalizations"]]
+            message_ids = future.result()
+            batch_sent, batch_failed = [], []
+            for email, message_id in zip(recipients, message_ids):
+                (batch_failed if message_id is None else batch_sent).append(email)
+            n_sent += len(batch_sent)
+            failed.extend(batch_failed)
+            log_info(
+                f"Broadcast {id_[:8]}: request {i + 1}/{len(batches)} sent to {len(batch_sent)}/{len(recipients)} recipients"
+            )
+
+            # recipients not sent to (e.g. SendGrid being down) are sent
+            # to again by the next run
+            if db is not None and len(batch_sent) > 0:
+                db.add_broadcast_emails(id_, batch_sent)
+
+    if db is not None and len(failed) == 0:
+        db.finish_broadcast(id_)
+    return n_sent, failed
@@ -12,6 +12,11 @@ TS_DOMAIN = environ["TS_DOMAIN"]
 # primary MongoDB server connection string
 DB_CONNECTION_STR = environ["DB_CONNECTION_STR"]
 
+# max and min number of pooled connections to the MongoDB server per
+# process (all Database objects of a process share one client)
+DB_MAX_POOL_SIZE = int(getenv("DB_MAX_POOL_SIZE", "50"))
+DB_MIN_POOL_SIZE = int(getenv("DB_MIN_POOL_SIZE", "0"))
+
 # set of collections that are in a proper tigersnatch database
 COLLECTIONS = {
     "mappings",
@@ -26,10 +31,47 @@ COLLECTIONS = {
     "api_keys",
 }
 
+# collections that are created on first use, so they may be missing from
+# a proper tigersnatch database
+LAZY_COLLECTIONS = {
+    "tokens",
+    "metrics",
+    "outbox",
+    "deliveries",
+    "broadcasts",
+}
+
 # MobileApp keys
 CONSUMER_KEY = environ["CONSUMER_KEY"]
 CONSUMER_SECRET = environ["CONSUMER_SECRET"]
 
+# OIT API OAuth tokens are refreshed this many seconds before they expire.
+# a process refreshing the shared token holds a lock for at most
+# TOKEN_REFRESH_LOCK_SECS seconds, during which other processes wait for
+# the new token instead of requesting their own
+TOKEN_REFRESH_MARGIN_SECS = int(getenv("TOKEN_REFRESH_MARGIN_SECS", "300"))
+TOKEN_REFRESH_LOCK_SECS = int(getenv("TOKEN_REFRESH_LOCK_SECS", "10"))
+
+# base URL of the Princeton OIT APIs (overridable to point the API clients
+# at a local fake server, e.g. for benchmarks)
+OIT_BASE_URL = getenv("OIT_BASE_URL", "https://api.princeton.edu:443")
+
+# HTTP layer for the OIT APIs (see transport.py): max number of pooled
+# keep-alive connections per host, connect timeout, default read timeout
+# (endpoints may override it in transport.py), number of retries of
+# 5xx/429 responses and connection errors (with jittered exponential
+# backoff between OIT_BACKOFF_BASE_SECS and OIT_BACKOFF_MAX_SECS), and the
+# number of consecutive failed requests after which all requests fail
+# fast for OIT_CIRCUIT_RESET_SECS seconds
+OIT_POOL_MAXSIZE = int(getenv("OIT_POOL_MAXSIZE", "10"))
+OIT_CONNECT_TIMEOUT_SECS = float(getenv("OIT_CONNECT_TIMEOUT_SECS", "3.05"))
+OIT_READ_TIMEOUT_SECS = float(getenv("OIT_READ_TIMEOUT_SECS", "10"))
+OIT_MAX_RETRIES = int(getenv("OIT_MAX_RETRIES", "2"))
+OIT_BACKOFF_BASE_SECS = float(getenv("OIT_BACKOFF_BASE_SECS", "0.5"))
+OIT_BACKOFF_MAX_SECS = float(getenv("OIT_BACKOFF_MAX_SECS", "8"))
+OIT_CIRCUIT_FAILURE_THRESHOLD = int(getenv("OIT_CIRCUIT_FAILURE_THRESHOLD", "5"))
+OIT_CIRCUIT_RESET_SECS = float(getenv("OIT_CIRCUIT_RESET_SECS", "30"))
+
 # CAS key
 APP_SECRET_KEY = environ["APP_SECRET_KEY"]
 
@@ -63,6 +105,15 @@ STATS_INTERVAL_MINS = int(environ["STATS_INTERVAL_MINS"])
 # maximum number of sections a user can be on waitlists for
 MAX_WAITLIST_SIZE = int(environ["MAX_WAITLIST_SIZE"])
 
+# if SUBSCRIPTION_TRANSACTIONS, the writes of a subscribe or unsubscribe
+# (users, waitlists, and notifs documents) are made in one multi-document
+# transaction, which needs a replica set such as MongoDB Atlas
+SUBSCRIPTION_TRANSACTIONS = getenv("SUBSCRIPTION_TRANSACTIONS", "False").lower() in (
+    "true",
+    "1",
+    "t",
+)
+
 # maximum number of entries in custom user logs
 MAX_LOG_LENGTH = MAX_WAITLIST_SIZE * 2
 
@@ -80,11 +131,119 @@ MIN_NOTIFS_DELAY_MINS = int(environ["MIN_NOTIFS_DELAY_MINS"])
 # specific section (saves a lot of money for inactive/unresponsive users)
 MAX_AUTO_RESUB_NOTIFS = int(environ["MAX_AUTO_RESUB_NOTIFS"])
 
+# number of courseIDs sent in each MobileApp courses/seats request, the
+# number of such requests that may be in flight at once, and the number of
+# times a failed request is retried before its courses are skipped for the
+# current notifications cycle (the only retries of courses/seats requests:
+# see transport.ENDPOINT_MAX_RETRIES)
+SEATS_CHUNK_SIZE = int(getenv("SEATS_CHUNK_SIZE", "50"))
+SEATS_MAX_WORKERS = int(getenv("SEATS_MAX_WORKERS", "4"))
+SEATS_CHUNK_RETRIES = int(getenv("SEATS_CHUNK_RETRIES", "2"))
+SEATS_RETRY_DELAY_SECS = float(getenv("SEATS_RETRY_DELAY_SECS", "1"))
+
+# whether notifications cycles use the asyncio MobileApp client (see
+# asyncmobileapp.py), and the max number of courses/seats requests it
+# keeps in flight at once
+ASYNC_NOTIFS_CYCLE = getenv("ASYNC_NOTIFS_CYCLE", "False").lower() in (
+    "true",
+    "1",
+    "t",
+)
+SEATS_MAX_IN_FLIGHT = int(getenv("SEATS_MAX_IN_FLIGHT", "8"))
+
+# per-phase traces of notifications cycles (see cycletrace.py) are kept in
+# the metrics collection for this many days. the admin panel performance
+# summary reports percentiles over the last METRICS_SUMMARY_CYCLES cycles
+METRICS_TTL_DAYS = int(getenv("METRICS_TTL_DAYS", "14"))
+METRICS_SUMMARY_CYCLES = int(getenv("METRICS_SUMMARY_CYCLES", "500"))
+
 # Twilio SMS
 TWILIO_PHONE = environ["TWILIO_PHONE"]
 TWILIO_SID = environ["TWILIO_SID"]
 TWILIO_TOKEN = environ["TWILIO_TOKEN"]
 
+# max number of notification emails (SendGrid) and text messages (Twilio)
+# being sent at once by the notifs dyno (see delivery.py)
+EMAIL_MAX_WORKERS = int(getenv("EMAIL_MAX_WORKERS", "16"))
+SMS_MAX_WORKERS = int(getenv("SMS_MAX_WORKERS", "4"))
+
+# base URLs of the SendGrid and Twilio APIs (overridable to point the
+# provider clients at local fake servers, e.g. for benchmarks)
+SENDGRID_BASE_URL = getenv("SENDGRID_BASE_URL", "https://api.sendgrid.com")
+TWILIO_BASE_URL = getenv("TWILIO_BASE_URL", "https://api.twilio.com")
+
+# timeout in seconds of SendGrid and Twilio requests
+PROVIDER_TIMEOUT_SECS = float(getenv("PROVIDER_TIMEOUT_SECS", "20"))
+
+# sends per second (on average, up to *_BURST at once) allowed through
+# each SendGrid and Twilio account by each process (0 for no limit). a
+# request throttled by the provider pauses sending through its account
+# for its Retry-After (or PROVIDER_THROTTLE_BACKOFF_SECS seconds if not
+# given) and is retried up to PROVIDER_THROTTLE_RETRIES times
+SENDGRID_RATE_PER_SEC = float(getenv("SENDGRID_RATE_PER_SEC", "50"))
+SENDGRID_BURST = int(getenv("SENDGRID_BURST", "100"))
+TWILIO_RATE_PER_SEC = float(getenv("TWILIO_RATE_PER_SEC", "10"))
+TWILIO_BURST = int(getenv("TWILIO_BURST", "10"))
+PROVIDER_THROTTLE_RETRIES = int(getenv("PROVIDER_THROTTLE_RETRIES", "5"))
+PROVIDER_THROTTLE_BACKOFF_SECS = float(getenv("PROVIDER_THROTTLE_BACKOFF_SECS", "5"))
+
+# notifications are stored in the outbox collection before they are sent
+# (see outbox.py). if OUTBOX_INLINE_DELIVERY, the notifs dyno sends them
+# at the end of each notifications cycle; otherwise they are left to
+# outbox worker dynos (send_outbox_worker.py). workers claim up to
+# OUTBOX_CLAIM_BATCH messages at a time for OUTBOX_LEASE_SECS seconds. a
+# failed message is retried after OUTBOX_RETRY_DELAY_SECS seconds
+# (doubling per attempt, up to OUTBOX_RETRY_MAX_DELAY_SECS) and is
+# dead-lettered after OUTBOX_MAX_ATTEMPTS attempts. sent and dead messages
+# are kept for OUTBOX_RETENTION_DAYS days
+OUTBOX_INLINE_DELIVERY = getenv("OUTBOX_INLINE_DELIVERY", "True").lower() in (
+    "true",
+    "1",
+    "t",
+)
+OUTBOX_CLAIM_BATCH = int(getenv("OUTBOX_CLAIM_BATCH", "200"))
+OUTBOX_LEASE_SECS = int(getenv("OUTBOX_LEASE_SECS", "120"))
+OUTBOX_MAX_ATTEMPTS = int(getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_DELAY_SECS = int(getenv("OUTBOX_RETRY_DELAY_SECS", "30"))
+OUTBOX_RETRY_MAX_DELAY_SECS = int(getenv("OUTBOX_RETRY_MAX_DELAY_SECS", "1800"))
+OUTBOX_RETENTION_DAYS = int(getenv("OUTBOX_RETENTION_DAYS", "7"))
+
+# announcement emails to all users (see broadcast.py) are sent to
+# BROADCAST_BATCH_SIZE users per SendGrid request (at most 1000), with up
+# to BROADCAST_MAX_WORKERS requests in flight
+BROADCAST_BATCH_SIZE = int(getenv("BROADCAST_BATCH_SIZE", "500"))
+BROADCAST_MAX_WORKERS = int(getenv("BROADCAST_MAX_WORKERS", "4"))
+
+# system log events are written in the background (see systemlog.py),
+# SYSTEM_LOG_BATCH_SIZE at a time or at least every SYSTEM_LOG_FLUSH_SECS
+# seconds. events beyond SYSTEM_LOG_MAX_QUEUE waiting to be written are
+# dropped
+SYSTEM_LOG_BATCH_SIZE = int(getenv("SYSTEM_LOG_BATCH_SIZE", "100"))
+SYSTEM_LOG_FLUSH_SECS = float(getenv("SYSTEM_LOG_FLUSH_SECS", "2"))
+SYSTEM_LOG_MAX_QUEUE = int(getenv("SYSTEM_LOG_MAX_QUEUE", "10000"))
+
+# the admin document is cached per process (see admincache.py) for up to
+# ADMIN_CACHE_TTL_SECS seconds. if ADMIN_CACHE_WATCH, the cache is also
+# dropped as soon as any process changes the document (through a change
+# stream, which needs a replica set such as MongoDB Atlas)
+ADMIN_CACHE_TTL_SECS = float(getenv("ADMIN_CACHE_TTL_SECS", "5"))
+ADMIN_CACHE_WATCH = getenv("ADMIN_CACHE_WATCH", "True").lower() in (
+    "true",
+    "1",
+    "t",
+)
+
+# the delivery of each notification to each recipient is recorded in the
+# deliveries collection (see outbox.py) for DELIVERY_RETENTION_DAYS days.
+# a notification of the same open spots in a class to the same user is
+# not sent again within DELIVERY_DEDUPE_WINDOW_SECS seconds (e.g. by
+# overlapping cycles). the admin panel summarizes the deliveries of the
+# last DELIVERY_STATS_HOURS hours
+DELIVERY_RETENTION_DAYS = int(getenv("DELIVERY_RETENTION_DAYS", "14"))
+DELIVERY_DEDUPE_WINDOW_SECS = int(getenv("DELIVERY_DEDUPE_WINDOW_SECS", "60"))
+DELIVERY_STATS_HOURS = int(getenv("DELIVERY_STATS_HOURS", "24"))
+OUTBOX_POLL_SECS = int(getenv("OUTBOX_POLL_SECS", "2"))
+
 # offset in minutes that is added to all provided notifications start times
 # (this was an OIT request to alleviate load on endpoints during the first few minutes of enrollment)
 OIT_NOTIFS_OFFSET_MINS = int(environ["OIT_NOTIFS_OFFSET_MINS"])
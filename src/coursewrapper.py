@@ -6,13 +6,27 @@
 
 
 class CourseWrapper:
-    def __init__(self, course_deptnum, new_enroll, new_cap, courseid, db):
-        self._db = db
+    # prev_enrollments maps classids to their previous enrollments and
+    # is only used if the course has reserved seats. updates to previous
+    # enrollments are queued in write_buffer (a WriteBuffer)
+
+    def __init__(
+        self,
+        course_deptnum,
+        new_enroll,
+        new_cap,
+        courseid,
+        has_reserved_seats,
+        prev_enrollments,
+        write_buffer,
+    ):
+        self._write_buffer = write_buffer
         self._course_deptnum = course_deptnum
         self._new_enroll = new_enroll
         self._new_cap = new_cap
         self._courseid = courseid
-        self._has_reserved_seats = self._db.does_course_have_reserved_seats(courseid)
+        self._has_reserved_seats = has_reserved_seats
+        self._prev_enrollments = prev_enrollments
         self._compute_available_slots()
 
     # returns _course_deptnum
@@ -42,12 +56,9 @@ class CourseWrapper:
                         d = 0
                     else:
                         # spot openings = previous enrollment - new enrollment
-                        d = (
-                            self._db.get_prev_enrollment_RESERVED_SEATS_ONLY(k)
-                            - self._new_enroll[k]
-                        )
+                        d = self._prev_enrollments.get(k, 0) - self._new_enroll[k]
                     # update (rolling) previous enrollment with new enrollment
-                    self._db.update_prev_enrollment_RESERVED_SEATS_ONLY(
+                    self._write_buffer.update_prev_enrollment_RESERVED_SEATS_ONLY(
                         k, self._new_enroll[k]
                     )
                 else:
@@ -58,7 +69,7 @@ class CourseWrapper:
 
             diff[k] = max(d, 0)
 
-        self._db = None
+        self._write_buffer = None
         self._available_slots = diff
 
     # string representation; prints _course_deptnum, classids, and all
@@ -81,11 +92,11 @@ class CourseWrapper:
 if __name__ == "__main__":
     new_enroll = {"40268": 9}
     new_cap = {"40268": 10}
-    course = CourseWrapper("COS126", new_enroll, new_cap, "002054")
+    course = CourseWrapper("COS126", new_enroll, new_cap, "002054", False, {}, None)
     print(course, end="")
 
     new_enroll = {"40268": 10}
-    course1 = CourseWrapper("COS126", new_enroll, new_cap, "002054")
+    course1 = CourseWrapper("COS126", new_enroll, new_cap, "002054", False, {}, None)
     print(course1, end="")
     print(course, end="")
     print(course, end="")
@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------
+# cycletrace.py
+# Contains CycleTrace, a class that records structured spans for the
+# phases of a notifications cycle (duration, item counts, and the number
+# of database commands and HTTP requests made during each phase), and
+# the process-wide counters those call counts are taken from.
+# ----------------------------------------------------------------------
+
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+from time import time
+
+import pytz
+from bson import ObjectId
+from pymongo import monitoring
+
+TZ = pytz.timezone("US/Eastern")
+
+
+# counts the commands sent by every MongoClient it is registered with
+# (see Database.__init__())
+class DBCommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = Lock()
+        self.n_commands = 0
+
+    def started(self, event):
+        with self._lock:
+            self.n_commands += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+DB_COMMAND_COUNTER = DBCommandCounter()
+
+_http_lock = Lock()
+_n_http_requests = 0
+
+
+# records that an HTTP request was sent (called by the HTTP clients, e.g.
+# Transport)
+def record_http_request():
+    global _n_http_requests
+    with _http_lock:
+        _n_http_requests += 1
+
+
+def get_http_request_count():
+    return _n_http_requests
+
+
+class CycleTrace:
+    # cycle_id uniquely identifies the traced cycle
+
+    def __init__(self):
+        self.cycle_id = str(ObjectId())
+        self._time = datetime.now(TZ)
+        self._tic = time()
+        self._spans = []
+
+    # context manager that records a span named name around its body and
+    # yields a dictionary of item counts to fill in. database commands
+    # and HTTP requests are counted process-wide, so calls made by other
+    # threads during the span are included
+
+    @contextmanager
+    def span(self, name):
+        counts = {}
+        tic = time()
+        n_db = DB_COMMAND_COUNTER.n_commands
+        n_http = get_http_request_count()
+        try:
+            yield counts
+        finally:
+            self._spans.append(
+                {
+                    "name": name,
+                    "duration_secs": time() - tic,
+                    "counts": counts,
+                    "db_calls": DB_COMMAND_COUNTER.n_commands - n_db,
+                    "http_calls": get_http_request_count() - n_http,
+                }
+            )
+
+    # returns the number of seconds since the traced cycle started
+
+    def elapsed(self):
+        return time() - self._tic
+
+    # returns the trace as a metrics collection document. meta is stored
+    # alongside the spans
+
+    def to_doc(self, **meta):
+        doc = {
+            "cycle_id": self.cycle_id,
+            "time": self._time,
+            "duration_secs": time() - self._tic,
+            "spans": self._spans,
+        }
+        doc.update(meta)
+        return doc
@@ -1,58 +1,116 @@
 # ----------------------------------------------------------------------
 # database.py
 # Contains Database, a class used to communicate with the TigerSnatch
-# database.
+# database. All Database objects of a process share one MongoClient (and
+# so one connection pool).
 # ----------------------------------------------------------------------
 
 import re
 from datetime import datetime, timedelta
+from os import getpid
 from random import randint
 from sys import stderr, stdout
+from threading import Lock
+from time import time
 
 import certifi
 import heroku3
 import pytz
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from bson import ObjectId
+from pymongo import InsertOne, MongoClient, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
 
 from activedirectory import ActiveDirectory
+from admincache import get_admin_cache, get_admin_cache_stats
 from config import (
     COLLECTIONS,
     DB_CONNECTION_STR,
+    DB_MAX_POOL_SIZE,
+    DB_MIN_POOL_SIZE,
+    DELIVERY_DEDUPE_WINDOW_SECS,
+    DELIVERY_STATS_HOURS,
     HEROKU_API_KEY,
     HEROKU_APP_NAME,
+    LAZY_COLLECTIONS,
     MAX_ADMIN_LOG_LENGTH,
     MAX_AUTO_RESUB_NOTIFS,
     MAX_LOG_LENGTH,
     MAX_WAITLIST_SIZE,
+    METRICS_SUMMARY_CYCLES,
     NOTIFS_INTERVAL_SECS,
+    OUTBOX_LEASE_SECS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETENTION_DAYS,
+    SUBSCRIPTION_TRANSACTIONS,
     TS_DOMAIN,
 )
+from cycletrace import DB_COMMAND_COUNTER
 from log_utils import *
 from schema import CLASS_SCHEMA, COURSES_SCHEMA, ENROLLMENTS_SCHEMA, MAPPINGS_SCHEMA
+from systemlog import get_system_log_stats, get_system_log_writer
 
 TZ = pytz.timezone("US/Eastern")
 
 
+_client = None
+_client_pid = None
+_client_lock = Lock()
+
+
+# returns the TigerSnatch MongoDB database through the MongoClient shared
+# by all Database objects of this process. the client is created (and the
+# server and the database's collections are checked) on first use, and
+# again in a forked process, since a MongoClient must not be used across
+# a fork. commands sent are counted by DB_COMMAND_COUNTER (see
+# cycletrace.py). indexes are created by _ensure_indexes.py, the release
+# step of every deploy (see Procfile), not here
+def _get_shared_db():
+    global _client, _client_pid
+    if _client_pid == getpid():
+        return _client.tigersnatch
+
+    with _client_lock:
+        if _client_pid != getpid():
+            client = MongoClient(
+                DB_CONNECTION_STR,
+                serverSelectionTimeoutMS=5000,
+                maxIdleTimeMS=600000,
+                maxPoolSize=DB_MAX_POOL_SIZE,
+                minPoolSize=DB_MIN_POOL_SIZE,
+                tlsCAFile=certifi.where(),
+                event_listeners=[DB_COMMAND_COUNTER],
+            )
+
+            try:
+                client.admin.command("ismaster")
+            except ConnectionFailure:
+                log_error("Failed (server not available)")
+                raise Exception("server unavailable")
+
+            _check_basic_integrity(client.tigersnatch)
+            _client, _client_pid = client, getpid()
+    return _client.tigersnatch
+
+
 class Database:
-    # creates a reference to the TigerSnatch MongoDB database
+    # creates a reference to the TigerSnatch MongoDB database. Database
+    # objects are cheap: they all share the MongoClient of the process
+    # (see _get_shared_db())
 
     def __init__(self):
-        self._db = MongoClient(
-            DB_CONNECTION_STR,
-            serverSelectionTimeoutMS=5000,
-            maxIdleTimeMS=600000,
-            tlsCAFile=certifi.where(),
-        )
+        _get_shared_db()
 
-        try:
-            self._db.admin.command("ismaster")
-        except ConnectionFailure:
-            log_error("Failed (server not available)")
-            raise Exception("server unavailable")
+    # the pymongo database that queries run against (the shared one
+    # unless set, e.g. to a scratch database for benchmarks)
 
-        self._db = self._db.tigersnatch
-        self._check_basic_integrity()
+    @property
+    def _db(self):
+        db = self.__dict__.get("_db")
+        return db if db is not None else _get_shared_db()
+
+    @_db.setter
+    def _db(self, db):
+        self.__dict__["_db"] = db
 
     """
     Retired Trades method
@@ -139,7 +197,7 @@ class Database:
             log_error(f"{courseid} is an invalid courseID")
             return False
         try:
-            self._db.admin.update_one({}, {"$addToSet": {"disabled_courses": courseid}})
+            self._update_admin({"$addToSet": {"disabled_courses": courseid}})
             self.clear_course_waitlists(courseid, "SYSTEM_AUTO")
             return True
         except:
@@ -152,7 +210,7 @@ class Database:
             log_error(f"{courseid} is an invalid courseID")
             return False
         try:
-            self._db.admin.update_one({}, {"$pull": {"disabled_courses": courseid}})
+            self._update_admin({"$pull": {"disabled_courses": courseid}})
             return True
         except:
             log_error(
@@ -167,8 +225,7 @@ class Database:
             log_system(log)
         log = f"{(datetime.now(TZ)).strftime('%b %d, %Y @ %-I:%M %p ET')} \u2192 {log}"
 
-        self._db.admin.update_one(
-            {},
+        self._update_admin(
             {
                 "$push": {
                     "logs": {
@@ -183,7 +240,7 @@ class Database:
     # check if netid is an admin is defined in the database
 
     def is_admin(self, netid):
-        return netid in self._db.admin.find_one({}, {"admins": 1, "_id": 0})["admins"]
+        return netid in self._get_admin()["admins"]
 
     # returns MAX_ADMIN_LOG_LENGTH most recent admin logs
 
@@ -193,7 +250,7 @@ class Database:
     # returns dictionary with all admin data (excluding logs)
 
     def get_admin_data(self):
-        return self._db.admin.find_one({}, {"logs": 0, "_id": 0})
+        return self._get_admin()
 
     # returns dictionary with app-related data
 
@@ -219,7 +276,7 @@ class Database:
 
         try:
             new_status = "on" if status else "off"
-            self._db.admin.update_one({}, {"$set": {"notifs_status": new_status}})
+            self._update_admin({"$set": {"notifs_status": new_status}})
             if log:
                 self._add_admin_log(f"notification script is now {new_status}")
             self._add_system_log(
@@ -234,12 +291,9 @@ class Database:
 
     def get_cron_notification_status(self):
         try:
-            data = self._db.admin.find_one(
-                {}, {"notifs_status": 1, "live_notifs_status": 1, "_id": 0}
-            )
             return (
-                data["notifs_status"] == "on"
-                and data["live_notifs_status"]["state"] != "inactive"
+                self._get_admin()["notifs_status"] == "on"
+                and self._get_live_notifs_status()["state"] != "inactive"
             )
         except:
             raise Exception('ensure that key "notifs_status" is in admin collection')
@@ -248,9 +302,7 @@ class Database:
 
     def did_notifs_spreadsheet_change(self, data):
         tz = pytz.timezone("UTC")
-        curr = self._db.admin.find_one({}, {"notifs_schedule": 1, "_id": 0})[
-            "notifs_schedule"
-        ]
+        curr = self._get_admin()["notifs_schedule"]
         curr = [[tz.localize(pair[0]), tz.localize(pair[1])] for pair in curr]
 
         if len(curr) != len(data):
@@ -267,9 +319,7 @@ class Database:
     def get_current_or_next_notifs_interval(self, fmt="%-m/%-d @ %-I:%M %p"):
         tz_utc = pytz.timezone("UTC")
         tz_et = pytz.timezone("US/Eastern")
-        curr = self._db.admin.find_one({}, {"notifs_schedule": 1, "_id": 0})[
-            "notifs_schedule"
-        ]
+        curr = self._get_admin()["notifs_schedule"]
         if len(curr) == 0:
             return "Next notifications period isn't scheduled. Notify a TigerApps member if this isn't fixed soon!"
         start, end = tz_utc.localize(curr[0][0]), tz_utc.localize(curr[0][1])
@@ -286,7 +336,7 @@ class Database:
     # updates notifs_schedule entry in admin collection
 
     def update_notifs_schedule(self, data):
-        self._db.admin.update_one({}, {"$set": {"notifs_schedule": data}})
+        self._update_admin({"$set": {"notifs_schedule": data}})
 
     # clears and removes users from the waitlist for class classid
 
@@ -361,7 +411,9 @@ class Database:
                 self._add_admin_log(f"user {netid} does not exist - cannot be blocked")
                 return False
 
-            blacklist = self.get_blacklist()
+            blacklist = self._db.admin.find_one({}, {"blacklist": 1, "_id": 0})[
+                "blacklist"
+            ]
 
             # check if user is already in blacklist
             if netid in blacklist:
@@ -372,7 +424,7 @@ class Database:
                 remove_user(netid)
 
             blacklist.append(netid)
-            self._db.admin.update_one({}, {"$set": {"blacklist": blacklist}})
+            self._update_admin({"$set": {"blacklist": blacklist}})
             self._add_admin_log(f"user {netid} blocked and removed from database")
 
             self._add_system_log(
@@ -391,13 +443,15 @@ class Database:
 
     def remove_from_blacklist(self, netid, admin_netid):
         try:
-            blacklist = self.get_blacklist()
+            blacklist = self._db.admin.find_one({}, {"blacklist": 1, "_id": 0})[
+                "blacklist"
+            ]
             if netid not in blacklist:
                 self._add_admin_log(f"user {netid} not blocked - not removed")
                 return False
 
             blacklist.remove(netid)
-            self._db.admin.update_one({}, {"$set": {"blacklist": blacklist}})
+            self._update_admin({"$set": {"blacklist": blacklist}})
             self._add_admin_log(f"user {netid} unblocked")
 
             self._add_system_log(
@@ -414,7 +468,7 @@ class Database:
     # returns list of blacklisted netids
 
     def get_blacklist(self):
-        return self._db.admin.find_one({}, {"blacklist": 1, "_id": 0})["blacklist"]
+        return self._get_admin()["blacklist"]
 
     # returns a user's waited-on sections
 
@@ -507,9 +561,7 @@ class Database:
             return res
 
         def get_disabled_courses():
-            data = self._db.admin.find_one({}, {"disabled_courses": 1, "_id": 0})[
-                "disabled_courses"
-            ]
+            data = self._get_admin()["disabled_courses"]
             if len(data) == 0:
                 return ["No courses are disabled"]
             res = ["Disabled courses:"]
@@ -521,9 +573,7 @@ class Database:
 
         def get_notifs_schedule(fmt="%b %d, %Y @ %-I:%M %p"):
             tz = pytz.timezone("UTC")
-            datetimes = list(self._db.admin.find({}, {"notifs_schedule": 1, "_id": 0}))[
-                0
-            ]["notifs_schedule"]
+            datetimes = self._get_admin()["notifs_schedule"]
             res = ["Scheduled notifications intervals (ET):"]
             for start, end in datetimes:
                 start, end = (
@@ -543,9 +593,7 @@ class Database:
             )
 
         def get_site_ref_counts():
-            raw_counts = self._db.admin.find_one({}, {"site_ref_counts": 1, "_id": 0})[
-                "site_ref_counts"
-            ]
+            raw_counts = self._get_admin()["site_ref_counts"]
 
             ref_to_name = {
                 "princetoncourses": "Princeton Courses",
@@ -632,6 +680,199 @@ class Database:
             print(e, file=stderr)
             return "error"
 
+    # stores the OIT API transport stats of the notifs dyno (see
+    # Transport.get_stats()) for get_performance_summary()
+
+    def set_notifs_transport_stats(self, stats):
+        self._update_admin({"$set": {"notifs_transport_stats": stats}})
+
+    # stores the notifs dyno's notification provider stats (see
+    # providers.get_provider_stats()) for the admin panel performance
+    # summary
+
+    def set_notifs_provider_stats(self, stats):
+        self._update_admin({"$set": {"notifs_provider_stats": stats}})
+
+    # stores the trace of a notifications cycle (see CycleTrace.to_doc())
+    # in the metrics collection, whose TTL index expires traces after
+    # METRICS_TTL_DAYS days
+
+    def add_cycle_metrics(self, doc):
+        self._db.metrics.insert_one(doc)
+
+    # returns {phase: {"n", "p50", "p95", "db_calls_p50", "http_calls_p50"}}
+    # (durations in seconds) over the last n_cycles cycle traces, and the
+    # number of traces found. "first_notif" is the time from the start of
+    # a cycle to its first notification sent (without call counts)
+
+    def get_cycle_phase_percentiles(self, n_cycles=METRICS_SUMMARY_CYCLES):
+        traces = list(
+            self._db.metrics.find(
+                {}, {"spans": 1, "duration_secs": 1, "first_notif_secs": 1, "_id": 0}
+            )
+            .sort("time", -1)
+            .limit(n_cycles)
+        )
+        phases = {"cycle": {"duration_secs": [], "db_calls": [], "http_calls": []}}
+        for trace in traces:
+            phases["cycle"]["duration_secs"].append(trace["duration_secs"])
+            # a phase may have several spans in a cycle (e.g. one per batch
+            # of messages sent), which are summed
+            trace_phases = {}
+            totals = {"db_calls": 0, "http_calls": 0}
+            for span in trace["spans"]:
+                phase = trace_phases.setdefault(
+                    span["name"], {"duration_secs": 0, "db_calls": 0, "http_calls": 0}
+                )
+                for k in phase:
+                    phase[k] += span[k]
+                for k in totals:
+                    totals[k] += span[k]
+            for name, trace_phase in trace_phases.items():
+                phase = phases.setdefault(
+                    name, {"duration_secs": [], "db_calls": [], "http_calls": []}
+                )
+                for k in phase:
+                    phase[k].append(trace_phase[k])
+            for k in totals:
+                phases["cycle"][k].append(totals[k])
+
+        res = {}
+        for name, phase in phases.items():
+            if not phase["duration_secs"]:
+                continue
+            res[name] = {
+                "n": len(phase["duration_secs"]),
+                "p50": _percentile(phase["duration_secs"], 50),
+                "p95": _percentile(phase["duration_secs"], 95),
+                "db_calls_p50": _percentile(phase["db_calls"], 50),
+                "http_calls_p50": _percentile(phase["http_calls"], 50),
+            }
+
+        first_notif = [
+            trace["first_notif_secs"]
+            for trace in traces
+            if trace.get("first_notif_secs") is not None
+        ]
+        if first_notif:
+            res["first_notif"] = {
+                "n": len(first_notif),
+                "p50": _percentile(first_notif, 50),
+                "p95": _percentile(first_notif, 95),
+            }
+        return res, len(traces)
+
+    # generates TigerSnatch performance summary: p50/p95 durations of each
+    # phase of recent notifications cycles, notification delivery success
+    # rates and latencies, SendGrid/Twilio call latencies
+    # of the notifs dyno, and OIT API connection pool,
+    # retry, and circuit breaker stats of the notifs dyno (as of its last
+    # notifications cycle) and of the web worker handling this request
+    # (web_transport_stats)
+
+    def get_performance_summary(self, web_transport_stats):
+        def format_transport_stats(stats):
+            if not stats:
+                return ["No OIT API requests recorded"]
+            res = [
+                f"Requests: {stats['requests']} ({stats['retries']} retries, {stats['failures']} failed, {stats['fast_failures']} failed fast)",
+                f"Circuit breaker: {stats['circuit_state']} (opened {stats['circuit_opens']} times)",
+                f"Connections: {stats['connections_opened']} opened, {stats['connections_reused']} reuses (pool size {stats['pool_maxsize']})",
+            ]
+            for endpoint, endpoint_stats in sorted(stats["endpoints"].items()):
+                n = endpoint_stats["requests"]
+                avg_ms = round(endpoint_stats["total_secs"] / n * 1000) if n else 0
+                res.append(
+                    f"{endpoint}: {n} requests, avg {avg_ms}ms, {endpoint_stats['retries']} retries, {endpoint_stats['failures']} failed"
+                )
+            return res
+
+        def format_time(secs):
+            return (
+                datetime.fromtimestamp(secs, TZ).strftime("%b %-d, %Y @ %-I:%M %p ET")
+                if secs
+                else "-"
+            )
+
+        line_break = "===================="
+
+        try:
+            percentiles, n_cycles = self.get_cycle_phase_percentiles()
+            res = [f"Notifications cycle phases (last {n_cycles} cycles)"]
+            if not percentiles:
+                res.append("No cycle traces recorded")
+            for name, phase in percentiles.items():
+                if "db_calls_p50" not in phase:
+                    res.append(
+                        f"{name}: p50 {phase['p50']:.2f}s, p95 {phase['p95']:.2f}s ({phase['n']} cycles)"
+                    )
+                    continue
+                res.append(
+                    f"{name}: p50 {phase['p50']:.2f}s, p95 {phase['p95']:.2f}s, {phase['db_calls_p50']} DB calls, {phase['http_calls_p50']} HTTP calls (p50, {phase['n']} cycles)"
+                )
+            res.append(line_break)
+
+            outbox_counts = self.get_outbox_counts()
+            res.append(
+                f"Notification outbox: {outbox_counts.get('pending', 0)} pending, {outbox_counts.get('leased', 0)} being sent, {outbox_counts.get('sent', 0)} sent, {outbox_counts.get('skipped', 0)} skipped as duplicates, {outbox_counts.get('dead', 0)} dead-lettered (last {OUTBOX_RETENTION_DAYS} days)"
+            )
+            res.append(line_break)
+
+            delivery_stats = self.get_delivery_stats()
+            res.append(f"Notification deliveries (last {DELIVERY_STATS_HOURS} hours)")
+            if not delivery_stats:
+                res.append("No deliveries recorded")
+            for channel, stats in sorted(delivery_stats.items()):
+                latency = (
+                    f"latency p50 {stats['latency_p50']:.2f}s, p95 {stats['latency_p95']:.2f}s"
+                    if stats["latency_p50"] is not None
+                    else "no latency recorded"
+                )
+                res.append(
+                    f"{channel}: {stats['sent']}/{stats['n']} recipients sent ({stats['success_rate']:.1%}), {latency}"
+                )
+            res.append(line_break)
+
+            admin = self._get_admin()
+            res.append("Notifs dyno notification providers")
+            provider_stats = admin.get("notifs_provider_stats")
+            if not provider_stats:
+                res.append("No SendGrid/Twilio calls recorded")
+            for name, stats in sorted((provider_stats or {}).items()):
+                n = stats["calls"]
+                avg_ms = round(stats["total_secs"] / n * 1000) if n else 0
+                res.append(
+                    f"{name}: {n} calls, avg {avg_ms}ms, max {round(stats['max_secs'] * 1000)}ms, {stats['failures']} failed, {stats.get('throttled', 0)} throttled"
+                )
+            res.append(line_break)
+
+            notifs_stats = admin.get("notifs_transport_stats")
+            res.append(
+                f"Notifs dyno OIT API (since {format_time(notifs_stats and notifs_stats['since'])}, as of {format_time(notifs_stats and notifs_stats['time'])})"
+            )
+            res.extend(format_transport_stats(notifs_stats))
+            res.append(line_break)
+            res.append(
+                f"This web worker OIT API (since {format_time(web_transport_stats['since'])})"
+            )
+            res.extend(format_transport_stats(web_transport_stats))
+            res.append(line_break)
+
+            log_stats = get_system_log_stats()
+            res.append(
+                f"This web worker system log: {log_stats['written']} events written, {log_stats['queued']} queued, {log_stats['dropped']} dropped, {log_stats['failed']} failed to write"
+            )
+            admin_stats = get_admin_cache_stats()
+            res.append(
+                f"This web worker admin document cache: {admin_stats['hits']} hits, {admin_stats['reads']} reads, {admin_stats['invalidations']} invalidations"
+            )
+            return "{".join(res)
+
+        except Exception as e:
+            log_error("Failed to generate performance summary")
+            print(e, file=stderr)
+            return "error"
+
     # ----------------------------------------------------------------------
     # STATS METHODS
     # ----------------------------------------------------------------------
@@ -747,19 +988,13 @@ class Database:
         return len(set([e["courseid"] for e in courseids]))
 
     def get_email_counter(self):
-        return self._db.admin.find_one({}, {"_id": 0, "stats_total_notifs": 1})[
-            "stats_total_notifs"
-        ]
+        return self._get_admin()["stats_total_notifs"]
 
     def get_current_email_counter(self):
-        return self._db.admin.find_one({}, {"_id": 0, "stats_current_notifs": 1})[
-            "stats_current_notifs"
-        ]
+        return self._get_admin()["stats_current_notifs"]
 
     def add_stats_notif_log(self, log):
-        stats_notifs_logs = self._db.admin.find_one(
-            {}, {"_id": 0, "stats_notifs_logs": 1}
-        )["stats_notifs_logs"]
+        stats_notifs_logs = self._get_admin()["stats_notifs_logs"]
 
         try:
             if (
@@ -773,8 +1008,7 @@ class Database:
 
         log = f"{(datetime.now(TZ)).strftime('%b %d, %Y @ %-I:%M %p ET')} \u2192 {log}"
 
-        self._db.admin.update_one(
-            {},
+        self._update_admin(
             {
                 "$push": {
                     "stats_notifs_logs": {
@@ -787,29 +1021,28 @@ class Database:
         )
 
     def get_stats(self):
-        stats = self._db.admin.find_one(
-            {},
-            {
-                "stats_top_subs": 1,
-                "stats_total_users": 1,
-                "stats_total_subs": 1,
-                "stats_subbed_users": 1,
-                "stats_subbed_sections": 1,
-                "stats_subbed_courses": 1,
-                "stats_total_notifs": 1,
-                "stats_notifs_logs": 1,
-                "stats_update_time": 1,
-                "stats_current_notifs": 1,
-                "_id": 0,
-            },
-        )
-        return stats
+        admin = self._get_admin()
+        return {
+            key: admin[key]
+            for key in [
+                "stats_top_subs",
+                "stats_total_users",
+                "stats_total_subs",
+                "stats_subbed_users",
+                "stats_subbed_sections",
+                "stats_subbed_courses",
+                "stats_total_notifs",
+                "stats_notifs_logs",
+                "stats_update_time",
+                "stats_current_notifs",
+            ]
+            if key in admin
+        }
 
     def increment_site_ref(self, ref: str):
         if not ref:
             return
-        self._db.admin.update_one(
-            {},
+        self._update_admin(
             {"$inc": {f"site_ref_counts.{ref}": 1}},
         )
         log_info(f"Incremented site ref count for {ref}")
@@ -881,11 +1114,17 @@ class Database:
     # update user netid's waitlist log
 
     def update_user_waitlist_log(self, netid, entry):
+        self.bulk_write("logs", [self.waitlist_log_op(netid, entry)])
+
+    # returns the logs collection write operation performed by
+    # update_user_waitlist_log(), for use with bulk_write()
+
+    def waitlist_log_op(self, netid, entry):
         entry = (
             f"{(datetime.now(TZ)).strftime('%b %-d, %Y @ %-I:%M %p ET')} \u2192 {entry}"
         )
 
-        self._db.logs.update_one(
+        return UpdateOne(
             {"netid": netid},
             {
                 "$push": {
@@ -918,6 +1157,16 @@ class Database:
     def get_users(self, netids):
         return list(self._db.users.find({"netid": {"$in": netids}}))
 
+    # returns a dictionary mapping each netid in netids to a dictionary of
+    # its values for the given keys from the users collection (users that
+    # do not exist are left out)
+
+    def get_users_by_netid(self, netids, keys):
+        projection = {key: 1 for key in keys}
+        projection.update({"netid": 1, "_id": 0})
+        res = self._db.users.find({"netid": {"$in": list(netids)}}, projection)
+        return {user["netid"]: user for user in res}
+
     # returns all data needed to display user waitlists on dashboard
 
     def get_dashboard_data(self, netid):
@@ -1051,28 +1300,53 @@ class Database:
             classid
         ]
 
+    # returns a dictionary mapping each netid in netids to its notifs
+    # collection data for each of classids (see get_user_notifs_history())
+
+    def get_users_notifs_histories(self, netids, classids):
+        projection = {classid: 1 for classid in classids}
+        projection.update({"netid": 1, "_id": 0})
+        res = self._db.notifs.find({"netid": {"$in": list(netids)}}, projection)
+        return {notifs["netid"]: notifs for notifs in res}
+
     # updates n_open_spots and last_notif fields for data in notifs collection
 
     def update_users_notifs_history(
         self, netids, classid, n_open_spots, reserved_seats=False
     ):
+        self.bulk_write(
+            "notifs",
+            self.notifs_history_ops(netids, classid, n_open_spots, reserved_seats),
+        )
+
+    # returns the list of notifs collection write operations performed by
+    # update_users_notifs_history(), for use with bulk_write()
+
+    def notifs_history_ops(self, netids, classid, n_open_spots, reserved_seats=False):
         # if the class has reserved seating, update only the num_notifs counter
         if reserved_seats:
-            self._db.notifs.update_many(
-                {"netid": {"$in": netids}, classid: {"$exists": True}},
-                {
-                    "$inc": {
-                        f"{classid}.num_notifs": 1
-                    },  # increments by 1 if exists, otherwise sets to 1
-                },
-            )
-            return
+            if len(netids) == 0:
+                return []
+            return [
+                UpdateMany(
+                    {"netid": {"$in": netids}, classid: {"$exists": True}},
+                    {
+                        "$inc": {
+                            f"{classid}.num_notifs": 1
+                        },  # increments by 1 if exists, otherwise sets to 1
+                    },
+                )
+            ]
 
         # update n_open_spots for all users subbed to classid (key classid exists)
-        self._db.notifs.update_many(
-            {classid: {"$exists": True}},
-            {"$set": {f"{classid}.n_open_spots": n_open_spots}},
-        )
+        ops = [
+            UpdateMany(
+                {classid: {"$exists": True}},
+                {"$set": {f"{classid}.n_open_spots": n_open_spots}},
+            )
+        ]
+        if len(netids) == 0:
+            return ops
 
         # update last_notif for only users who received notifs (i.e. netids)
         # add or subtract a random small amount of time to help spread out notifs
@@ -1080,15 +1354,18 @@ class Database:
         new_last_notif = datetime.now(TZ) + timedelta(
             minutes=randint(-RAND_OFFSET_MINS, RAND_OFFSET_MINS)
         )
-        self._db.notifs.update_many(
-            {"netid": {"$in": netids}, classid: {"$exists": True}},
-            {
-                "$set": {f"{classid}.last_notif": new_last_notif},
-                "$inc": {
-                    f"{classid}.num_notifs": 1
-                },  # increments by 1 if exists, otherwise sets to 1
-            },
+        ops.append(
+            UpdateMany(
+                {"netid": {"$in": netids}, classid: {"$exists": True}},
+                {
+                    "$set": {f"{classid}.last_notif": new_last_notif},
+                    "$inc": {
+                        f"{classid}.num_notifs": 1
+                    },  # increments by 1 if exists, otherwise sets to 1
+                },
+            )
         )
+        return ops
 
     # ----------------------------------------------------------------------
     # TERM METHODS
@@ -1097,9 +1374,7 @@ class Database:
     # gets current term code from admin collection
 
     def get_current_term_code(self):
-        res = self._db.admin.find_one(
-            {}, {"current_term_code": 1, "current_term_name": 1, "_id": 0}
-        )
+        res = self._get_admin()
         return res["current_term_code"], res["current_term_name"]
 
     # updates current term code from admin collection
@@ -1108,8 +1383,8 @@ class Database:
         if self.get_current_term_code()[0] == code:
             return False
 
-        self._db.admin.update_one(
-            {}, {"$set": {"current_term_code": code, "current_term_name": name}}
+        self._update_admin(
+            {"$set": {"current_term_code": code, "current_term_name": name}}
         )
         return True
 
@@ -1165,28 +1440,114 @@ class Database:
 
     def get_course_with_enrollment(self, courseid):
         course_info = self.get_course(courseid)
-        has_reserved_seats = course_info["has_reserved_seats"]
+        classids = [
+            course_info[key]["classid"]
+            for key in course_info
+            if key.startswith("class_")
+        ]
+        enrollments = {
+            e["classid"]: e
+            for e in self._db.enrollments.find(
+                {"classid": {"$in": classids}},
+                {"_id": 0, "classid": 1, "enrollment": 1, "capacity": 1},
+            )
+        }
         for key in course_info.keys():
             if key.startswith("class_"):
                 class_dict = course_info[key]
-                classid = class_dict["classid"]
-                class_data = self.get_class_enrollment(classid)
-                class_dict["enrollment"] = class_data["enrollment"]
-                class_dict["capacity"] = class_data["capacity"]
-                # we mark a class as full (i.e. allow subbing) if at least one is true:
-                #   1. capacity is non-zero and enrollment is at least as large as capacity
-                #   2. class has reserved seating and positive enrollment
-                #   3. class is closed
-                class_dict["isFull"] = (
-                    (
-                        class_dict["capacity"] > 0
-                        and class_dict["enrollment"] >= class_dict["capacity"]
-                    )
-                    or (has_reserved_seats and class_dict["enrollment"] > 0)
-                    or not class_dict["status_is_open"]
+                _set_class_enrollment(
+                    class_dict,
+                    enrollments[class_dict["classid"]],
+                    course_info["has_reserved_seats"],
                 )
         return course_info
 
+    # returns the data shown on the course page of courseid, assembled from
+    # one aggregation: the course as in get_course_with_enrollment(), in
+    # which each class dictionary also has
+    #   "wl_size": the number of users on its waitlist
+    #   "time_of_last_notif": the time of its last notification as in
+    #       get_time_of_last_notif() (None if never notified)
+    #   "subscribers": {year: [netids]} of the users on its waitlist
+    #       ("Other" for users with no year)
+    # returns None if there is no such course
+
+    def get_course_view(self, courseid):
+        res = self._db.courses.aggregate(
+            [
+                {"$match": {"courseid": courseid}},
+                {"$limit": 1},
+                {"$project": {"_id": 0}},
+                {
+                    "$lookup": {
+                        "from": "enrollments",
+                        "localField": "courseid",
+                        "foreignField": "courseid",
+                        "as": "_enrollments",
+                    }
+                },
+                {
+                    "$lookup": {
+                        "from": "waitlists",
+                        "localField": "_enrollments.classid",
+                        "foreignField": "classid",
+                        "as": "_waitlists",
+                    }
+                },
+                {
+                    "$addFields": {
+                        "_netids": {
+                            "$reduce": {
+                                "input": "$_waitlists.waitlist",
+                                "initialValue": [],
+                                "in": {"$concatArrays": ["$$value", "$$this"]},
+                            }
+                        }
+                    }
+                },
+                # only the netid and year of each subscriber are joined
+                # (the equality match still uses the users netid index;
+                # needs MongoDB 5.0+)
+                {
+                    "$lookup": {
+                        "from": "users",
+                        "localField": "_netids",
+                        "foreignField": "netid",
+                        "pipeline": [{"$project": {"_id": 0, "netid": 1, "year": 1}}],
+                        "as": "_users",
+                    }
+                },
+            ]
+        )
+        course = next(res, None)
+        if course is None:
+            return None
+
+        enrollments = {e["classid"]: e for e in course.pop("_enrollments")}
+        waitlists = {w["classid"]: w["waitlist"] for w in course.pop("_waitlists")}
+        # users without a year are left out, as are netids without a user
+        years = {u["netid"]: u["year"] for u in course.pop("_users") if "year" in u}
+        course.pop("_netids")
+
+        for key in course.keys():
+            if not key.startswith("class_"):
+                continue
+            class_dict = course[key]
+            class_data = enrollments[class_dict["classid"]]
+            _set_class_enrollment(class_dict, class_data, course["has_reserved_seats"])
+
+            waitlist = waitlists.get(class_dict["classid"], [])
+            class_dict["wl_size"] = len(waitlist)
+            class_dict["time_of_last_notif"] = _format_notif_time(
+                class_data.get("last_notif")
+            )
+            subscribers = {}
+            for netid in waitlist:
+                if netid in years:
+                    subscribers.setdefault(years[netid] or "Other", []).append(netid)
+            class_dict["subscribers"] = subscribers
+        return course
+
     # updates time that a course page was last updated
 
     def update_course_time(self, courseid, curr_time):
@@ -1246,9 +1607,7 @@ class Database:
 
     def is_course_disabled(self, courseid):
         try:
-            disabled_courses = self._db.admin.find_one(
-                {}, {"disabled_courses": 1, "_id": 0}
-            )["disabled_courses"]
+            disabled_courses = self._get_admin()["disabled_courses"]
             return courseid in disabled_courses
         except:
             return False
@@ -1257,9 +1616,7 @@ class Database:
 
     def get_disabled_courses(self):
         try:
-            return self._db.admin.find_one({}, {"disabled_courses": 1, "_id": 0})[
-                "disabled_courses"
-            ]
+            return self._get_admin()["disabled_courses"]
         except:
             return []
 
@@ -1271,12 +1628,21 @@ class Database:
         except:
             return False
 
+    # returns the set of courseids (out of courseids) that have reserved seating
+
+    def get_courses_with_reserved_seats(self, courseids):
+        res = self._db.courses.find(
+            {"courseid": {"$in": list(courseids)}, "has_reserved_seats": True},
+            {"_id": 0, "courseid": 1},
+        )
+        return set(course["courseid"] for course in res)
+
     # checks if a course (via its entire original "displayname" key) is a top-N subscribed course
 
     def is_course_top_n_subscribed(self, displayname):
         try:
             displayname = " / ".join(displayname.split("/"))
-            data = self._db.admin.find_one({}, {"_id": 0, "stats_top_subs": 1})
+            data = self._get_admin()
             top_courses = set([e["deptnum"] for e in data["stats_top_subs"]])
             return displayname in top_courses
         except:
@@ -1347,6 +1713,44 @@ class Database:
             dept_num = " / ".join(displayname.split("/"))
         return dept_num, title, sectionname, courseid
 
+    # returns a dictionary mapping each of classids to the tuple
+    # (dept_num, title, sectionname, courseid, has_reserved_seats), as in
+    # classid_to_classinfo(), using two queries in total. classids that
+    # cannot be found are left out
+
+    def classids_to_classinfo(self, classids):
+        enrollments = list(
+            self._db.enrollments.find(
+                {"classid": {"$in": list(classids)}},
+                {"_id": 0, "classid": 1, "courseid": 1, "section": 1},
+            )
+        )
+        courses = self._db.courses.find(
+            {"courseid": {"$in": list(set(e["courseid"] for e in enrollments))}},
+            {
+                "_id": 0,
+                "courseid": 1,
+                "displayname": 1,
+                "title": 1,
+                "has_reserved_seats": 1,
+            },
+        )
+        courses = {course["courseid"]: course for course in courses}
+
+        res = {}
+        for enrollment in enrollments:
+            course = courses.get(enrollment["courseid"])
+            if course is None:
+                continue
+            res[enrollment["classid"]] = (
+                course["displayname"].split("/")[0],
+                course["title"],
+                enrollment["section"],
+                enrollment["courseid"],
+                course.get("has_reserved_seats", False),
+            )
+        return res
+
     # get dictionary for class with given classid in courses
 
     def get_class(self, courseid, classid):
@@ -1423,6 +1827,20 @@ class Database:
         except:
             return 0
 
+    # returns a dictionary mapping each of classids to its previous enrollment
+    # (see get_prev_enrollment_RESERVED_SEATS_ONLY()) in a single query
+    # USE ONLY IF THE CORRESPONDING COURSES HAVE RESERVED SEATS!
+    def get_prev_enrollments_RESERVED_SEATS_ONLY(self, classids):
+        res = {classid: 0 for classid in classids}
+        if len(res) == 0:
+            return res
+        for enrollment in self._db.enrollments.find(
+            {"classid": {"$in": list(res)}, "prev_enrollment": {"$exists": True}},
+            {"_id": 0, "classid": 1, "prev_enrollment": 1},
+        ):
+            res[enrollment["classid"]] = enrollment["prev_enrollment"]
+        return res
+
     def update_prev_enrollment_RESERVED_SEATS_ONLY(self, classid, enrollment):
         try:
             self._db.enrollments.update_one(
@@ -1431,6 +1849,13 @@ class Database:
         except:
             raise RuntimeError(f"class {classid} not found in enrollments")
 
+    # returns the enrollments collection write operation performed by
+    # update_prev_enrollment_RESERVED_SEATS_ONLY(), for use with bulk_write()
+    def prev_enrollment_op_RESERVED_SEATS_ONLY(self, classid, enrollment):
+        return UpdateOne(
+            {"classid": classid}, {"$set": {"prev_enrollment": enrollment}}
+        )
+
     # sets the time of last notif for class classid to NOW
     # time of last notif stored in enrollments collection
     def update_time_of_last_notif(self, classid):
@@ -1441,20 +1866,63 @@ class Database:
         except:
             raise RuntimeError(f"class {classid} not found in enrollments")
 
+    # returns the enrollments collection write operation performed by
+    # update_time_of_last_notif(), for use with bulk_write()
+    def time_of_last_notif_op(self, classid):
+        return UpdateOne(
+            {"classid": classid}, {"$set": {"last_notif": datetime.now(TZ)}}
+        )
+
+    # returns a dictionary mapping each of classids that has a stored seats
+    # fingerprint to a dictionary {"fingerprint": [enrollment, capacity,
+    # status], "time": datetime (UTC) the fingerprint was last recorded}
+    # in a single query. classids without a fingerprint are left out.
+    def get_seats_fingerprints(self, classids):
+        res = {}
+        if len(classids) == 0:
+            return res
+        for enrollment in self._db.enrollments.find(
+            {
+                "classid": {"$in": list(classids)},
+                "seats_fingerprint": {"$exists": True},
+            },
+            {
+                "_id": 0,
+                "classid": 1,
+                "seats_fingerprint": 1,
+                "seats_fingerprint_time": 1,
+            },
+        ):
+            res[enrollment["classid"]] = {
+                "fingerprint": enrollment["seats_fingerprint"],
+                "time": pytz.utc.localize(enrollment["seats_fingerprint_time"]),
+            }
+        return res
+
+    # returns the enrollments collection write operation that stores the
+    # seats fingerprint of class classid, recorded at time time
+    # (see get_seats_fingerprints()), for use with bulk_write()
+    def seats_fingerprint_op(self, classid, fingerprint, time):
+        return UpdateOne(
+            {"classid": classid},
+            {
+                "$set": {
+                    "seats_fingerprint": list(fingerprint),
+                    "seats_fingerprint_time": time,
+                }
+            },
+        )
+
     # returns the time of last notif as a string, or None if it does not exist, for class classid
     # can pass a custom format string for the datetime
     def get_time_of_last_notif(self, classid, fmt="%-m/%-d @ %-I:%M %p"):
         try:
-            tz_utc = pytz.timezone("UTC")
-            tz_et = pytz.timezone("US/Eastern")
             time = self._db.enrollments.find_one({"classid": classid}, {"_id": 0})[
                 "last_notif"
             ]
-            time = tz_utc.localize(time)
-            time = time.astimezone(tz_et)
-            return time.strftime(fmt)
         except:
             return None
+        return _format_notif_time(time, fmt)
 
     # ----------------------------------------------------------------------
     # WAITLIST METHODS
@@ -1465,6 +1933,62 @@ class Database:
     def get_waited_classes(self):
         return self._db.waitlists.find({}, {"courseid": 1, "classid": 1, "_id": 0})
 
+    # returns all waited-on classes grouped by their parent course in a
+    # single aggregation (waitlists -> enrollments -> mappings), in the form:
+    # {
+    #   courseid1: [deptnum, classid1, classid2, ...],
+    #   courseid2: [deptnum, classid1, ...],
+    #   ...
+    # }
+    # classes with no enrollments or mappings entry are dropped, and
+    # courses in disabled_courses are logged and skipped
+
+    def get_waited_classes_by_course(self):
+        disabled_courses = self.get_disabled_courses()
+        res = self._db.waitlists.aggregate(
+            [
+                {"$project": {"_id": 0, "classid": 1}},
+                {
+                    "$lookup": {
+                        "from": "enrollments",
+                        "localField": "classid",
+                        "foreignField": "classid",
+                        "as": "enrollment",
+                    }
+                },
+                {"$unwind": "$enrollment"},
+                {"$project": {"classid": 1, "courseid": "$enrollment.courseid"}},
+                {
+                    "$lookup": {
+                        "from": "mappings",
+                        "localField": "courseid",
+                        "foreignField": "courseid",
+                        "as": "mapping",
+                    }
+                },
+                {"$unwind": "$mapping"},
+                {
+                    "$group": {
+                        "_id": "$courseid",
+                        "displayname": {"$first": "$mapping.displayname"},
+                        "classids": {"$push": "$classid"},
+                    }
+                },
+                {"$addFields": {"disabled": {"$in": ["$_id", disabled_courses]}}},
+            ]
+        )
+
+        data = {}
+        for course in res:
+            courseid = course["_id"]
+            deptnum = course["displayname"].split("/")[0]
+            if course["disabled"]:
+                log_notifs(f"{deptnum} (courseID {courseid}) is disabled - skipping")
+                continue
+            data[courseid] = [deptnum] + course["classids"]
+
+        return data
+
     # returns a specific classid's waitlist document
 
     def get_class_waitlist(self, classid):
@@ -1473,6 +1997,16 @@ class Database:
         except:
             raise Exception(f"classid {classid} does not exist")
 
+    # returns a dictionary mapping each of classids that has a waitlist
+    # document to its list of waitlisted netids
+
+    def get_class_waitlists(self, classids):
+        res = self._db.waitlists.find(
+            {"classid": {"$in": list(classids)}},
+            {"_id": 0, "classid": 1, "waitlist": 1},
+        )
+        return {waitlist["classid"]: waitlist["waitlist"] for waitlist in res}
+
     # returns a specific classid's waitlist size
 
     def get_class_waitlist_size(self, classid):
@@ -1481,33 +2015,22 @@ class Database:
         except:
             raise Exception(f"classid {classid} does not exist")
 
-    # adds user of given netid to waitlist for class classid
+    # adds user of given netid to waitlist for class classid. returns 1 if
+    # subscribed, 0 if the user is already on MAX_WAITLIST_SIZE waitlists,
+    # and raises an Exception if the subscription is not allowed. the user
+    # and waitlist documents are changed with $addToSet, conditional on the
+    # user not being subscribed yet and under the waitlist limit, so that
+    # concurrent subscriptions cannot overwrite each other
 
     def add_to_waitlist(self, netid, classid, disable_checks=False):
-        # validation checks
-        def validate(courseid):
+        # validation checks of the class (those of the user are part of
+        # the conditional update below)
+        def validate(class_enrollment, course):
             # helper method to check if class is full
             def is_class_full(enrollment_dict):
                 return enrollment_dict["enrollment"] >= enrollment_dict["capacity"]
 
-            has_reserved_seats = self.does_course_have_reserved_seats(
-                self.classid_to_course_info(classid)[1]
-            )
-
-            # if user does not exist, do not allow sub
-            if not self.is_user_created(netid):
-                raise Exception(f"user {netid} does not exist")
-
-            class_enrollment = self.get_class_enrollment(classid)
-            # if class does not exist, do not allow sub
-            if class_enrollment is None:
-                raise Exception(f"class {classid} does not exist")
-
-            # if user is already subbed to class, do not allow sub
-            if classid in self.get_user(netid, "waitlists"):
-                raise Exception(
-                    f"user {netid} is already in waitlist for class {classid}"
-                )
+            has_reserved_seats = course.get("has_reserved_seats", False)
 
             # if class is in a disabled course, do not allow sub
             if self.is_course_disabled(courseid):
@@ -1515,8 +2038,7 @@ class Database:
                     f"User {netid}: class {classid} is in disabled course {courseid}"
                 )
 
-            course_info = self.get_course(courseid)
-            class_status_is_open = course_info[f"class_{classid}"]["status_is_open"]
+            class_status_is_open = course[f"class_{classid}"]["status_is_open"]
 
             # if class is open and doesn't have reserved seats, do not allow sub
             if class_status_is_open and not has_reserved_seats:
@@ -1541,52 +2063,83 @@ class Database:
                 )
 
         netid = netid.strip()
-        coursedeptnum, courseid = self.classid_to_course_info(classid)
-        if not disable_checks:
-            validate(courseid)
-
-        # add classid to user's waitlist
-        user_waitlists = self.get_user(netid, "waitlists")
-        try:
-            if len(user_waitlists) >= MAX_WAITLIST_SIZE:
-                log_info(
-                    f"User {netid} exceeded the waitlist limit of {MAX_WAITLIST_SIZE}"
-                )
-                return 0
-        except Exception as e:
-            print(e, file=stderr)
 
-        user_waitlists.append(classid)
-        self._db.users.update_one(
-            {"netid": netid}, {"$set": {"waitlists": user_waitlists}}
+        # if class does not exist, do not allow sub
+        class_enrollment = self.get_class_enrollment(classid)
+        if class_enrollment is None:
+            raise Exception(f"class {classid} does not exist")
+        courseid = class_enrollment["courseid"]
+        course = self._db.courses.find_one(
+            {"courseid": courseid},
+            {
+                "_id": 0,
+                "displayname": 1,
+                "has_reserved_seats": 1,
+                f"class_{classid}.status_is_open": 1,
+            },
         )
+        if course is None:
+            raise RuntimeError(f"courseid {courseid} not found in courses")
+        coursedeptnum = course["displayname"].split("/")[0]
+        if not disable_checks:
+            validate(class_enrollment, course)
 
-        # add user to waitlist for classid
-        waitlist = self.get_class_waitlist(classid)
-        if waitlist is None:
-            self._db.waitlists.insert_one({"classid": classid, "waitlist": []})
-            class_waitlist = []
-        else:
-            class_waitlist = waitlist["waitlist"]
-
-        class_waitlist.append(netid)
-        self._db.waitlists.update_one(
-            {"classid": classid}, {"$set": {"waitlist": class_waitlist}}
-        )
+        def subscribe(session):
+            # add classid to user's waitlist
+            res = self._db.users.update_one(
+                {
+                    "netid": netid,
+                    "waitlists": {"$ne": classid},
+                    "$expr": {"$lt": [{"$size": "$waitlists"}, MAX_WAITLIST_SIZE]},
+                },
+                {"$addToSet": {"waitlists": classid}},
+                session=session,
+            )
+            if res.matched_count == 0:
+                user = self._db.users.find_one(
+                    {"netid": netid}, {"waitlists": 1, "_id": 0}, session=session
+                )
+                # if user does not exist, do not allow sub
+                if user is None:
+                    raise Exception(f"user {netid} does not exist")
+                # if user is already subbed to class, do not allow sub
+                if classid in user["waitlists"]:
+                    if not disable_checks:
+                        raise Exception(
+                            f"user {netid} is already in waitlist for class {classid}"
+                        )
+                else:
+                    log_info(
+                        f"User {netid} exceeded the waitlist limit of {MAX_WAITLIST_SIZE}"
+                    )
+                    return 0
+
+            # add user to waitlist for classid
+            self._db.waitlists.update_one(
+                {"classid": classid},
+                {"$addToSet": {"waitlist": netid}},
+                upsert=True,
+                session=session,
+            )
 
-        # add class to user's document in notifs collection with default values
-        self._db.notifs.update_one(
-            {"netid": netid},
-            {
-                "$set": {
-                    classid: {
-                        "n_open_spots": 0,
-                        "last_notif": datetime.now(TZ),
-                        "num_notifs": 0,
+            # add class to user's document in notifs collection with default values
+            self._db.notifs.update_one(
+                {"netid": netid},
+                {
+                    "$set": {
+                        classid: {
+                            "n_open_spots": 0,
+                            "last_notif": datetime.now(TZ),
+                            "num_notifs": 0,
+                        }
                     }
-                }
-            },
-        )
+                },
+                session=session,
+            )
+            return 1
+
+        if self._run_subscription_writes(subscribe) == 0:
+            return 0
 
         self._add_system_log(
             "subscription",
@@ -1599,58 +2152,51 @@ class Database:
         return 1
 
     # removes user of given netid to waitlist for class classid
-    # if waitlist for class is empty now, delete entry from waitlists collection
+    # if waitlist for class is empty now, delete entry from waitlists collection.
+    # the user and waitlist documents are changed with $pull, and an emptied
+    # waitlist is deleted only if it is still empty
 
     def remove_from_waitlist(self, netid, classid, force_remove=False):
-        def validate(courseid):
-            if not self.is_user_created(netid):
-                raise Exception(f"user {netid} does not exist")
-            waitlist = self.get_class_waitlist(classid)
-            if waitlist is None:
-                raise Exception(
-                    f"no waitlist for class {classid} exists (user {netid})"
-                )
-            if (
-                classid not in self.get_user(netid, "waitlists")
-                or netid not in waitlist["waitlist"]
-            ):
-                raise Exception(f"user {netid} not in waitlist for class {classid}")
-            if self.is_course_disabled(courseid):
-                raise Exception(
-                    f"User {netid}: class {classid} is in disabled course {courseid}"
-                )
-
         netid = netid.strip()
-        coursedeptnum, courseid = self.classid_to_course_info(classid)
-        if not force_remove:
-            validate(courseid)
+        classinfo = self.classids_to_classinfo([classid]).get(classid)
+        if classinfo is None:
+            raise RuntimeError(f"classid {classid} not found in enrollments")
+        coursedeptnum, _, _, courseid, has_reserved_seats = classinfo
+        if not force_remove and self.is_course_disabled(courseid):
+            raise Exception(
+                f"User {netid}: class {classid} is in disabled course {courseid}"
+            )
 
-        # remove classid from user's waitlist
-        user_waitlists = self.get_user(netid, "waitlists")
-        if classid in user_waitlists:
-            user_waitlists.remove(classid)
-            self._db.users.update_one(
-                {"netid": netid}, {"$set": {"waitlists": user_waitlists}}
+        def unsubscribe(session):
+            # remove classid from user's waitlist
+            user_filter = {"netid": netid}
+            if not force_remove:
+                user_filter["waitlists"] = classid
+            res = self._db.users.update_one(
+                user_filter, {"$pull": {"waitlists": classid}}, session=session
             )
+            if res.matched_count == 0 and not force_remove:
+                if not self.is_user_created(netid):
+                    raise Exception(f"user {netid} does not exist")
+                raise Exception(f"user {netid} not in waitlist for class {classid}")
 
-        # remove user from waitlist for classid
-        class_waitlist = self.get_class_waitlist(classid)["waitlist"]
-        if netid in class_waitlist:
-            class_waitlist.remove(netid)
-            if len(class_waitlist) == 0:
-                self._db.waitlists.delete_one({"classid": classid})
-                # reset prev_enrollment to 0 if the course has reserved seats
-                if self.does_course_have_reserved_seats(
-                    self.classid_to_course_info(classid)[1]
-                ):
-                    self.update_prev_enrollment_RESERVED_SEATS_ONLY(classid, 0)
-            else:
-                self._db.waitlists.update_one(
-                    {"classid": classid}, {"$set": {"waitlist": class_waitlist}}
-                )
+            # remove user from waitlist for classid
+            self._db.waitlists.update_one(
+                {"classid": classid}, {"$pull": {"waitlist": netid}}, session=session
+            )
+            emptied = self._db.waitlists.delete_one(
+                {"classid": classid, "waitlist": {"$size": 0}}, session=session
+            )
 
-        # remove class from user's document in notifs collection
-        self._db.notifs.update_one({"netid": netid}, {"$unset": {classid: ""}})
+            # remove class from user's document in notifs collection
+            self._db.notifs.update_one(
+                {"netid": netid}, {"$unset": {classid: ""}}, session=session
+            )
+            return emptied.deleted_count > 0
+
+        # reset prev_enrollment to 0 if the course has reserved seats
+        if self._run_subscription_writes(unsubscribe) and has_reserved_seats:
+            self.update_prev_enrollment_RESERVED_SEATS_ONLY(classid, 0)
 
         self._add_system_log(
             "subscription",
@@ -1660,6 +2206,96 @@ class Database:
             netid=netid,
         )
 
+    # returns write_fn(session), where write_fn makes the writes of a
+    # subscribe or unsubscribe with session. if SUBSCRIPTION_TRANSACTIONS,
+    # session is that of a transaction (retried as a whole on transient
+    # errors); otherwise it is None and the writes are made one by one
+
+    def _run_subscription_writes(self, write_fn):
+        if not SUBSCRIPTION_TRANSACTIONS:
+            return write_fn(None)
+        with self._db.client.start_session() as session:
+            return session.with_transaction(write_fn)
+
+    # removes users from waitlists with one bulk write per collection,
+    # where removals is a dictionary in the form:
+    # {
+    #   classid1: [netid1, netid2, ...],
+    #   classid2: [netid1, ...],
+    #   ...
+    # }
+    # performs no validation checks (like remove_from_waitlist() with
+    # force_remove=True). waitlists that become empty are deleted
+
+    def remove_from_waitlists_bulk(self, removals):
+        removals = {
+            classid: netids for classid, netids in removals.items() if len(netids) > 0
+        }
+        if len(removals) == 0:
+            return
+
+        users_ops, waitlists_ops, notifs_ops = [], [], []
+        for classid, netids in removals.items():
+            users_ops.append(
+                UpdateMany(
+                    {"netid": {"$in": netids}}, {"$pull": {"waitlists": classid}}
+                )
+            )
+            waitlists_ops.append(
+                UpdateOne({"classid": classid}, {"$pullAll": {"waitlist": netids}})
+            )
+            notifs_ops.append(
+                UpdateMany({"netid": {"$in": netids}}, {"$unset": {classid: ""}})
+            )
+        self.bulk_write("users", users_ops)
+        self.bulk_write("waitlists", waitlists_ops)
+        self.bulk_write("notifs", notifs_ops)
+
+        classids = list(removals)
+        classinfo = self.classids_to_classinfo(classids)
+
+        # delete emptied waitlists and reset prev_enrollment to 0 for those
+        # whose course has reserved seats
+        emptied = self._db.waitlists.find(
+            {"classid": {"$in": classids}, "waitlist": {"$size": 0}},
+            {"_id": 0, "classid": 1},
+        )
+        emptied = [waitlist["classid"] for waitlist in emptied]
+        # a waitlist subscribed to since it was found empty is kept (see
+        # remove_from_waitlist())
+        deleted = [
+            classid
+            for classid in emptied
+            if self._db.waitlists.delete_one(
+                {"classid": classid, "waitlist": {"$size": 0}}
+            ).deleted_count
+            > 0
+        ]
+        if len(deleted) > 0:
+            self.bulk_write(
+                "enrollments",
+                [
+                    self.prev_enrollment_op_RESERVED_SEATS_ONLY(classid, 0)
+                    for classid in deleted
+                    if classid in classinfo and classinfo[classid][4]
+                ],
+            )
+
+        logs = []
+        for classid, netids in removals.items():
+            coursedeptnum = classinfo[classid][0] if classid in classinfo else "?"
+            for netid in netids:
+                logs.append(
+                    self.system_log_op(
+                        "subscription",
+                        {
+                            "message": f"User {netid} unsubscribed from class {classid} ({coursedeptnum})"
+                        },
+                        netid=netid,
+                    )
+                )
+        self.bulk_write("system", logs)
+
     # ----------------------------------------------------------------------
     # LIVE NOTIFICATION STATUS METHODS
     # ----------------------------------------------------------------------
@@ -1667,15 +2303,21 @@ class Database:
     # returns the current state of live notifications and the data associated with it
     def get_live_notifs_status(self):
         try:
-            res = self._db.admin.find_one({}, {"_id": 0, "live_notifs_status": 1})[
-                "live_notifs_status"
-            ]
+            res = self._get_live_notifs_status()
             return res["state"], res["description"], res["countdown"]
         except Exception as e:
             log_error("Failed to get live notifs status")
             print(e, file=stderr)
             return "error", None
 
+    # returns the live_notifs_status of the admin document, read from the
+    # database (it changes every second, so it is not cached: see
+    # admincache.py)
+    def _get_live_notifs_status(self):
+        return self._db.admin.find_one({}, {"live_notifs_status": 1, "_id": 0})[
+            "live_notifs_status"
+        ]
+
     # sets the current state of live notifications and the data associated with it
     def set_live_notifs_status(
         self, state, data, update_countdown_state=True, update_countdown_data=True
@@ -1691,14 +2333,12 @@ class Database:
                 if not set_args:
                     return
 
-                self._db.admin.update_one(
-                    {},
+                self._update_admin(
                     {"$set": set_args},
                 )
                 return
 
-            self._db.admin.update_one(
-                {},
+            self._update_admin(
                 {
                     "$set": {
                         "live_notifs_status.state": state,
@@ -1710,6 +2350,217 @@ class Database:
             log_error("Failed to set live notifs status")
             print(e, file=stderr)
 
+    # ----------------------------------------------------------------------
+    # NOTIFICATION OUTBOX METHODS
+    # ----------------------------------------------------------------------
+
+    # inserts the outbox messages msgs (see outbox.outbox_message()),
+    # skipping those whose idempotency key (_id) is already in the outbox,
+    # and returns the number of messages inserted
+    def add_outbox_messages(self, msgs):
+        if len(msgs) == 0:
+            return 0
+        try:
+            return len(self._db.outbox.insert_many(msgs, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            return e.details["nInserted"]
+
+    # leases up to n due outbox messages (pending ones whose retry time has
+    # come, and leased ones whose lease expired), highest priority first,
+    # to worker worker_id for OUTBOX_LEASE_SECS seconds and returns them.
+    # messages whose lease expired on their last allowed attempt are
+    # dead-lettered instead
+    def claim_outbox_messages(self, worker_id, n):
+        now = datetime.now(pytz.utc)
+        self._db.outbox.update_many(
+            {
+                "status": "leased",
+                "lease_until": {"$lt": now},
+                "attempts": {"$gte": OUTBOX_MAX_ATTEMPTS},
+            },
+            {"$set": {"status": "dead", "error": "lease expired", "done_at": now}},
+        )
+
+        due = {
+            "$or": [
+                {"status": "pending", "available_at": {"$lte": now}},
+                {"status": "leased", "lease_until": {"$lt": now}},
+            ]
+        }
+        ids = [
+            msg["_id"]
+            for msg in self._db.outbox.find(due, {"_id": 1})
+            .sort([("priority", 1), ("available_at", 1)])
+            .limit(n)
+        ]
+        if len(ids) == 0:
+            return []
+
+        # messages claimed by another worker in the meantime no longer
+        # match due, so each message is leased to one worker only
+        lease = f"{worker_id}:{ObjectId()}"
+        self._db.outbox.update_many(
+            {"_id": {"$in": ids}, **due},
+            {
+                "$set": {
+                    "status": "leased",
+                    "lease": lease,
+                    "lease_until": now + timedelta(seconds=OUTBOX_LEASE_SECS),
+                },
+                "$inc": {"attempts": 1},
+            },
+        )
+        return list(self._db.outbox.find({"lease": lease}))
+
+    # returns an operation that sets fields of the leased outbox message
+    # msg (see claim_outbox_messages()) unless its lease has been lost
+    def outbox_update_op(self, msg, fields):
+        return UpdateOne({"_id": msg["_id"], "lease": msg["lease"]}, {"$set": fields})
+
+    # returns {status: number of outbox messages}
+    def get_outbox_counts(self):
+        return {
+            doc["_id"]: doc["n"]
+            for doc in self._db.outbox.aggregate(
+                [{"$group": {"_id": "$status", "n": {"$sum": 1}}}]
+            )
+        }
+
+    # ----------------------------------------------------------------------
+    # NOTIFICATION DELIVERY RECORD METHODS
+    # ----------------------------------------------------------------------
+
+    # inserts or updates the delivery records records (see
+    # outbox._delivery_records()), which expire DELIVERY_RETENTION_DAYS
+    # days after their last update
+    def add_delivery_records(self, records):
+        if len(records) == 0:
+            return
+        now = datetime.now(pytz.utc)
+        self._db.deliveries.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": record["_id"]},
+                    {
+                        "$set": {
+                            **{k: v for k, v in record.items() if k != "_id"},
+                            "updated_at": now,
+                        }
+                    },
+                    upsert=True,
+                )
+                for record in records
+            ],
+            ordered=False,
+        )
+
+    # returns the set of delivery keys (see outbox.delivery_key()) of
+    # keys, or of the delivery records with _id in record_ids, that were
+    # sent: in the cycle of the record, or within the last window_secs
+    # seconds
+    def get_delivered_keys(
+        self, record_ids, keys, window_secs=DELIVERY_DEDUPE_WINDOW_SECS
+    ):
+        if len(keys) == 0:
+            return set()
+        since = datetime.now(pytz.utc) - timedelta(seconds=window_secs)
+        return {
+            record["key"]
+            for record in self._db.deliveries.find(
+                {
+                    "status": "sent",
+                    "$or": [
+                        {"_id": {"$in": record_ids}},
+                        {"key": {"$in": keys}, "sent_at": {"$gte": since}},
+                    ],
+                },
+                {"key": 1, "_id": 0},
+            )
+        }
+
+    # returns {channel: {"n", "sent", "success_rate", "latency_p50",
+    # "latency_p95"}} over the delivery records of the last hours hours.
+    # latencies (in seconds, from the notification being stored in the
+    # outbox to its being sent) are None if nothing was sent
+
+    def get_delivery_stats(self, hours=DELIVERY_STATS_HOURS):
+        since = datetime.now(pytz.utc) - timedelta(hours=hours)
+        res = {}
+        for doc in self._db.deliveries.aggregate(
+            [
+                {"$match": {"updated_at": {"$gte": since}}},
+                {
+                    "$group": {
+                        "_id": "$channel",
+                        "n": {"$sum": 1},
+                        "sent": {
+                            "$sum": {"$cond": [{"$eq": ["$status", "sent"]}, 1, 0]}
+                        },
+                        "latencies": {"$push": "$latency_secs"},
+                    }
+                },
+            ]
+        ):
+            latencies = [secs for secs in doc["latencies"] if secs is not None]
+            res[doc["_id"]] = {
+                "n": doc["n"],
+                "sent": doc["sent"],
+                "success_rate": doc["sent"] / doc["n"],
+                "latency_p50": _percentile(latencies, 50) if latencies else None,
+                "latency_p95": _percentile(latencies, 95) if latencies else None,
+            }
+        return res
+
+    # ----------------------------------------------------------------------
+    # BROADCAST METHODS
+    # ----------------------------------------------------------------------
+
+    # returns the progress of the announcement broadcast broadcast_id (see
+    # broadcast.send_broadcast()), or None if it was never started
+    def get_broadcast(self, broadcast_id):
+        return self._db.broadcasts.find_one({"_id": broadcast_id})
+
+    # records the start of a run of the broadcast broadcast_id of subject
+    # to n_recipients users
+    def start_broadcast(self, broadcast_id, subject, n_recipients):
+        now = datetime.now(TZ)
+        self._db.broadcasts.update_one(
+            {"_id": broadcast_id},
+            {
+                "$setOnInsert": {
+                    "subject": subject,
+                    "sent_emails": [],
+                    "n_sent": 0,
+                    "created_at": now,
+                },
+                "$set": {
+                    "status": "running",
+                    "n_recipients": n_recipients,
+                    "last_run_at": now,
+                },
+            },
+            upsert=True,
+        )
+
+    # checkpoints the broadcast broadcast_id as sent to the users emails
+    def add_broadcast_emails(self, broadcast_id, emails):
+        self._db.broadcasts.update_one(
+            {"_id": broadcast_id},
+            {
+                "$addToSet": {"sent_emails": {"$each": emails}},
+                "$inc": {"n_sent": len(emails)},
+            },
+        )
+
+    # marks the broadcast broadcast_id as sent in full
+    def finish_broadcast(self, broadcast_id):
+        self._db.broadcasts.update_one(
+            {"_id": broadcast_id},
+            {"$set": {"status": "done", "done_at": datetime.now(TZ)}},
+        )
+
     # ----------------------------------------------------------------------
     # DATABASE POPULATION METHODS
     # ----------------------------------------------------------------------
@@ -1823,10 +2674,10 @@ class Database:
         self._db.logs.update_many({}, {"$set": {"waitlist_log": []}})
 
         log_info("Clearing disabled courses")
-        self._db.admin.update_one({}, {"$set": {"disabled_courses": []}})
+        self._update_admin({"$set": {"disabled_courses": []}})
 
         log_info("Resetting current notification count to 0")
-        self._db.admin.update_one({}, {"$set": {"stats_current_notifs": 0}})
+        self._update_admin({"$set": {"stats_current_notifs": 0}})
 
         clear_coll("mappings")
         clear_coll("courses")
@@ -1861,24 +2712,45 @@ class Database:
     def increment_email_counter(self, n):
         if n <= 0:
             return
-        self._db.admin.update_one(
-            {}, {"$inc": {"stats_total_notifs": n, "stats_current_notifs": n}}
+        self._update_admin(
+            {"$inc": {"stats_total_notifs": n, "stats_current_notifs": n}}
         )
 
+    # returns a copy of the admin document (without its logs) from the
+    # admin cache of this process (see admincache.py)
+
+    def _get_admin(self):
+        return get_admin_cache(self._db.admin).get()
+
+    # applies update to the admin document and drops the cached copy of
+    # this process (other processes drop theirs through the change stream
+    # or when it expires)
+
+    def _update_admin(self, update):
+        res = self._db.admin.update_one({}, update)
+        get_admin_cache(self._db.admin).invalidate()
+        return res
+
+    # performs write operations ops (e.g. UpdateOne, UpdateMany) on
+    # collection coll as a single ordered bulk write
+
+    def bulk_write(self, coll, ops):
+        if len(ops) == 0:
+            return None
+        return self._db[coll].bulk_write(ops, ordered=True)
+
     def _get_all_emails_csv(self, years=None):
         years = {"year": {"$in": years}} if years else {}
         data = self._db.users.find(years, {"_id": 0, "email": 1})
         emails = [k["email"] for k in data if k["email"] != "tigersnatch@princeton.edu"]
         return ",".join(emails)
 
-    # checks that all required collections are available in self._db;
+    # checks that all required collections are available in self._db and
+    # that every other collection is one that is created on first use;
     # raises a RuntimeError if not
 
     def _check_basic_integrity(self):
-        if COLLECTIONS != set(self._db.list_collection_names()):
-            raise RuntimeError(
-                "one or more database collections is misnamed and/or missing"
-            )
+        _check_basic_integrity(self._db)
 
     # turn Heroku maintenance mode ON (True) or OFF (False)
 
@@ -1913,17 +2785,28 @@ class Database:
         app = heroku_conn.apps()[HEROKU_APP_NAME]
         return app
 
-    # adds log message to logs array in system collection
+    # adds log message to logs array in system collection. the message is
+    # written in the background (see systemlog.py)
 
     def _add_system_log(self, type, meta, netid=None, print_=True, log_fn=log_system):
+        meta = self._system_log_doc(type, meta, netid=netid)
+        if "message" in meta and print_:
+            log_fn(meta["message"])
+            stdout.flush()
+        get_system_log_writer(self._db.system).add(meta)
+
+    # returns the system collection write operation performed by
+    # _add_system_log() (without printing), for use with bulk_write()
+
+    def system_log_op(self, type, meta, netid=None):
+        return InsertOne(self._system_log_doc(type, meta, netid=netid))
+
+    def _system_log_doc(self, type, meta, netid=None):
         meta["type"] = type
         meta["time"] = datetime.now(TZ)
         if netid is not None:
             meta["netid"] = netid
-        if "message" in meta and print_:
-            log_fn(meta["message"])
-            stdout.flush()
-        self._db.system.insert_one(meta)
+        return meta
 
     # prints database name, its collections, and the number of documents
     # in each collection
@@ -1946,6 +2829,104 @@ class Database:
             return found_key
         return None
 
+    # returns the cached OAuth token document with _id name in the form
+    # {"access_token": str, "expires_at": float (UNIX time)}, or None if
+    # no token has been cached yet
+
+    def get_oauth_token(self, name):
+        return self._db.tokens.find_one(
+            {"_id": name}, {"_id": 0, "access_token": 1, "expires_at": 1}
+        )
+
+    # tries to take the lock for refreshing OAuth token name for lock_secs
+    # seconds. returns True if this caller holds the lock, False if
+    # another process is already refreshing the token
+
+    def lock_oauth_token_refresh(self, name, lock_secs):
+        now = time()
+        self._db.tokens.update_one(
+            {"_id": name}, {"$setOnInsert": {"refreshing_until": 0}}, upsert=True
+        )
+        return (
+            self._db.tokens.find_one_and_update(
+                {"_id": name, "refreshing_until": {"$lt": now}},
+                {"$set": {"refreshing_until": now + lock_secs}},
+            )
+            is not None
+        )
+
+    # caches OAuth token access_token (valid until UNIX time expires_at)
+    # under name and releases the refresh lock
+
+    def set_oauth_token(self, name, access_token, expires_at):
+        self._db.tokens.update_one(
+            {"_id": name},
+            {
+                "$set": {
+                    "access_token": access_token,
+                    "expires_at": expires_at,
+                    "refreshing_until": 0,
+                }
+            },
+            upsert=True,
+        )
+
+    # marks cached OAuth token name as expired if it is still access_token
+    # (i.e. it was rejected by the API and has not been replaced yet)
+
+    def invalidate_oauth_token(self, name, access_token):
+        self._db.tokens.update_one(
+            {"_id": name, "access_token": access_token},
+            {"$set": {"expires_at": 0}},
+        )
+
+
+# sets the "enrollment", "capacity", and "isFull" of the class dictionary
+# class_dict of a course document from its enrollments document
+# class_data
+def _set_class_enrollment(class_dict, class_data, has_reserved_seats):
+    class_dict["enrollment"] = class_data["enrollment"]
+    class_dict["capacity"] = class_data["capacity"]
+    # we mark a class as full (i.e. allow subbing) if at least one is true:
+    #   1. capacity is non-zero and enrollment is at least as large as capacity
+    #   2. class has reserved seating and positive enrollment
+    #   3. class is closed
+    class_dict["isFull"] = (
+        (
+            class_dict["capacity"] > 0
+            and class_dict["enrollment"] >= class_dict["capacity"]
+        )
+        or (has_reserved_seats and class_dict["enrollment"] > 0)
+        or not class_dict["status_is_open"]
+    )
+
+
+# returns the time of last notif time (stored in UTC, without a timezone)
+# in ET formatted with fmt, or None if it is missing
+def _format_notif_time(time, fmt="%-m/%-d @ %-I:%M %p"):
+    try:
+        time = pytz.timezone("UTC").localize(time)
+        return time.astimezone(pytz.timezone("US/Eastern")).strftime(fmt)
+    except:
+        return None
+
+
+# checks that all required collections are available in the pymongo
+# database db and that every other collection is one that is created on
+# first use; raises a RuntimeError if not
+def _check_basic_integrity(db):
+    names = set(db.list_collection_names())
+    if not COLLECTIONS <= names or not names <= COLLECTIONS | LAZY_COLLECTIONS:
+        raise RuntimeError(
+            "one or more database collections is misnamed and/or missing"
+        )
+
+
+# returns the p-th percentile of the non-empty list values
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(int(p / 100 * len(values)), len(values) - 1)]
+
 
 if __name__ == "__main__":
     Database().set_live_notifs_status("active", "computing open spots")
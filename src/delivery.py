@@ -0,0 +1,129 @@
+# ----------------------------------------------------------------------
+# delivery.py
+# Contains DeliveryExecutor, a long-lived pool of sender threads used by
+# the notifications cycle to send emails and text messages. Sending is
+# network I/O, so each provider gets its own thread pool (sized by
+# EMAIL_MAX_WORKERS and SMS_MAX_WORKERS) and emails and texts are sent at
+# the same time. The send rate of each provider is capped by its rate
+# limiter (see providers.py).
+# ----------------------------------------------------------------------
+
+from concurrent.futures import ThreadPoolExecutor
+from sys import stderr
+from threading import Lock
+
+from config import EMAIL_MAX_WORKERS, SMS_MAX_WORKERS
+from cycletrace import CycleTrace
+from log_utils import *
+from notify import send_email, send_text
+from providers import get_send_rate
+
+# provider through which each channel is sent
+CHANNEL_PROVIDERS = {"email": "sendgrid", "sms": "twilio"}
+
+
+class DeliveryExecutor:
+    def __init__(
+        self, email_max_workers=EMAIL_MAX_WORKERS, sms_max_workers=SMS_MAX_WORKERS
+    ):
+        self._pools = {
+            "email": ThreadPoolExecutor(
+                max_workers=email_max_workers, thread_name_prefix="email"
+            ),
+            "sms": ThreadPoolExecutor(
+                max_workers=sms_max_workers, thread_name_prefix="sms"
+            ),
+        }
+        self._n_queued = {channel: 0 for channel in self._pools}
+        self._n_queued_lock = Lock()
+
+    # sends every email request in emails_args (lists of send_email()
+    # arguments, see Notify.send_emails_html()) and every text in
+    # texts_args (lists of send_text() arguments, see Notify.send_sms())
+    # concurrently. returns the lists of per-message results, in the order
+    # of the arguments: the provider message ID of each recipient of the
+    # message (None for those it was not sent to), or None if the send
+    # raised. waiting on the emails and then on the texts is recorded as
+    # the email_send and sms_send phases of trace, so sms_send only covers
+    # the texts still in flight once all emails are sent
+
+    def deliver(self, emails_args, texts_args, trace: CycleTrace = None):
+        email_futures = [self.submit("email", args) for args in emails_args]
+        text_futures = [self.submit("sms", args) for args in texts_args]
+        return wait_for_results(email_futures, text_futures, trace)
+
+    # queues the sending of a message over channel ("email" or "sms") with
+    # args (the send_email() or send_text() arguments) and returns its
+    # Future. messages of a channel are sent in the order they are queued
+
+    def submit(self, channel, args):
+        send = send_email if channel == "email" else send_text
+        with self._n_queued_lock:
+            self._n_queued[channel] += 1
+        future = self._pools[channel].submit(send, *args)
+        future.add_done_callback(lambda _: self._on_done(channel))
+        return future
+
+    # returns {channel: (sends per second, number of messages queued or
+    # in flight)} for the live notifs status
+
+    def get_status(self):
+        with self._n_queued_lock:
+            n_queued = dict(self._n_queued)
+        return {
+            channel: (get_send_rate(CHANNEL_PROVIDERS[channel]), n)
+            for channel, n in n_queued.items()
+        }
+
+    def _on_done(self, channel):
+        with self._n_queued_lock:
+            self._n_queued[channel] -= 1
+
+    # stops the sender threads after any messages in flight are sent
+
+    def shutdown(self):
+        for pool in self._pools.values():
+            pool.shutdown(wait=True)
+
+
+# waits for the email and text Futures returned by submit() and returns
+# their results (see deliver()). the waits are recorded as the email_send
+# and sms_send phases of trace if given
+def wait_for_results(email_futures, text_futures, trace: CycleTrace = None):
+    if trace is None:
+        trace = CycleTrace()
+
+    with trace.span("email_send") as counts:
+        emails_res = _get_results(email_futures)
+        counts["requests"] = len(emails_res)
+        counts["sent"] = count_sent(emails_res)
+    with trace.span("sms_send") as counts:
+        texts_res = _get_results(text_futures)
+        counts["texts"] = len(texts_res)
+        counts["sent"] = count_sent(texts_res)
+
+    return emails_res, texts_res
+
+
+# returns the number of recipients sent to over the per-message results
+# results (see deliver())
+def count_sent(results):
+    return sum(
+        sum(1 for message_id in res if message_id is not None)
+        for res in results
+        if res is not None
+    )
+
+
+# returns the result of each future in futures (None, i.e. nothing sent,
+# for a send that raised)
+def _get_results(futures):
+    res = []
+    for future in futures:
+        try:
+            res.append(future.result())
+        except Exception as e:
+            log_error("Failed to send notification")
+            print(e, file=stderr)
+            res.append(None)
+    return res
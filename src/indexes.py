@@ -0,0 +1,224 @@
+# ----------------------------------------------------------------------
+# indexes.py
+# Declares the indexes of the TigerSnatch database (INDEXES) and the
+# hot-path queries that must be served by one (HOT_QUERIES).
+# ensure_indexes() creates any missing index and is run by
+# _ensure_indexes.py on every deploy (see Procfile), and
+# verify_indexes() explains every hot-path query and reports those that
+# scan a whole collection. migrate_waitlists_index() turns the classid
+# index of the waitlists collection created before it was unique into a
+# unique one. Key functions: ensure_indexes(), verify_indexes(),
+# migrate_waitlists_index()
+# ----------------------------------------------------------------------
+
+from datetime import datetime
+from sys import stderr
+
+from pymongo.errors import OperationFailure
+
+from config import (
+    DELIVERY_RETENTION_DAYS,
+    METRICS_TTL_DAYS,
+    OUTBOX_RETENTION_DAYS,
+)
+from log_utils import *
+
+# error codes of creating an index whose keys or name match an existing
+# index with different options (e.g. a changed TTL)
+INDEX_CONFLICT_CODES = {85, 86}
+
+# list of (collection, keys, options) of the required indexes. options
+# are passed to create_index(); an index with expireAfterSeconds is a TTL
+# index whose expiry is updated in place when its config value changes
+INDEXES = [
+    ("users", [("netid", 1)], {}),
+    ("enrollments", [("classid", 1)], {}),
+    ("enrollments", [("courseid", 1)], {}),
+    # unique, so that concurrent subscriptions upserting the waitlist of
+    # a class cannot create two (see Database.add_to_waitlist()). an
+    # existing non-unique index is replaced by _ensure_indexes.py (see
+    # migrate_waitlists_index())
+    ("waitlists", [("classid", 1)], {"unique": True}),
+    ("mappings", [("courseid", 1)], {}),
+    ("courses", [("courseid", 1)], {}),
+    ("notifs", [("netid", 1)], {}),
+    ("logs", [("netid", 1)], {}),
+    ("api_keys", [("key", 1)], {}),
+    ("system", [("type", 1), ("time", -1)], {}),
+    (
+        "metrics",
+        [("time", 1)],
+        {"expireAfterSeconds": METRICS_TTL_DAYS * 24 * 60 * 60},
+    ),
+    ("outbox", [("status", 1), ("priority", 1), ("available_at", 1)], {}),
+    ("outbox", [("lease", 1)], {"sparse": True}),
+    (
+        "outbox",
+        [("done_at", 1)],
+        {"expireAfterSeconds": OUTBOX_RETENTION_DAYS * 24 * 60 * 60},
+    ),
+    ("deliveries", [("key", 1), ("sent_at", 1)], {}),
+    (
+        "deliveries",
+        [("updated_at", 1)],
+        {"expireAfterSeconds": DELIVERY_RETENTION_DAYS * 24 * 60 * 60},
+    ),
+]
+
+_SAMPLE_TIME = datetime(2000, 1, 1)
+
+# list of (collection, filter, sort) of the queries run per request or per
+# notifications cycle, with sample values. each must use an index
+HOT_QUERIES = [
+    ("users", {"netid": "x"}, None),
+    ("users", {"netid": {"$in": ["x", "y"]}}, None),
+    ("enrollments", {"classid": "x"}, None),
+    (
+        "enrollments",
+        {"classid": {"$in": ["x", "y"]}, "seats_fingerprint": {"$exists": True}},
+        None,
+    ),
+    ("enrollments", {"courseid": "x"}, None),
+    ("waitlists", {"classid": "x"}, None),
+    ("mappings", {"courseid": "x"}, None),
+    ("mappings", {"courseid": {"$in": ["x", "y"]}}, None),
+    ("courses", {"courseid": "x"}, None),
+    ("courses", {"courseid": {"$in": ["x", "y"]}}, None),
+    ("notifs", {"netid": "x"}, None),
+    ("notifs", {"netid": {"$in": ["x", "y"]}}, None),
+    ("logs", {"netid": "x"}, None),
+    ("api_keys", {"key": "x"}, None),
+    ("system", {"type": "cron", "time": {"$gte": _SAMPLE_TIME}}, [("time", -1)]),
+    (
+        "outbox",
+        {
+            "$or": [
+                {"status": "pending", "available_at": {"$lte": _SAMPLE_TIME}},
+                {"status": "leased", "lease_until": {"$lt": _SAMPLE_TIME}},
+            ]
+        },
+        [("priority", 1), ("available_at", 1)],
+    ),
+    ("outbox", {"lease": "x"}, None),
+    (
+        "deliveries",
+        {
+            "status": "sent",
+            "$or": [
+                {"_id": {"$in": ["x"]}},
+                {"key": {"$in": ["x"]}, "sent_at": {"$gte": _SAMPLE_TIME}},
+            ],
+        },
+        None,
+    ),
+]
+
+
+# creates the indexes of INDEXES that are missing from the pymongo
+# database db (a no-op for those that exist) and updates the expiry of
+# TTL indexes whose config value changed. an index that cannot be created
+# is logged and skipped. returns the names of the indexes ensured
+def ensure_indexes(db):
+    names = []
+    for coll, keys, options in INDEXES:
+        try:
+            names.append(_ensure_index(db, coll, keys, options))
+        except Exception as e:
+            log_error(f"Failed to create index {keys} on {coll}")
+            print(e, file=stderr)
+    return names
+
+
+def _ensure_index(db, coll, keys, options):
+    try:
+        return db[coll].create_index(keys, **options)
+    except OperationFailure as e:
+        if e.code not in INDEX_CONFLICT_CODES or "expireAfterSeconds" not in options:
+            raise
+    db.command(
+        "collMod",
+        coll,
+        index={
+            "keyPattern": dict(keys),
+            "expireAfterSeconds": options["expireAfterSeconds"],
+        },
+    )
+    log_info(f"Updated the expiry of TTL index {keys} on {coll}")
+    return "_".join(f"{key}_{direction}" for key, direction in keys)
+
+
+# merges the waitlists documents of the pymongo database db that share a
+# classid (which subscriptions racing before the classid index was
+# unique could create) into the oldest of them, keeping the order of the
+# subscribers. returns the number of classids merged
+def merge_duplicate_waitlists(db):
+    n_merged = 0
+    duplicates = db.waitlists.aggregate(
+        [
+            {"$sort": {"_id": 1}},
+            {
+                "$group": {
+                    "_id": "$classid",
+                    "ids": {"$push": "$_id"},
+                    "waitlists": {"$push": "$waitlist"},
+                }
+            },
+            {"$match": {"ids.1": {"$exists": True}}},
+        ]
+    )
+    for duplicate in duplicates:
+        waitlist = list(
+            dict.fromkeys(netid for w in duplicate["waitlists"] for netid in w)
+        )
+        db.waitlists.update_one(
+            {"_id": duplicate["ids"][0]}, {"$set": {"waitlist": waitlist}}
+        )
+        db.waitlists.delete_many({"_id": {"$in": duplicate["ids"][1:]}})
+        log_info(
+            f"Merged {len(duplicate['ids'])} waitlists of class {duplicate['_id']}"
+        )
+        n_merged += 1
+    return n_merged
+
+
+# makes the classid index of the waitlists collection of the pymongo
+# database db unique (see INDEXES), which create_index() cannot do to an
+# existing index: merges duplicate waitlists, then drops the index if it
+# is not unique and creates it again. returns the name of the index
+def migrate_waitlists_index(db):
+    merge_duplicate_waitlists(db)
+    for name, info in db.waitlists.index_information().items():
+        if list(info["key"]) == [("classid", 1)] and not info.get("unique", False):
+            db.waitlists.drop_index(name)
+            log_info(f"Dropped non-unique index {name} on waitlists")
+    return db.waitlists.create_index([("classid", 1)], unique=True)
+
+
+# explains every query of HOT_QUERIES against the pymongo database db and
+# returns the list of (collection, filter) of those whose winning plan
+# scans a whole collection (COLLSCAN)
+def verify_indexes(db):
+    res = []
+    for coll, filter, sort in HOT_QUERIES:
+        cursor = db[coll].find(filter)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        stages = plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+        if "COLLSCAN" in stages:
+            log_error(f"Query {filter} on {coll} does a COLLSCAN")
+            res.append((coll, filter))
+    return res
+
+
+# returns the set of stages (e.g. "IXSCAN", "FETCH", "COLLSCAN") in the
+# explain() plan tree plan
+def plan_stages(plan):
+    if isinstance(plan, list):
+        return set().union(*(plan_stages(p) for p in plan))
+    if not isinstance(plan, dict):
+        return set()
+    res = {plan["stage"]} if "stage" in plan else set()
+    for value in plan.values():
+        if isinstance(value, (dict, list)):
+            res |= plan_stages(value)
+    return res
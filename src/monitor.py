@@ -4,112 +4,232 @@
 # the database. Key class method: get_classes_with_changed_enrollments()
 # ----------------------------------------------------------------------
 
+import asyncio
+from datetime import datetime
 from sys import stderr
 from time import time
 
+import pytz
+
+from asyncmobileapp import AsyncMobileApp
 from config import COURSE_UPDATE_INTERVAL_MINS
 from coursewrapper import CourseWrapper
+from cycletrace import CycleTrace
 from database import Database
 from log_utils import *
+from mobileapp import MobileApp
 from monitor_utils import (
     get_course_in_mobileapp,
     get_latest_term,
     get_new_mobileapp_data,
+    get_seats_chunked_async,
+    is_section_unchanged,
+    parse_seats_data,
 )
+from writebuffer import WriteBuffer
 
 
 class Monitor:
-    def __init__(self, _db: Database):
+    # api is the MobileApp used to fetch seats in
+    # get_classes_with_changed_enrollments() (a new one per call if not
+    # given)
+
+    def __init__(self, _db: Database, api: MobileApp = None):
         self._db = _db
+        self._api = api
+        # classid -> last recorded seats fingerprint (see
+        # Database.get_seats_fingerprints()), loaded lazily from the db
+        self._fingerprints = {}
+        # classid -> seats fingerprint observed in the current cycle, not
+        # recorded until save_fingerprints()
+        self._pending_fingerprints = {}
 
     # organizes all waited-on classes into groups by their parent course
+    # (sections of disabled courses are skipped)
 
     def _construct_waited_classes(self):
-        waited_classes = list(self._db.get_waited_classes())
-        disabled_courses = self._db.get_disabled_courses()
-        data = {}
+        self._waited_classes = self._db.get_waited_classes_by_course()
 
-        for class_ in waited_classes:
-            classid = class_["classid"]
-            try:
-                deptnum, courseid = self._db.classid_to_course_info(classid)
-            except:
-                continue
-
-            # skip sections whose course is disabled
-            if courseid in disabled_courses:
-                log_notifs(f"{deptnum} (courseID {courseid}) is disabled - skipping")
-                continue
+    # _construct_waited_classes(), traced as the waitlist_load phase of
+    # trace
 
-            if courseid in data:
-                data[courseid].append(classid)
-            else:
-                data[courseid] = [deptnum, classid]
-
-        self._waited_classes = data
+    def _load_waitlists(self, trace: CycleTrace):
+        with trace.span("waitlist_load") as counts:
+            self._construct_waited_classes()
+            counts["courses"] = len(self._waited_classes)
+            counts["sections"] = sum(
+                len(classes) - 1 for classes in self._waited_classes.values()
+            )
 
-    # constructs CourseWrapper objects for all course buckets as
-    # specified in _construct_waited_classes()
+    # returns the list of courseids and the list of classids in
+    # _construct_waited_classes()
 
-    def _analyze_classes(self):
-        term = get_latest_term()
+    def _get_waited_ids(self):
         courseids = []
         classids = []
-
-        # build list of courseids and list of classids
         for courseid in self._waited_classes:
             courseids.append(courseid)
             classids.extend(self._waited_classes[courseid][1:])
+        return courseids, classids
+
+    # fetches the new enrollments and capacities of all course buckets as
+    # specified in _construct_waited_classes(), traced as the seat_fetch
+    # phase of trace. returns them with the set of courseids with reserved
+    # seats
+
+    def _analyze_classes(self, trace: CycleTrace):
+        with trace.span("seat_fetch") as counts:
+            term = get_latest_term(self._db)
+            courseids, classids = self._get_waited_ids()
+
+            reserved_courseids = self._db.get_courses_with_reserved_seats(courseids)
+
+            # get new enrollment and capacity for subscribed sections
+            new_enroll_all, new_cap_all = get_new_mobileapp_data(
+                term,
+                courseids,
+                classids,
+                default_empty_dicts=True,
+                db=self._db,
+                write_buffer=self._write_buffer,
+                reserved_courseids=reserved_courseids,
+                observed=self._observed,
+                api=self._api,
+            )
+            counts["courses"] = len(courseids)
+            counts["sections_observed"] = len(self._observed)
+
+        return new_enroll_all, new_cap_all, reserved_courseids
 
-        # get new enrollment and capacity for subscribed sections
-        new_enroll_all, new_cap_all = get_new_mobileapp_data(
-            term,
-            courseids,
-            classids,
-            default_empty_dicts=True,
-        )
+    # async version of _analyze_classes() that fetches seats with api and
+    # runs independent database queries at the same time as the requests
 
-        # construct list of CourseWrapper objects
+    async def _analyze_classes_async(self, api: AsyncMobileApp, trace: CycleTrace):
+        with trace.span("seat_fetch") as counts:
+            term = await asyncio.to_thread(get_latest_term, self._db)
+            courseids, classids = self._get_waited_ids()
+
+            reserved_courseids, data, _ = await asyncio.gather(
+                asyncio.to_thread(self._db.get_courses_with_reserved_seats, courseids),
+                get_seats_chunked_async(api, self._db, term, courseids),
+                asyncio.to_thread(self._load_fingerprints, classids),
+            )
+
+            # get new enrollment and capacity for subscribed sections
+            new_enroll_all, new_cap_all = parse_seats_data(
+                data,
+                courseids,
+                classids,
+                default_empty_dicts=True,
+                db=self._db,
+                write_buffer=self._write_buffer,
+                reserved_courseids=reserved_courseids,
+                observed=self._observed,
+            )
+            counts["courses"] = len(courseids)
+            counts["sections_observed"] = len(self._observed)
+
+        return new_enroll_all, new_cap_all, reserved_courseids
+
+    # constructs the list of CourseWrapper objects for the new enrollments
+    # and capacities of open classes (see get_new_mobileapp_data())
+
+    def _wrap_courses(
+        self, new_enroll_all, new_cap_all, reserved_courseids, prev_enrollments
+    ):
         course_wrappers = []
         for courseid in new_enroll_all:
             course_deptnum = self._waited_classes[courseid][0]
             new_enroll = new_enroll_all[courseid]
             new_cap = new_cap_all[courseid]
             course_wrapper = CourseWrapper(
-                course_deptnum, new_enroll, new_cap, courseid, self._db
+                course_deptnum,
+                new_enroll,
+                new_cap,
+                courseid,
+                courseid in reserved_courseids,
+                prev_enrollments,
+                self._write_buffer,
             )
             course_wrappers.append(course_wrapper)
 
         self._waited_course_wrappers = course_wrappers
 
-    # generates, caches, and returns a dictionary in the form:
-    # {
-    #   classid1: n_slots_available,
-    #   classid2: n_slots_available,
-    #   ...
-    # }
-    # the result is to be used to determine to whom notifications are to
-    # be sent. this method also updates the applicable enrollment data
-    # in the enrollments collection.
+    # loads the stored seats fingerprints of classids that are not in
+    # memory yet
 
-    def get_classes_with_changed_enrollments(self):
+    def _load_fingerprints(self, classids):
+        missing = [classid for classid in classids if classid not in self._fingerprints]
+        self._fingerprints.update(self._db.get_seats_fingerprints(missing))
+
+    # returns the subset of data (see get_classes_with_changed_enrollments())
+    # whose sections' seats fingerprints changed since they were last
+    # recorded or were last recorded at least MIN_NOTIFS_DELAY_MINS minutes
+    # ago. the fingerprints of all other observed sections are kept
+    # pending until save_fingerprints() is called
+
+    def _skip_unchanged_sections(self, data):
+        self._load_fingerprints(self._observed)
+
+        now = datetime.now(pytz.utc)
+        changed = {}
+        for classid, fingerprint in self._observed.items():
+            if is_section_unchanged(self._fingerprints.get(classid), fingerprint, now):
+                continue
+            self._pending_fingerprints[classid] = {
+                "fingerprint": fingerprint,
+                "time": now,
+            }
+            if classid in data:
+                changed[classid] = data[classid]
+
+        n_skipped = len(data) - len(changed)
+        if n_skipped > 0:
+            log_notifs(f"Skipped {n_skipped} sections with unchanged seats")
+        return changed
+
+    # records (in memory and in the enrollments collection, with one bulk
+    # write) the pending fingerprints of the sections of the last
+    # get_classes_with_changed_enrollments() that had no open spots or
+    # were handled (notified_classids: their notifications were stored,
+    # or none of their subscribers was due one). to be called once the
+    # notifications of the cycle are stored, so that a section whose
+    # notifications failed is not skipped as unchanged in the next cycles
+
+    def save_fingerprints(self, notified_classids):
         try:
-            return self._changed_enrollments
-        except:
-            pass
+            open_spots = self._changed_enrollments
+        except AttributeError:
+            open_spots = {}
+        pending, self._pending_fingerprints = self._pending_fingerprints, {}
+        write_buffer = WriteBuffer(self._db)
+        for classid, prev in pending.items():
+            if open_spots.get(classid, 0) > 0 and classid not in notified_classids:
+                continue
+            self._fingerprints[classid] = prev
+            write_buffer.update_seats_fingerprint(
+                classid, prev["fingerprint"], prev["time"]
+            )
+        return write_buffer.flush()
+
+    # resets the per-cycle state of get_classes_with_changed_enrollments()
+    # and returns the cycle start time
 
+    def _start_cycle(self):
         tic = time()
 
         log_notifs("Calculating open spots")
         self.update_live_notifs_state_active("Finding open spots...")
 
-        self._construct_waited_classes()
-        try:
-            self._waited_classes
-        except:
-            raise RuntimeError("missing _waited_classes")
+        self._write_buffer = WriteBuffer(self._db)
+        self._observed = {}
+        self._pending_fingerprints = {}
+        return tic
 
-        self._analyze_classes()
+    # returns the open spots of all classes wrapped in _wrap_courses()
+    # whose seats changed (see _skip_unchanged_sections())
+
+    def _get_open_spots(self):
         try:
             self._waited_course_wrappers
         except:
@@ -124,10 +244,108 @@ class Monitor:
             for class_, n_slots in course.get_available_slots().items():
                 data[class_] = n_slots
 
+        return self._skip_unchanged_sections(data)
+
+    # generates, caches, and returns a dictionary in the form:
+    # {
+    #   classid1: n_slots_available,
+    #   classid2: n_slots_available,
+    #   ...
+    # }
+    # the result is to be used to determine to whom notifications are to
+    # be sent. sections whose seats have not changed within the last
+    # MIN_NOTIFS_DELAY_MINS minutes are left out; their fingerprints are
+    # stored by save_fingerprints(). this method also updates the
+    # applicable enrollment data in the enrollments collection (and
+    # notifs history of closed classes) with one bulk write per
+    # collection. the waitlist_load, seat_fetch, and slot_compute phases
+    # are recorded in trace if given.
+
+    def get_classes_with_changed_enrollments(self, trace: CycleTrace = None):
+        try:
+            return self._changed_enrollments
+        except:
+            pass
+
+        if trace is None:
+            trace = CycleTrace()
+        tic = self._start_cycle()
+        self._load_waitlists(trace)
+        try:
+            self._waited_classes
+        except:
+            raise RuntimeError("missing _waited_classes")
+
+        new_enroll_all, new_cap_all, reserved_courseids = self._analyze_classes(trace)
+        with trace.span("slot_compute") as counts:
+            # prefetch previous enrollments of open classes with reserved seats
+            prev_enrollments = self._db.get_prev_enrollments_RESERVED_SEATS_ONLY(
+                _open_reserved_classids(new_enroll_all, reserved_courseids)
+            )
+            self._wrap_courses(
+                new_enroll_all, new_cap_all, reserved_courseids, prev_enrollments
+            )
+            data = self._get_open_spots()
+            self._write_buffer.flush()
+            counts["open_sections"] = len(data)
+
+        self._changed_enrollments = data
+        log_notifs(f"Calculated open spots: approx. {round(time()-tic)} seconds")
+        return self._changed_enrollments, len(self._waited_course_wrappers)
+
+    # async version of get_classes_with_changed_enrollments() that fetches
+    # seats with api (an AsyncMobileApp), keeping many seats requests and
+    # database operations in flight at once
+
+    async def get_classes_with_changed_enrollments_async(
+        self, api: AsyncMobileApp, trace: CycleTrace = None
+    ):
+        try:
+            return self._changed_enrollments
+        except:
+            pass
+
+        if trace is None:
+            trace = CycleTrace()
+        tic = await asyncio.to_thread(self._start_cycle)
+        await asyncio.to_thread(self._load_waitlists, trace)
+        try:
+            self._waited_classes
+        except:
+            raise RuntimeError("missing _waited_classes")
+
+        (
+            new_enroll_all,
+            new_cap_all,
+            reserved_courseids,
+        ) = await self._analyze_classes_async(api, trace)
+        with trace.span("slot_compute") as counts:
+            # prefetch previous enrollments of open classes with reserved seats
+            prev_enrollments = await asyncio.to_thread(
+                self._db.get_prev_enrollments_RESERVED_SEATS_ONLY,
+                _open_reserved_classids(new_enroll_all, reserved_courseids),
+            )
+            self._wrap_courses(
+                new_enroll_all, new_cap_all, reserved_courseids, prev_enrollments
+            )
+            data = self._get_open_spots()
+            await asyncio.to_thread(self._write_buffer.flush)
+            counts["open_sections"] = len(data)
+
         self._changed_enrollments = data
         log_notifs(f"Calculated open spots: approx. {round(time()-tic)} seconds")
         return self._changed_enrollments, len(self._waited_course_wrappers)
 
+    # clears the result cached by get_classes_with_changed_enrollments() so
+    # that a long-lived Monitor can compute open spots again for a new
+    # notifications cycle (recorded fingerprints are kept)
+
+    def clear_cache(self):
+        try:
+            del self._changed_enrollments
+        except AttributeError:
+            pass
+
     # updates all course data if it has been 2 minutes since last update
 
     def pull_course_updates(self, courseid):
@@ -148,7 +366,7 @@ class Monitor:
         except Exception as e:
             print(e, file=stderr)
 
-        current_term_code = get_latest_term()
+        current_term_code = get_latest_term(self._db)
 
         try:
             displayname = self._db.courseid_to_displayname(courseid)
@@ -185,6 +403,17 @@ class Monitor:
         self._db.set_live_notifs_status("countdown", "", update_countdown_data=False)
 
 
+# returns the classids in new_enroll_all (see get_new_mobileapp_data())
+# whose courses have reserved seats
+def _open_reserved_classids(new_enroll_all, reserved_courseids):
+    return [
+        classid
+        for courseid in new_enroll_all
+        if courseid in reserved_courseids
+        for classid in new_enroll_all[courseid]
+    ]
+
+
 if __name__ == "__main__":
     monitor = Monitor(Database())
     print(monitor.get_classes_with_changed_enrollments())
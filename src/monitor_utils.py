@@ -4,22 +4,188 @@
 # multiprocessing (top-level functions required).
 # ----------------------------------------------------------------------
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from time import sleep, time
+
+from asyncmobileapp import AsyncMobileApp
+from config import (
+    MIN_NOTIFS_DELAY_MINS,
+    SEATS_CHUNK_RETRIES,
+    SEATS_CHUNK_SIZE,
+    SEATS_MAX_IN_FLIGHT,
+    SEATS_MAX_WORKERS,
+    SEATS_RETRY_DELAY_SECS,
+)
 from database import Database
+from log_utils import *
 from mobileapp import MobileApp
+from writebuffer import WriteBuffer
+
+
+# gets the latest term code (using db if given)
+def get_latest_term(db: Database = None):
+    if db is None:
+        db = Database()
+    return db.get_current_term_code()[0]
+
+
+# fetches seat data for courseids from the courses/seats endpoint in chunks
+# of at most SEATS_CHUNK_SIZE courseIDs, with up to SEATS_MAX_WORKERS chunks
+# in flight at once. a failed chunk is retried on its own up to
+# SEATS_CHUNK_RETRIES times; if it still fails, its courses are logged and
+# left out of the result. returns the merged response in the same format
+# as MobileApp.get_seats()
+def get_seats_chunked(api: MobileApp, db: Database, term: str, courseids: list):
+    def fetch_chunk(chunk):
+        for attempt in range(SEATS_CHUNK_RETRIES + 1):
+            if attempt > 0:
+                sleep(SEATS_RETRY_DELAY_SECS * attempt)
+            tic = time()
+            try:
+                return api.get_seats(term=term, course_ids=",".join(chunk))
+            except Exception as e:
+                _log_seats_chunk_failure(api, db, term, chunk, attempt, tic, e)
+        _log_seats_chunk_skipped(chunk)
+        return None
+
+    chunks = _chunk_courseids(courseids)
+    if len(chunks) == 0:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(SEATS_MAX_WORKERS, len(chunks))) as pool:
+        responses = list(pool.map(fetch_chunk, chunks))
+
+    return _merge_seats_responses(responses)
+
+
+# async version of get_seats_chunked() for AsyncMobileApp, with up to
+# SEATS_MAX_IN_FLIGHT chunks in flight at once
+async def get_seats_chunked_async(
+    api: AsyncMobileApp, db: Database, term: str, courseids: list
+):
+    semaphore = asyncio.Semaphore(SEATS_MAX_IN_FLIGHT)
+
+    async def fetch_chunk(chunk):
+        async with semaphore:
+            for attempt in range(SEATS_CHUNK_RETRIES + 1):
+                if attempt > 0:
+                    await asyncio.sleep(SEATS_RETRY_DELAY_SECS * attempt)
+                tic = time()
+                try:
+                    return await api.get_seats(term=term, course_ids=",".join(chunk))
+                except Exception as e:
+                    await asyncio.to_thread(
+                        _log_seats_chunk_failure, api, db, term, chunk, attempt, tic, e
+                    )
+        _log_seats_chunk_skipped(chunk)
+        return None
+
+    chunks = _chunk_courseids(courseids)
+    if len(chunks) == 0:
+        return {}
+
+    responses = await asyncio.gather(*[fetch_chunk(chunk) for chunk in chunks])
+    return _merge_seats_responses(responses)
+
 
+def _chunk_courseids(courseids):
+    return [
+        courseids[i : i + SEATS_CHUNK_SIZE]
+        for i in range(0, len(courseids), SEATS_CHUNK_SIZE)
+    ]
 
-# gets the latest term code
-def get_latest_term():
-    return Database().get_current_term_code()[0]
+
+def _log_seats_chunk_failure(api, db, term, chunk, attempt, tic, e):
+    db._add_system_log(
+        "mobileapp",
+        {
+            "message": "MobileApp API query failed",
+            "response_time": time() - tic,
+            "endpoint": api.configs.COURSE_SEATS,
+            "args": {"term": term, "course_ids": ",".join(chunk)},
+            "attempt": attempt + 1,
+            "error": str(e),
+        },
+        print_=False,
+    )
+
+
+def _log_seats_chunk_skipped(chunk):
+    log_error(
+        f"Failed to get seats for {len(chunk)} courses after {SEATS_CHUNK_RETRIES + 1} attempts - skipping: {', '.join(chunk)}"
+    )
+
+
+# merges the courses/seats responses of all chunks that did not fail
+def _merge_seats_responses(responses):
+    responses = [res for res in responses if res is not None]
+    if len(responses) == 0:
+        return {}
+
+    data = {"course": []}
+    for res in responses:
+        data["course"].extend(res.get("course", []))
+    return data
 
 
 # returns two dictionaries: one containing new class enrollments, one
-# containing new class capacities
+# containing new class capacities. database writes for closed classes are
+# queued in write_buffer if given (the caller must flush it), otherwise
+# they are written before returning. reserved_courseids is the set of
+# courseids with reserved seats (fetched if not given). api is the
+# MobileApp used to fetch seats (a new one if not given). if observed is
+# given, it is filled with the seats fingerprint [enrollment, capacity,
+# status] of every subscribed class in the response, open or not
 def get_new_mobileapp_data(
-    term: str, courseids: list, classids: list, default_empty_dicts=False
+    term: str,
+    courseids: list,
+    classids: list,
+    default_empty_dicts=False,
+    db: Database = None,
+    write_buffer: WriteBuffer = None,
+    reserved_courseids: set = None,
+    observed: dict = None,
+    api: MobileApp = None,
+):
+    if db is None:
+        db = Database()
+    if api is None:
+        api = MobileApp(db=db)
+    data = get_seats_chunked(api, db, term, courseids)
+
+    buffer = write_buffer if write_buffer is not None else WriteBuffer(db)
+    res = parse_seats_data(
+        data,
+        courseids,
+        classids,
+        default_empty_dicts=default_empty_dicts,
+        db=db,
+        write_buffer=buffer,
+        reserved_courseids=reserved_courseids,
+        observed=observed,
+    )
+    if write_buffer is None:
+        buffer.flush()
+
+    return res
+
+
+# parses data, a courses/seats response (see get_seats_chunked()), into
+# the return value of get_new_mobileapp_data() (see there for the other
+# arguments). database writes for closed classes are queued in
+# write_buffer, which the caller must flush
+def parse_seats_data(
+    data: dict,
+    courseids: list,
+    classids: list,
+    default_empty_dicts=False,
+    db: Database = None,
+    write_buffer: WriteBuffer = None,
+    reserved_courseids: set = None,
+    observed: dict = None,
 ):
-    data = MobileApp().get_seats(term=term, course_ids=",".join(courseids))
-
     if "course" not in data:
         if default_empty_dicts:
             return {}, {}
@@ -29,7 +195,8 @@ def get_new_mobileapp_data(
     new_cap = {}
     courseids = set(courseids)
     classids = set(classids)
-    db = Database()
+    if reserved_courseids is None:
+        reserved_courseids = db.get_courses_with_reserved_seats(courseids)
 
     for course in data["course"]:
         courseid = course["course_id"]
@@ -39,7 +206,7 @@ def get_new_mobileapp_data(
         if "classes" not in course:
             continue
 
-        has_reserved_seats = db.does_course_have_reserved_seats(courseid)
+        has_reserved_seats = courseid in reserved_courseids
 
         """
         Create the following structure for each of new_cap and new_enroll:
@@ -62,19 +229,25 @@ def get_new_mobileapp_data(
             # skip classids that people are not subscribed to
             if classid not in classids:
                 continue
+            if observed is not None:
+                observed[classid] = [
+                    int(class_["enrollment"]),
+                    int(class_["capacity"]),
+                    class_["pu_calc_status"],
+                ]
             # skip classes whose status is not "Open" (enrollment is not possible)
             if class_["pu_calc_status"] != "Open":
                 # set number of open spots to 0 for all subscribers to this class
                 # ensures that notifications are sent after this sequence of events:
                 # 1. x spots open  2. x spots are taken and/or the class is closed
                 # 3. x spots open again/remain open within the non-notification time frame
-                db.update_users_notifs_history([], classid, 0)
+                write_buffer.update_users_notifs_history([], classid, 0)
 
                 # for classes with reserved seats that are currently Closed, update (rolling)
                 # previous enrollment with new enrollment. if a class is Open, this will
                 # happen in CourseWrapper.
                 if has_reserved_seats:
-                    db.update_prev_enrollment_RESERVED_SEATS_ONLY(
+                    write_buffer.update_prev_enrollment_RESERVED_SEATS_ONLY(
                         classid, int(class_["enrollment"])
                     )
                 continue
@@ -87,6 +260,17 @@ def get_new_mobileapp_data(
     return new_enroll, new_cap
 
 
+# returns whether a section whose seats fingerprint is fingerprint at time
+# now can skip the notifications pipeline given prev, its last recorded
+# fingerprint (see Database.get_seats_fingerprints()): that is, whether its
+# seats have not changed since prev was recorded less than
+# MIN_NOTIFS_DELAY_MINS minutes ago
+def is_section_unchanged(prev, fingerprint, now):
+    if prev is None or list(prev["fingerprint"]) != list(fingerprint):
+        return False
+    return now - prev["time"] < timedelta(minutes=MIN_NOTIFS_DELAY_MINS)
+
+
 # returns course data and parses its data into dictionaries
 # ready to be inserted into database collections
 def get_course_in_mobileapp(term, course_, curr_time, db: Database):
@@ -7,22 +7,24 @@ from datetime import datetime
 from sys import stderr
 
 import pytz
-from sendgrid import SendGridAPIClient
-from twilio.rest import Client
 
 from config import (
+    MAX_AUTO_RESUB_NOTIFS,
     MIN_NOTIFS_DELAY_MINS,
-    SENDGRID_API_KEY,
     TS_DOMAIN,
     TS_EMAIL,
-    TWILIO_PHONE,
-    TWILIO_SID,
-    TWILIO_TOKEN,
 )
+from log_utils import *
+from providers import ThrottledError, get_provider
+from writebuffer import WriteBuffer
 
 TZ_ET = pytz.timezone("US/Eastern")
 TZ_UTC = pytz.timezone("UTC")
 
+# max number of personalizations (recipients) SendGrid accepts in one
+# mail send request
+MAX_PERSONALIZATIONS = 1000
+
 
 class Notify:
     # initializes Notify, fetching all information about a given classid
@@ -33,6 +35,7 @@ class Notify:
         self._classid = classid
         self.n_new_slots = n_new_slots
         self.db = db
+        self._text_netids = []
         try:
             (
                 self._deptnum,
@@ -62,17 +65,7 @@ class Notify:
                         continue
 
                     history = db.get_user_notifs_history(netid, classid)
-                    open_spots_changed = n_new_slots != history["n_open_spots"]
-                    time_diff_mins = (
-                        datetime.now(TZ_ET) - TZ_UTC.localize(history["last_notif"])
-                    ).total_seconds() / 60
-                    notifs_delay_exceeded = (
-                        n_new_slots == history["n_open_spots"]
-                        and time_diff_mins >= MIN_NOTIFS_DELAY_MINS
-                    )
-
-                    # send notif if # open spots changes OR if last_notif time is >=MIN_NOTIFS_DELAY_MINS mins ago
-                    if open_spots_changed or notifs_delay_exceeded:
+                    if _is_notif_due(n_new_slots, history):
                         temp_netids.append(netid)
                 self._netids = temp_netids
 
@@ -99,6 +92,11 @@ class Notify:
                 f"unable to get notification data for subscriptions of class {classid} with error: {e}"
             )
 
+    # returns the classID of this Notify object
+
+    def get_classid(self):
+        return self._classid
+
     # returns the netIDs of this Notify object
 
     def get_netids(self):
@@ -109,60 +107,88 @@ class Notify:
     def get_phones(self):
         return self._phones
 
+    # returns the netIDs of the users texted by the last send_sms(), in
+    # the order of its send_text() arguments
+
+    def get_text_netids(self):
+        return self._text_netids
+
+    # returns the sending priority of this Notify object (lower is sent
+    # first): the number of open spots per notified user, so that the
+    # users with the slimmest chance of getting a spot hear first
+
+    def get_priority(self):
+        if len(self._netids) == 0:
+            return float("inf")
+        return self.n_new_slots / len(self._netids)
+
     # returns the deptnum + section name of this Notify object
 
     def get_name(self):
         return f'<a class="text-decoration-underline text-dark" href="{TS_DOMAIN}/course?courseid={self._courseid}&skip" target="_blank style="cursor: pointer">{self._deptnum}</a> {self._sectionname}'
 
-    # sends a formatted email
+    # returns whether the i-th user of this Notify object stays subscribed
+    # after being notified (see Database.get_user_auto_resub())
+
+    def _get_auto_resub(self, i, print_max_resub_msg=False):
+        return self.db.get_user_auto_resub(
+            self._netids[i],
+            classid=self._classid,
+            print_max_resub_msg=print_max_resub_msg,
+        )
+
+    # unsubscribes the i-th user of this Notify object from its class
+
+    def _unsubscribe(self, i):
+        self.db.remove_from_waitlist(self._netids[i], self._classid)
+
+    def _add_system_log(self, type, meta, netid):
+        self.db._add_system_log(type, meta, netid=netid, print_=False)
+
+    # returns the send_email() arguments for notifying all users of this
+    # Notify object by email: one SendGrid request per email template
+    # (and per MAX_PERSONALIZATIONS users), with a personalization for
+    # each user
 
     def send_emails_html(self):
-        send_email_args = []
+        personalizations = {}
         for i in range(len(self._emails)):
             try:
                 if self._has_reserved_seats:
-                    if self.db.get_user_auto_resub(
-                        self._netids[i], classid=self._classid
-                    ):
+                    if self._get_auto_resub(i):
                         # yes auto-resub | yes reserved seats
                         template_id = "d-b32c7a8c99f2491899322ced801b216b"
                     else:
                         # no auto-resub | yes reserved seats
                         template_id = "d-632e8760499b40d680742b9acdb8d129"
                 else:
-                    if self.db.get_user_auto_resub(
-                        self._netids[i], classid=self._classid
-                    ):
+                    if self._get_auto_resub(i):
                         # yes auto-resub | no reserved seats
                         template_id = "d-c04bc32123ea45ec80889919cc5c377e"
                     else:
                         # no auto-resub | no reserved seats
                         template_id = "d-2607514c41ef48cdb649bad3d4f0c660"
 
-                data = {
-                    "personalizations": [
-                        {
-                            "to": [{"email": self._emails[i]}],
-                            "dynamic_template_data": {
-                                "netid": self._netids[i],
-                                "sectionname": self._sectionname,
-                                "coursename": self._coursename,
-                                "deptnum": self._deptnum,
-                                "tigerhub_url": "https://phubprod.princeton.edu/psp/phubprod/?cmd=start",
-                                "dashboard_url": f"{TS_DOMAIN}/dashboard?&skip&ref=email",
-                                "course_url": f"{TS_DOMAIN}/course?query=&courseid={self._courseid}&skip&ref=email",
-                                "n_open_spots": self.n_new_slots,
-                                "n_other_students": len(self._netids) - 1,
-                            },
-                        }
-                    ],
-                    "from": {"email": TS_EMAIL, "name": "TigerSnatch"},
-                    "template_id": template_id,
-                }
-
-                send_email_args.append([data])
+                if template_id not in personalizations:
+                    personalizations[template_id] = []
+                personalizations[template_id].append(
+                    {
+                        "to": [{"email": self._emails[i]}],
+                        "dynamic_template_data": {
+                            "netid": self._netids[i],
+                            "sectionname": self._sectionname,
+                            "coursename": self._coursename,
+                            "deptnum": self._deptnum,
+                            "tigerhub_url": "https://phubprod.princeton.edu/psp/phubprod/?cmd=start",
+                            "dashboard_url": f"{TS_DOMAIN}/dashboard?&skip&ref=email",
+                            "course_url": f"{TS_DOMAIN}/course?query=&courseid={self._courseid}&skip&ref=email",
+                            "n_open_spots": self.n_new_slots,
+                            "n_other_students": len(self._netids) - 1,
+                        },
+                    }
+                )
 
-                self.db._add_system_log(
+                self._add_system_log(
                     "notif_email",
                     {
                         "netid": self._netids[i],
@@ -174,12 +200,23 @@ class Notify:
                         "reserved_seats": self._has_reserved_seats,
                         "email": self._emails[i],
                     },
-                    netid=self._netids[i],
-                    print_=False,
+                    self._netids[i],
                 )
             except Exception as e:
                 print(e, file=stderr)
 
+        send_email_args = []
+        for template_id, template_personalizations in personalizations.items():
+            for i in range(0, len(template_personalizations), MAX_PERSONALIZATIONS):
+                data = {
+                    "personalizations": template_personalizations[
+                        i : i + MAX_PERSONALIZATIONS
+                    ],
+                    "from": {"email": TS_EMAIL, "name": "TigerSnatch"},
+                    "template_id": template_id,
+                }
+                send_email_args.append([data])
+
         return send_email_args
 
     # sends an SMS
@@ -189,11 +226,10 @@ class Notify:
         msg_unsubbed = f"{self._sectionname} in {self._deptnum} has {self.n_new_slots} open spot(s)! {len(self._netids) - 1} other student(s) notified. {reserved if self._has_reserved_seats else ''}You've been unsubscribed from this section. Resubscribe: {TS_DOMAIN}/course?courseid={self._courseid}&skip&ref=sms"
         msg_resubbed = f"{self._sectionname} in {self._deptnum} has {self.n_new_slots} open spot(s)! {len(self._netids) - 1} other student(s) notified. {reserved if self._has_reserved_seats else ''}Unsubscribe: {TS_DOMAIN}/dashboard?&skip&ref=sms"
         send_text_args = []
+        self._text_netids = []
         for i, phone in enumerate(self._phones):
             try:
-                is_auto_resub = self.db.get_user_auto_resub(
-                    self._netids[i], classid=self._classid, print_max_resub_msg=True
-                )
+                is_auto_resub = self._get_auto_resub(i, print_max_resub_msg=True)
                 if phone != "":
                     send_text_args.append(
                         [
@@ -201,11 +237,12 @@ class Notify:
                             msg_resubbed if is_auto_resub else msg_unsubbed,
                         ]
                     )
+                    self._text_netids.append(self._netids[i])
                 if not is_auto_resub:
-                    self.db.remove_from_waitlist(self._netids[i], self._classid)
+                    self._unsubscribe(i)
 
                 if phone != "":
-                    self.db._add_system_log(
+                    self._add_system_log(
                         "notif_text",
                         {
                             "netid": self._netids[i],
@@ -217,8 +254,7 @@ class Notify:
                             "reserved_seats": self._has_reserved_seats,
                             "phone": phone,
                         },
-                        netid=self._netids[i],
-                        print_=False,
+                        self._netids[i],
                     )
             except Exception as e:
                 print(e, file=stderr)
@@ -236,26 +272,227 @@ class Notify:
         return ret
 
 
+class NotifyBatch:
+    # initializes NotifyBatch, fetching all information needed to notify
+    # the subscribers of every classid in new_slots (as returned by
+    # Monitor.get_classes_with_changed_enrollments()) with a fixed number
+    # of queries, independent of the number of classes and subscribers.
+    # all resulting database writes are queued until flush() is called
+
+    def __init__(self, new_slots, db):
+        self.db = db
+        self._write_buffer = WriteBuffer(db)
+        self._removals = {}
+        self._notifies = []
+
+        classids = []
+        for classid, n_new_slots in new_slots.items():
+            if n_new_slots == 0:
+                # cover edge case where the number of open spots is 0
+                # this case should already be covered in get_new_mobileapp_data(), but
+                # we are keeping this logic for precaution
+                self._write_buffer.update_users_notifs_history([], classid, 0)
+                continue
+            classids.append(classid)
+
+        classinfo = db.classids_to_classinfo(classids)
+        waitlists = db.get_class_waitlists(classids)
+        netids = set(netid for waitlist in waitlists.values() for netid in waitlist)
+        users = db.get_users_by_netid(netids, ["email", "phone", "auto_resub"])
+        notifs_histories = db.get_users_notifs_histories(netids, classids)
+
+        for classid in classids:
+            try:
+                notify = _BatchedNotify(
+                    self,
+                    classid,
+                    new_slots[classid],
+                    classinfo[classid],
+                    waitlists[classid],
+                    users,
+                    notifs_histories,
+                )
+            except Exception as e:
+                print(
+                    f"unable to get notification data for subscriptions of class {classid} with error: {e}",
+                    file=stderr,
+                )
+                continue
+            self._notifies.append(notify)
+        self._notifies.sort(key=lambda notify: notify.get_priority())
+
+    # returns a Notify-like object for each class with open spots, in
+    # increasing order of priority (see Notify.get_priority())
+
+    def get_notifies(self):
+        return self._notifies
+
+    # writes all queued database updates, then unsubscribes all notified
+    # users who are not auto-resubscribed
+
+    def flush(self):
+        self._write_buffer.flush()
+        removals, self._removals = self._removals, {}
+        self.db.remove_from_waitlists_bulk(removals)
+
+
+class _BatchedNotify(Notify):
+    # Notify for a single class of a NotifyBatch: reads from the data the
+    # batch prefetched and queues writes in the batch instead of accessing
+    # the database
+
+    def __init__(
+        self, batch, classid, n_new_slots, classinfo, waitlist, users, histories
+    ):
+        self._batch = batch
+        self._classid = classid
+        self.n_new_slots = n_new_slots
+        self.db = batch.db
+        self._text_netids = []
+        (
+            self._deptnum,
+            self._title,
+            self._sectionname,
+            self._courseid,
+            self._has_reserved_seats,
+        ) = classinfo
+        self._coursename = f"{self._deptnum}: {self._title}"
+        self._users = users
+        self._histories = {
+            netid: histories.get(netid, {}).get(classid) for netid in waitlist
+        }
+        self._netids = [netid for netid in waitlist if netid in users]
+
+        user_log = f"{n_new_slots} spot{'s'[:n_new_slots^1]} available in {self._deptnum} {self._sectionname}"
+
+        # courses with reserved seating use different logic for notifying
+        # (see Notify.__init__())
+        if not self._has_reserved_seats:
+            self._netids = [
+                netid
+                for netid in self._netids
+                if not users[netid].get("auto_resub", False)
+                or _is_notif_due(n_new_slots, self._histories[netid])
+            ]
+
+        buffer = batch._write_buffer
+        buffer.update_users_notifs_history(
+            self._netids,
+            classid,
+            n_new_slots,
+            reserved_seats=self._has_reserved_seats,
+        )
+
+        self._emails = [users[netid]["email"] for netid in self._netids]
+        self._phones = [users[netid].get("phone", "") for netid in self._netids]
+        for netid in self._netids:
+            buffer.update_user_waitlist_log(netid, user_log)
+
+        if len(self._netids) > 0:
+            buffer.update_time_of_last_notif(classid)
+
+    # same as Notify._get_auto_resub(), accounting for the notification
+    # counter increment queued in __init__()
+
+    def _get_auto_resub(self, i, print_max_resub_msg=False):
+        netid = self._netids[i]
+        if not self._users[netid].get("auto_resub", False):
+            return False
+
+        history = self._histories[netid] or {}
+        if history.get("num_notifs", 0) + 1 >= MAX_AUTO_RESUB_NOTIFS:
+            if print_max_resub_msg:
+                log_info(
+                    f"User {netid} reached maximum auto resubs ({MAX_AUTO_RESUB_NOTIFS}) for classID {self._classid}"
+                )
+            return False
+
+        return True
+
+    def _unsubscribe(self, i):
+        removals = self._batch._removals
+        if self._classid not in removals:
+            removals[self._classid] = []
+        removals[self._classid].append(self._netids[i])
+
+    def _add_system_log(self, type, meta, netid):
+        self._batch._write_buffer.add_system_log(type, meta, netid=netid)
+
+
+# returns whether an auto-resubscribed user with notifs collection data
+# history for a class should be notified of its n_new_slots open spots
+# (see Notify.__init__())
+def _is_notif_due(n_new_slots, history):
+    if history is None:
+        return True
+
+    open_spots_changed = n_new_slots != history["n_open_spots"]
+    time_diff_mins = (
+        datetime.now(TZ_ET) - TZ_UTC.localize(history["last_notif"])
+    ).total_seconds() / 60
+    notifs_delay_exceeded = (
+        n_new_slots == history["n_open_spots"]
+        and time_diff_mins >= MIN_NOTIFS_DELAY_MINS
+    )
+
+    # send notif if # open spots changes OR if last_notif time is >=MIN_NOTIFS_DELAY_MINS mins ago
+    return open_spots_changed or notifs_delay_exceeded
+
+
+# sends the SendGrid mail send request data and returns the SendGrid
+# message ID of each of its recipients (personalizations), None for those
+# it was not sent to. if a request for several recipients fails, it is
+# retried as one request per recipient so that one bad address does not
+# block the others
 def send_email(data):
+    client = get_provider("sendgrid")
+    n = len(data["personalizations"])
     try:
-        SendGridAPIClient(SENDGRID_API_KEY).client.mail.send.post(request_body=data)
-        return True
+        return [client.send(data)] * n
+    except ThrottledError as e:
+        # requests for each recipient would be throttled too
+        print(e, file=stderr)
+        return [None] * n
     except Exception as e:
         print(e, file=stderr)
-        return False
+        if n == 1:
+            return [None]
+
+    log_warning(
+        f"Failed to send email to {n} recipients at once - sending individually"
+    )
+    ids = []
+    for personalization in data["personalizations"]:
+        single = dict(data, personalizations=[personalization])
+        try:
+            ids.append(client.send(single))
+        except Exception as e:
+            print(e, file=stderr)
+            ids.append(None)
+    return ids
+
 
+# returns the number of recipients of the send_email() arguments args
+def count_email_recipients(args):
+    return len(args[0]["personalizations"])
 
+
+# returns the netIDs of the recipients of the send_email() arguments args
+def get_email_netids(args):
+    return [
+        personalization["dynamic_template_data"]["netid"]
+        for personalization in args[0]["personalizations"]
+    ]
+
+
+# texts msg to phone and returns [its Twilio message SID], or [None] if it
+# was not sent
 def send_text(phone, msg):
     try:
-        Client(TWILIO_SID, TWILIO_TOKEN).api.account.messages.create(
-            to=f"+1{phone}",
-            from_=TWILIO_PHONE,
-            body=msg,
-        )
-        return True
+        return [get_provider("twilio").send(phone, msg)]
     except Exception as e:
         print(e, file=stderr)
-        return False
+        return [None]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,356 @@
+# ----------------------------------------------------------------------
+# outbox.py
+# Contains the notification outbox. Every notification email and text
+# message is stored in the outbox collection (see outbox_message())
+# before the notified users' notifs history is updated, so none are lost
+# if the notifs dyno stops mid-cycle. OutboxWorker drains the outbox:
+# it leases due messages, sends them with a DeliveryExecutor, retries
+# failed ones with exponential backoff, and dead-letters those that fail
+# OUTBOX_MAX_ATTEMPTS times. OutboxStream sends the messages of a cycle
+# as soon as they are stored. The outcome of each notification is kept
+# as a delivery record per recipient, and recipients already notified of
+# the same open spots (in the same cycle, or in any cycle within
+# DELIVERY_DEDUPE_WINDOW_SECS) are skipped.
+# ----------------------------------------------------------------------
+
+import json
+from datetime import datetime, timedelta
+from hashlib import sha1
+from os import getpid
+from socket import gethostname
+from sys import stderr
+
+import pytz
+from bson import ObjectId
+
+from config import (
+    OUTBOX_CLAIM_BATCH,
+    OUTBOX_LEASE_SECS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_DELAY_SECS,
+    OUTBOX_RETRY_MAX_DELAY_SECS,
+)
+from cycletrace import CycleTrace
+from database import Database
+from delivery import DeliveryExecutor, count_sent, wait_for_results
+from log_utils import *
+
+
+# returns the outbox document of a notification to send over channel
+# ("email" or "sms") with args (the send_email() or send_text()
+# arguments) to the subscribers netids (in the order of the recipients of
+# args) of class classid, which has n_open_spots open spots, decided in
+# the notifications cycle with id cycle_id. its _id is an idempotency
+# key, so storing the same notification twice in a cycle stores it once.
+# due messages are sent in increasing order of priority (see
+# Notify.get_priority())
+def outbox_message(cycle_id, classid, channel, args, netids, n_open_spots, priority=0):
+    digest = sha1(json.dumps([channel, args], sort_keys=True).encode()).hexdigest()
+    now = datetime.now(pytz.utc)
+    return {
+        "_id": f"{cycle_id}:{digest}",
+        "cycle_id": cycle_id,
+        "classid": classid,
+        "n_open_spots": n_open_spots,
+        "channel": channel,
+        "args": args,
+        "netids": netids,
+        "priority": priority,
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "available_at": now,
+    }
+
+
+# returns the key under which notifications over channel to netid of
+# n_open_spots open spots in class classid are deduplicated. the delivery
+# record of such a notification in cycle cycle_id has _id
+# f"{cycle_id}:{key}"
+def delivery_key(channel, netid, classid, n_open_spots):
+    return f"{channel}:{netid}:{classid}:{n_open_spots}"
+
+
+# returns the number of seconds to wait before retrying a message that
+# failed on attempt number attempts (starting at 1)
+def retry_delay_secs(attempts):
+    return min(
+        OUTBOX_RETRY_DELAY_SECS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_DELAY_SECS
+    )
+
+
+class OutboxWorker:
+    # db is the Database holding the outbox (a new one if not given) and
+    # delivery the DeliveryExecutor that sends the messages (a new one,
+    # shut down by close(), if not given)
+
+    def __init__(self, db: Database = None, delivery: DeliveryExecutor = None):
+        self._db = db if db is not None else Database()
+        self._owns_delivery = delivery is None
+        self._delivery = delivery if delivery is not None else DeliveryExecutor()
+        self._worker_id = f"{gethostname()}:{getpid()}"
+
+    # sends due outbox messages, OUTBOX_CLAIM_BATCH at a time, until none
+    # are left. returns the per-message results of the emails and texts
+    # sent (see DeliveryExecutor.deliver()), whose sending is recorded in
+    # trace if given
+
+    def drain(self, trace: CycleTrace = None):
+        emails_res, texts_res = [], []
+        while True:
+            msgs = self._db.claim_outbox_messages(self._worker_id, OUTBOX_CLAIM_BATCH)
+            if len(msgs) == 0:
+                break
+            batch_emails_res, batch_texts_res = self._send(msgs, trace)
+            emails_res.extend(batch_emails_res)
+            texts_res.extend(batch_texts_res)
+
+        n_sent = count_sent(emails_res) + count_sent(texts_res)
+        if n_sent > 0:
+            self._db.increment_email_counter(n_sent)
+        return emails_res, texts_res
+
+    # sends the leased messages msgs to the recipients not yet notified
+    # and records their outcomes
+
+    def _send(self, msgs, trace):
+        msgs, skipped = _skip_delivered(self._db, msgs)
+        emails = [msg for msg in msgs if msg["channel"] == "email"]
+        texts = [msg for msg in msgs if msg["channel"] == "sms"]
+        emails_res, texts_res = self._delivery.deliver(
+            [msg["args"] for msg in emails], [msg["args"] for msg in texts], trace
+        )
+        _record_outcomes(self._db, emails + texts, emails_res + texts_res, skipped)
+        return emails_res, texts_res
+
+    # returns an OutboxStream that sends messages through this worker as
+    # they are stored
+
+    def stream(self, trace: CycleTrace = None):
+        return OutboxStream(self._db, self._delivery, self._worker_id, trace)
+
+    # returns the send rates and queue depths of the DeliveryExecutor (see
+    # DeliveryExecutor.get_status())
+
+    def get_delivery_status(self):
+        return self._delivery.get_status()
+
+    # stops the DeliveryExecutor if this worker created it
+
+    def close(self):
+        if self._owns_delivery:
+            self._delivery.shutdown()
+
+
+class OutboxStream:
+    # stores messages leased to worker_id and queues them on delivery right
+    # away, so that the first sections of a cycle are notified while later
+    # ones are still being resolved. if the process stops before finish(),
+    # the leases expire and the messages are sent by another drain. the
+    # time from the start of trace to the first message sent is recorded
+
+    def __init__(self, db, delivery, worker_id, trace: CycleTrace = None):
+        self._db = db
+        self._delivery = delivery
+        self._worker_id = worker_id
+        self._trace = trace
+        self._lease = f"{worker_id}:{ObjectId()}"
+        self._ids = set()
+        self._msgs = {"email": [], "sms": []}
+        self._futures = {"email": [], "sms": []}
+        self._sent_at = {}
+        self.first_sent_secs = None
+
+    # stores the messages msgs (see outbox_message()) and queues them to
+    # be sent to the recipients not yet notified
+
+    def send(self, msgs):
+        now = datetime.now(pytz.utc)
+        msgs = [msg for msg in msgs if msg["_id"] not in self._ids]
+        self._ids.update(msg["_id"] for msg in msgs)
+        msgs, _ = _skip_delivered(self._db, msgs)
+        for msg in msgs:
+            msg.update(
+                {
+                    "status": "leased",
+                    "lease": self._lease,
+                    "lease_until": now + timedelta(seconds=OUTBOX_LEASE_SECS),
+                    "attempts": 1,
+                }
+            )
+        self._db.add_outbox_messages(msgs)
+
+        for msg in msgs:
+            future = self._delivery.submit(msg["channel"], msg["args"])
+            future.add_done_callback(
+                lambda future, msg_id=msg["_id"]: self._on_sent(msg_id, future)
+            )
+            self._msgs[msg["channel"]].append(msg)
+            self._futures[msg["channel"]].append(future)
+
+    # waits for all queued messages to be sent, records their outcomes,
+    # and returns their per-message results (see
+    # DeliveryExecutor.deliver())
+
+    def finish(self):
+        emails_res, texts_res = wait_for_results(
+            self._futures["email"], self._futures["sms"], self._trace
+        )
+        _record_outcomes(
+            self._db,
+            self._msgs["email"] + self._msgs["sms"],
+            emails_res + texts_res,
+            sent_at=self._sent_at,
+        )
+
+        n_sent = count_sent(emails_res) + count_sent(texts_res)
+        if n_sent > 0:
+            self._db.increment_email_counter(n_sent)
+        return emails_res, texts_res
+
+    def _on_sent(self, msg_id, future):
+        self._sent_at[msg_id] = datetime.now(pytz.utc)
+        if self.first_sent_secs is not None or future.exception() is not None:
+            return
+        if count_sent([future.result()]) > 0 and self._trace is not None:
+            self.first_sent_secs = self._trace.elapsed()
+
+
+# returns the messages of msgs with the recipients already notified of
+# the same open spots removed (see Database.get_delivered_keys()), and
+# the messages left without recipients. the messages are returned as
+# they are if the delivery records cannot be read
+def _skip_delivered(db, msgs):
+    keys = {
+        msg["_id"]: [
+            delivery_key(msg["channel"], netid, msg["classid"], msg["n_open_spots"])
+            for netid in msg["netids"]
+        ]
+        for msg in msgs
+    }
+    try:
+        delivered = db.get_delivered_keys(
+            [f"{msg['cycle_id']}:{key}" for msg in msgs for key in keys[msg["_id"]]],
+            [key for msg in msgs for key in keys[msg["_id"]]],
+        )
+    except Exception as e:
+        log_error("Failed to read notification delivery records")
+        print(e, file=stderr)
+        return msgs, []
+
+    to_send, skipped = [], []
+    for msg in msgs:
+        is_delivered = [key in delivered for key in keys[msg["_id"]]]
+        if not any(is_delivered):
+            to_send.append(msg)
+            continue
+        log_notifs(
+            f"Skipping {sum(is_delivered)} already notified recipient(s) of {msg['channel']} notification {msg['_id']} for classID {msg['classid']}"
+        )
+        if all(is_delivered):
+            skipped.append(msg)
+            continue
+        # only emails have several recipients
+        data = msg["args"][0]
+        msg["args"] = [
+            dict(
+                data,
+                personalizations=[
+                    personalization
+                    for personalization, done in zip(
+                        data["personalizations"], is_delivered
+                    )
+                    if not done
+                ],
+            )
+        ]
+        msg["netids"] = [
+            netid for netid, done in zip(msg["netids"], is_delivered) if not done
+        ]
+        to_send.append(msg)
+    return to_send, skipped
+
+
+# records the outcomes results (see DeliveryExecutor.deliver()) of the
+# leased messages msgs (sent when they are in sent_at, and now otherwise):
+# sent, pending for a retry of its unsent recipients, or dead-lettered,
+# and the delivery record of each recipient. the leased messages skipped
+# (see _skip_delivered()) are marked as such
+def _record_outcomes(db, msgs, results, skipped=(), sent_at=None):
+    now = datetime.now(pytz.utc)
+    ops = [
+        db.outbox_update_op(msg, {"status": "skipped", "done_at": now})
+        for msg in skipped
+    ]
+    records = []
+    for msg, res in zip(msgs, results):
+        message_ids = res if res is not None else [None] * len(msg["netids"])
+        n_sent = count_sent([message_ids])
+        if n_sent == len(message_ids):
+            fields = {"status": "sent", "n_sent": n_sent, "done_at": now}
+        elif msg["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            log_error(
+                f"Giving up on {msg['channel']} notification {msg['_id']} for classID {msg['classid']} after {msg['attempts']} attempts"
+            )
+            fields = {
+                "status": "dead",
+                "n_sent": n_sent,
+                "error": "send failed",
+                "done_at": now,
+            }
+        else:
+            fields = {
+                "status": "pending",
+                "error": "send failed",
+                "available_at": now
+                + timedelta(seconds=retry_delay_secs(msg["attempts"])),
+            }
+        ops.append(db.outbox_update_op(msg, fields))
+        records.extend(
+            _delivery_records(msg, message_ids, (sent_at or {}).get(msg["_id"], now))
+        )
+
+    try:
+        db.bulk_write("outbox", ops)
+        db.add_delivery_records(records)
+    except Exception as e:
+        # leases expire, so unrecorded messages are sent again
+        log_error("Failed to record outbox message outcomes")
+        print(e, file=stderr)
+
+
+# returns the delivery record of each recipient of the message msg sent at
+# sent_at with the provider message IDs message_ids (see
+# DeliveryExecutor.deliver())
+def _delivery_records(msg, message_ids, sent_at):
+    created_at = msg["created_at"]
+    if created_at.tzinfo is None:
+        # datetimes read from MongoDB are naive UTC
+        created_at = pytz.utc.localize(created_at)
+
+    records = []
+    for netid, message_id in zip(msg["netids"], message_ids):
+        key = delivery_key(msg["channel"], netid, msg["classid"], msg["n_open_spots"])
+        record = {
+            "_id": f"{msg['cycle_id']}:{key}",
+            "key": key,
+            "cycle_id": msg["cycle_id"],
+            "channel": msg["channel"],
+            "netid": netid,
+            "classid": msg["classid"],
+            "n_open_spots": msg["n_open_spots"],
+            "outbox_id": msg["_id"],
+            "attempts": msg["attempts"],
+            "status": "failed",
+        }
+        if message_id is not None:
+            record.update(
+                {
+                    "status": "sent",
+                    "provider_message_id": message_id,
+                    "sent_at": sent_at,
+                    "latency_secs": (sent_at - created_at).total_seconds(),
+                }
+            )
+        records.append(record)
+    return records
@@ -0,0 +1,250 @@
+# ----------------------------------------------------------------------
+# providers.py
+# Contains the clients of the notification providers (SendGrid for
+# emails, Twilio for text messages) and a registry that keeps one
+# long-lived client per provider in each thread of each process, so
+# that their HTTP connections are pooled and reused across messages.
+# Every call is timed and rate limited per provider account, and calls
+# throttled by the provider (429 Too Many Requests) are retried once its
+# Retry-After has passed. Key functions: get_provider(),
+# get_provider_stats(), get_send_rate()
+# ----------------------------------------------------------------------
+
+from hashlib import sha1
+from os import getpid
+from threading import Lock, local
+from time import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+from config import (
+    PROVIDER_THROTTLE_BACKOFF_SECS,
+    PROVIDER_THROTTLE_RETRIES,
+    PROVIDER_TIMEOUT_SECS,
+    SENDGRID_API_KEY,
+    SENDGRID_BASE_URL,
+    SENDGRID_BURST,
+    SENDGRID_RATE_PER_SEC,
+    TWILIO_BASE_URL,
+    TWILIO_BURST,
+    TWILIO_PHONE,
+    TWILIO_RATE_PER_SEC,
+    TWILIO_SID,
+    TWILIO_TOKEN,
+)
+from cycletrace import record_http_request
+from log_utils import *
+from ratelimit import get_rate_limiter
+
+SENDGRID_MAIL_SEND_URL = f"{SENDGRID_BASE_URL}/v3/mail/send"
+
+# base URL of the Twilio REST API in the Twilio library
+_TWILIO_DEFAULT_BASE_URL = "https://api.twilio.com"
+
+
+class ThrottledError(Exception):
+    # raised when a provider rejects a request with 429 Too Many
+    # Requests. retry_after is the number of seconds it asked to wait
+    # before retrying, or None if it did not say
+
+    def __init__(self, provider, retry_after=None):
+        super().__init__(f"{provider} throttled the request")
+        self.retry_after = retry_after
+
+
+class SendGridClient:
+    def __init__(self):
+        self._session = requests.Session()
+        self._session.mount(SENDGRID_BASE_URL, HTTPAdapter(pool_maxsize=1))
+        self._session.headers.update(
+            {
+                "Authorization": f"Bearer {SENDGRID_API_KEY}",
+                "Content-Type": "application/json",
+            }
+        )
+
+    # sends the SendGrid v3 mail send request data and returns its
+    # SendGrid message ID. raises ThrottledError if SendGrid throttles it
+    # and requests.HTTPError if SendGrid rejects it
+
+    def send(self, data):
+        res = self._session.post(
+            SENDGRID_MAIL_SEND_URL, json=data, timeout=PROVIDER_TIMEOUT_SECS
+        )
+        if res.status_code == 429:
+            raise ThrottledError("sendgrid", _get_retry_after(res.headers))
+        res.raise_for_status()
+        return res.headers.get("X-Message-Id", "")
+
+
+class _TwilioHttpClient(TwilioHttpClient):
+    # sends the Twilio library's requests to TWILIO_BASE_URL
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(_TWILIO_DEFAULT_BASE_URL):
+            url = TWILIO_BASE_URL + url[len(_TWILIO_DEFAULT_BASE_URL) :]
+        return super().request(method, url, *args, **kwargs)
+
+
+class TwilioClient:
+    def __init__(self):
+        self._client = Client(
+            TWILIO_SID,
+            TWILIO_TOKEN,
+            http_client=_TwilioHttpClient(
+                pool_connections=True, timeout=PROVIDER_TIMEOUT_SECS
+            ),
+        )
+
+    # texts msg to the US phone number phone and returns its Twilio
+    # message SID. raises ThrottledError if Twilio throttles it (Twilio
+    # does not return Retry-After to the client library, so
+    # PROVIDER_THROTTLE_BACKOFF_SECS is waited)
+
+    def send(self, phone, msg):
+        try:
+            return self._client.api.account.messages.create(
+                to=f"+1{phone}",
+                from_=TWILIO_PHONE,
+                body=msg,
+            ).sid
+        except TwilioRestException as e:
+            if e.status == 429:
+                raise ThrottledError("twilio") from e
+            raise
+
+
+_PROVIDERS = {
+    "sendgrid": SendGridClient,
+    "twilio": TwilioClient,
+}
+
+# (account, sends per second, burst) of each provider. sends through the
+# same account share one rate limiter per process
+_RATE_LIMITS = {
+    "sendgrid": (
+        sha1(SENDGRID_API_KEY.encode()).hexdigest()[:8],
+        SENDGRID_RATE_PER_SEC,
+        SENDGRID_BURST,
+    ),
+    "twilio": (TWILIO_SID, TWILIO_RATE_PER_SEC, TWILIO_BURST),
+}
+
+_clients = local()
+_stats = {}
+_stats_lock = Lock()
+
+
+class _TimedClient:
+    # wraps client (of provider name) to wait for the provider's rate
+    # limiter before every send() and to record its latency and outcome in
+    # the provider stats
+
+    def __init__(self, name, client):
+        self._name = name
+        self._client = client
+        self._limiter = _get_limiter(name)
+
+    # sends like the wrapped client and returns its result. a throttled
+    # send pauses the rate limiter of the provider account (so that no
+    # thread of this process sends through it until Retry-After has
+    # passed) and is retried up to PROVIDER_THROTTLE_RETRIES times before
+    # ThrottledError is raised
+
+    def send(self, *args):
+        for attempt in range(PROVIDER_THROTTLE_RETRIES + 1):
+            self._limiter.acquire()
+            try:
+                return self._timed_send(*args)
+            except ThrottledError as e:
+                retry_after = e.retry_after
+                if retry_after is None:
+                    retry_after = PROVIDER_THROTTLE_BACKOFF_SECS
+                log_warning(
+                    f"{self._name} throttled a request - pausing for {retry_after:.1f}s"
+                )
+                self._limiter.pause(retry_after)
+                if attempt == PROVIDER_THROTTLE_RETRIES:
+                    raise
+
+    def _timed_send(self, *args):
+        tic = time()
+        outcome = "failures"
+        try:
+            res = self._client.send(*args)
+            outcome = None
+            return res
+        except ThrottledError:
+            outcome = "throttled"
+            raise
+        finally:
+            record_http_request()
+            _record(self._name, time() - tic, outcome)
+
+
+# returns the client of provider name ("sendgrid" or "twilio") for the
+# calling thread, creating it on first use (a forked process gets its
+# own, since connections cannot be shared)
+def get_provider(name):
+    clients = getattr(_clients, "clients", None)
+    if clients is None or _clients.pid != getpid():
+        clients = _clients.clients = {}
+        _clients.pid = getpid()
+    if name not in clients:
+        clients[name] = _TimedClient(name, _PROVIDERS[name]())
+    return clients[name]
+
+
+# returns a JSON-serializable snapshot of this process's provider stats:
+# {name: {"calls", "failures", "throttled", "total_secs", "max_secs"}}
+def get_provider_stats():
+    with _stats_lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
+
+
+# returns the number of sends per second through provider name in this
+# process over the last few seconds (see TokenBucket.get_rate())
+def get_send_rate(name):
+    return _get_limiter(name).get_rate()
+
+
+def _get_limiter(name):
+    account, rate_per_sec, burst = _RATE_LIMITS[name]
+    return get_rate_limiter(name, account, rate_per_sec, burst)
+
+
+# returns the number of seconds until the rate limit of a throttled
+# SendGrid request resets according to its response headers, or None
+def _get_retry_after(headers):
+    try:
+        if "Retry-After" in headers:
+            return max(float(headers["Retry-After"]), 0)
+        if "X-RateLimit-Reset" in headers:
+            return max(float(headers["X-RateLimit-Reset"]) - time(), 0)
+    except ValueError:
+        pass
+    return None
+
+
+# records a send of provider name that took secs and failed with outcome
+# ("failures" or "throttled"), or succeeded if outcome is None
+def _record(name, secs, outcome):
+    with _stats_lock:
+        if name not in _stats:
+            _stats[name] = {
+                "calls": 0,
+                "failures": 0,
+                "throttled": 0,
+                "total_secs": 0.0,
+                "max_secs": 0.0,
+            }
+        stats = _stats[name]
+        stats["calls"] += 1
+        stats["total_secs"] += secs
+        stats["max_secs"] = max(stats["max_secs"], secs)
+        if outcome is not None:
+            stats[outcome] += 1
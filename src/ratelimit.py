@@ -0,0 +1,95 @@
+# ----------------------------------------------------------------------
+# ratelimit.py
+# Contains TokenBucket, a thread-safe token bucket rate limiter used to
+# keep notification sends under each provider account's rate limit, and
+# a registry of the buckets of this process. Key function:
+# get_rate_limiter()
+# ----------------------------------------------------------------------
+
+from collections import deque
+from threading import Lock
+from time import monotonic, sleep
+
+# window in seconds over which TokenBucket.get_rate() measures the rate
+RATE_WINDOW_SECS = 10
+
+
+class TokenBucket:
+    # allows rate_per_sec acquisitions per second on average and up to
+    # burst at once. a rate_per_sec of 0 or less means no limit
+
+    def __init__(self, rate_per_sec, burst):
+        self._rate = rate_per_sec
+        self._burst = max(burst, 1)
+        self._tokens = self._burst
+        self._updated = monotonic()
+        self._paused_until = 0
+        self._acquired = deque()
+        self._lock = Lock()
+
+    # blocks until a token is available (and any pause is over), then
+    # takes it
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    self._refill(now)
+                    if self._rate <= 0 or self._tokens >= 1:
+                        self._tokens -= 1
+                        self._acquired.append(now)
+                        self._trim(now)
+                        return
+                    wait = (1 - self._tokens) / self._rate
+            sleep(wait)
+
+    # stops handing out tokens for secs seconds (e.g. after the provider
+    # responded 429 Too Many Requests with a Retry-After of secs). tokens
+    # refill from the end of the pause, so sending resumes at the rate
+    # rather than with a full burst
+
+    def pause(self, secs):
+        with self._lock:
+            self._paused_until = max(self._paused_until, monotonic() + secs)
+            self._tokens = 0
+            self._updated = self._paused_until
+
+    # returns the number of tokens taken per second over the last
+    # RATE_WINDOW_SECS seconds
+
+    def get_rate(self):
+        with self._lock:
+            self._trim(monotonic())
+            return len(self._acquired) / RATE_WINDOW_SECS
+
+    # drops the acquisitions older than RATE_WINDOW_SECS seconds. must be
+    # called with self._lock held
+
+    def _trim(self, now):
+        while self._acquired and self._acquired[0] < now - RATE_WINDOW_SECS:
+            self._acquired.popleft()
+
+    # must be called with self._lock held
+
+    def _refill(self, now):
+        if self._rate > 0:
+            self._tokens = min(
+                self._burst, self._tokens + (now - self._updated) * self._rate
+            )
+        self._updated = now
+
+
+_buckets = {}
+_buckets_lock = Lock()
+
+
+# returns the TokenBucket shared by all threads of this process sending
+# through account of provider, creating it with rate_per_sec and burst on
+# first use
+def get_rate_limiter(provider, account, rate_per_sec, burst):
+    with _buckets_lock:
+        if (provider, account) not in _buckets:
+            _buckets[(provider, account)] = TokenBucket(rate_per_sec, burst)
+        return _buckets[(provider, account)]
@@ -8,8 +8,8 @@
 # run, depending on the number of waited-on classes.
 # ----------------------------------------------------------------------
 
+import asyncio
 from datetime import datetime, timedelta
-from os import cpu_count
 from sys import stderr, stdout
 from time import time
 
@@ -17,17 +17,26 @@ import pandas as pd
 import pytz
 import requests
 from icalendar import Calendar
-from multiprocess import Pool
 
+from asyncmobileapp import AsyncMobileApp
 from config import (
+    ASYNC_NOTIFS_CYCLE,
     AUTO_GENERATE_NOTIF_SCHEDULE,
     NOTIFS_INTERVAL_SECS,
     OIT_NOTIFS_OFFSET_MINS,
+    OUTBOX_INLINE_DELIVERY,
 )
+from cycletrace import CycleTrace
 from database import Database
+from delivery import DeliveryExecutor, count_sent
 from log_utils import *
+from mobileapp import MobileApp
 from monitor import Monitor
-from notify import Notify, send_email, send_text
+from notify import NotifyBatch, count_email_recipients, get_email_netids
+from outbox import OutboxWorker, outbox_message
+from providers import get_provider_stats
+from systemlog import flush_system_logs
+from transport import get_transport
 
 """
 - start and end times for add/drop and course selection periods
@@ -44,109 +53,282 @@ ICAL_URL = "https://registrar.princeton.edu/feeds/events/ical.ics"  # academic c
 _db = Database()
 
 
-def cronjob(end_time):
-    tic = time()
-    db = Database()
-    monitor = Monitor(db)
-
-    db._add_system_log(
-        "cron",
-        {"message": "notifications script executing"},
-        log_fn=log_notifs,
-    )
-
-    if db.get_maintenance_status():
-        db._add_system_log(
-            "cron",
-            {"message": "app in maintenance mode: notifications script killed"},
-            log_fn=log_notifs,
+# long-lived owner of the notifications cycle. holds one Database,
+# MobileApp (with its access token and HTTP connections), Monitor (with
+# its seats fingerprints), and OutboxWorker (with its sender threads)
+# across cycles so that per-cycle setup is paid once per process rather
+# than once every NOTIFS_INTERVAL_SECS. the MobileApp is created on the
+# first cycle. if use_async, open spots are found with an AsyncMobileApp
+# on an event loop that is also kept across cycles. notifications are
+# stored in the outbox and, if inline_delivery, sent at the end of each
+# cycle (otherwise outbox worker dynos send them).
+class NotificationEngine:
+    def __init__(
+        self,
+        db: Database = None,
+        use_async=ASYNC_NOTIFS_CYCLE,
+        inline_delivery=OUTBOX_INLINE_DELIVERY,
+    ):
+        self._db = db if db is not None else _db
+        self._use_async = use_async
+        self._inline_delivery = inline_delivery
+        self._api = None
+        self._async_api = None
+        self._loop = None
+        self._monitor = None
+        self._outbox_worker = None
+
+    # creates the MobileApp, Monitor, and OutboxWorker (and
+    # AsyncMobileApp and its event loop) if they do not exist yet
+
+    def _warm_up(self):
+        if self._monitor is not None:
+            return
+        self._api = MobileApp(db=self._db)
+        if self._use_async:
+            self._loop = asyncio.new_event_loop()
+            self._async_api = AsyncMobileApp(db=self._db)
+        if self._inline_delivery:
+            self._outbox_worker = OutboxWorker(self._db, DeliveryExecutor())
+        self._monitor = Monitor(self._db, api=self._api)
+
+    # returns the send rate and queue depth of emails and texts being sent
+    # by this engine, for the live notifs status (empty if not inline)
+
+    def _delivery_status(self):
+        if self._outbox_worker is None:
+            return ""
+        status = self._outbox_worker.get_delivery_status()
+        return "".join(
+            f"; {label} {status[channel][0]:.1f}/s, {status[channel][1]} queued"
+            for channel, label in (("email", "emails"), ("sms", "texts"))
         )
-        return
-
-    monitor.update_live_notifs_state_active("Now checking for open spots...")
-
-    # get all class openings (for waited-on classes) from MobileApp
-    new_slots, _ = monitor.get_classes_with_changed_enrollments()
 
-    monitor.update_live_notifs_state_active("Sending notifs (0 sent so far)...")
+    # stops the sender threads, closes the event loop (and the
+    # AsyncMobileApp's connections), and writes the queued system log
+    # events. the engine must not be used after
+
+    def close(self):
+        if self._outbox_worker is not None:
+            self._outbox_worker.close()
+        if self._loop is not None:
+            self._loop.run_until_complete(self._async_api.close())
+            self._loop.close()
+        flush_system_logs()
+
+    # returns the open spots in waited-on classes (see
+    # Monitor.get_classes_with_changed_enrollments()), recording the
+    # phases in trace
+
+    def _find_open_spots(self, trace: CycleTrace):
+        if not self._use_async:
+            return self._monitor.get_classes_with_changed_enrollments(trace)
+        return self._loop.run_until_complete(
+            self._monitor.get_classes_with_changed_enrollments_async(
+                self._async_api, trace
+            )
+        )
 
-    names = ""
-    emails_to_send, texts_to_send = [], []
-    n_sections = 0
-    for classid, n_new_slots in new_slots.items():
-        if n_new_slots == 0:
-            # cover edge case where the number of open spots is 0 (not covered in Notify)
-            # this case should already be covered in get_new_mobileapp_data(), but
-            # we are keeping this logic for precaution
-            db.update_users_notifs_history([], classid, 0)
-            continue
+    # runs one notifications cycle: finds open spots in waited-on
+    # classes and notifies their subscribers. end_time is the end of the
+    # current notifications window. the duration, item counts, and
+    # DB/HTTP call counts of each phase are stored in the metrics
+    # collection (see CycleTrace)
 
-        try:
-            notify = Notify(classid, n_new_slots, db)
-            netids = notify.get_netids()
-            if len(netids) == 0:
-                continue
-            log_notifs(f"Sending notifs for classID {classid}")
-            print(notify)
-            stdout.flush()
+    def run_cycle(self, end_time):
+        tic = time()
+        trace = CycleTrace()
+        self._warm_up()
+        db = self._db
+        monitor = self._monitor
+        monitor.clear_cache()
 
-            emails_to_send.extend(notify.send_emails_html())
-            texts_to_send.extend(notify.send_sms())
+        db._add_system_log(
+            "cron",
+            {"message": "notifications script executing"},
+            log_fn=log_notifs,
+        )
 
+        if db.get_maintenance_status():
+            db._add_system_log(
+                "cron",
+                {"message": "app in maintenance mode: notifications script killed"},
+                log_fn=log_notifs,
+            )
+            return
+
+        monitor.update_live_notifs_state_active("Now checking for open spots...")
+
+        # get all class openings (for waited-on classes) from MobileApp
+        new_slots, _ = self._find_open_spots(trace)
+
+        monitor.update_live_notifs_state_active("Sending notifs (0 sent so far)...")
+
+        names = ""
+        n_emails, n_texts, n_sections = 0, 0, 0
+        notified_classids = set()
+        # sections are sent as soon as they are resolved (if inline), the
+        # section with the fewest open spots per subscriber first (see
+        # NotifyBatch.get_notifies())
+        stream = self._outbox_worker.stream(trace) if self._inline_delivery else None
+        with trace.span("notify_build") as counts:
+            batch = NotifyBatch(new_slots, db)
+            for notify in batch.get_notifies():
+                try:
+                    netids = notify.get_netids()
+                    if len(netids) == 0:
+                        # all subscribers were notified recently: nothing
+                        # to store, so the section is handled
+                        notified_classids.add(notify.get_classid())
+                        continue
+                    log_notifs(f"Sending notifs for classID {notify.get_classid()}")
+                    print(notify)
+                    stdout.flush()
+
+                    classid = notify.get_classid()
+                    n_open_spots = notify.n_new_slots
+                    priority = notify.get_priority()
+                    notify_emails = notify.send_emails_html()
+                    notify_texts = notify.send_sms()
+                    msgs = [
+                        outbox_message(
+                            trace.cycle_id,
+                            classid,
+                            "email",
+                            args,
+                            get_email_netids(args),
+                            n_open_spots,
+                            priority,
+                        )
+                        for args in notify_emails
+                    ] + [
+                        outbox_message(
+                            trace.cycle_id,
+                            classid,
+                            "sms",
+                            args,
+                            [netid],
+                            n_open_spots,
+                            priority,
+                        )
+                        for args, netid in zip(notify_texts, notify.get_text_netids())
+                    ]
+                except Exception as e:
+                    print(e, file=stderr)
+                    continue
+
+                # store the notifications before the notifs history that
+                # marks them as sent is flushed (a failure here ends the
+                # cycle without flushing it)
+                if stream is not None:
+                    stream.send(msgs)
+                else:
+                    db.add_outbox_messages(msgs)
+                notified_classids.add(classid)
+
+                n_emails += sum(map(count_email_recipients, notify_emails))
+                n_texts += len(notify_texts)
+                monitor.update_live_notifs_state_active(
+                    f"Sending notifs ({n_emails + n_texts} sent so far{self._delivery_status()})..."
+                )
+                names += " " + notify.get_name() + ","
+                n_sections += 1
+
+            batch.flush()
+            # only now are the seats of the notified sections recorded as
+            # seen (see Monitor.save_fingerprints())
+            monitor.save_fingerprints(notified_classids)
+            counts["sections"] = n_sections
+            counts["emails"] = n_emails
+            counts["texts"] = n_texts
+
+        first_notif_secs = None
+        if self._inline_delivery:
             monitor.update_live_notifs_state_active(
-                f"Sending notifs ({len(emails_to_send) + len(texts_to_send)} sent so far)..."
+                f"Sending notifs ({n_emails + n_texts} sent so far{self._delivery_status()})..."
             )
+            emails_res, texts_res = stream.finish()
+            first_notif_secs = stream.first_sent_secs
+
+            # also send any notifications left over from earlier cycles
+            # that are due for a retry
+            drained_emails_res, drained_texts_res = self._outbox_worker.drain(trace)
+            emails_res += drained_emails_res
+            texts_res += drained_texts_res
+
+            n_emails_sent = count_sent(emails_res)
+            if len(emails_res) > 0 and n_emails_sent == 0:
+                log_error("Failed to send emails")
+
+            n_texts_sent = count_sent(texts_res)
+            if len(texts_res) > 0 and n_texts_sent == 0:
+                log_error("Failed to send texts")
+
+            total = n_emails_sent + n_texts_sent
+            verb = "sent"
+        else:
+            total = n_emails + n_texts
+            verb = "queued"
+        duration = round(time() - tic)
+
+        with trace.span("status_updates"):
+            if total > 0:
+                db._add_admin_log(
+                    f"{verb} {total} notifs in {duration} seconds ({n_sections} sections):{names[:-1]}",
+                    print_=False,
+                )
+                db.add_stats_notif_log(
+                    f"{total} notif{'s'[:total^1]} {verb} for {n_sections} section{'s'[:n_sections^1]}:{names[:-1]}"
+                )
+                db._add_system_log(
+                    "cron",
+                    {
+                        "message": f"{verb} {total} notifs in {duration} seconds ({n_sections} sections):{names[:-1]}"
+                    },
+                    log_fn=log_notifs,
+                )
+            elif total == 0:
+                db._add_system_log(
+                    "cron",
+                    {
+                        "message": f"{verb} 0 notifs in {duration} seconds ({n_sections} sections)"
+                    },
+                    log_fn=log_notifs,
+                )
+            stdout.flush()
 
-            names += " " + notify.get_name() + ","
-            n_sections += 1
+            try:
+                db.set_notifs_transport_stats(get_transport().get_stats())
+                db.set_notifs_provider_stats(get_provider_stats())
+            except Exception as e:
+                log_error("Failed to store OIT API transport and provider stats")
+                print(e, file=stderr)
 
+        try:
+            db.add_cycle_metrics(
+                trace.to_doc(
+                    async_cycle=self._use_async, first_notif_secs=first_notif_secs
+                )
+            )
         except Exception as e:
+            log_error("Failed to store notifications cycle metrics")
             print(e, file=stderr)
 
-    with Pool(cpu_count()) as pool:
-        emails_res = pool.starmap(send_email, emails_to_send)
-        texts_res = pool.starmap(send_text, texts_to_send)
-
-    n_emails_sent = sum(emails_res)
-    if len(emails_res) > 0 and n_emails_sent == 0:
-        log_error("Failed to send emails")
+        if datetime.now(TZ) >= end_time:
+            db.set_live_notifs_status("inactive", "")
+            return
 
-    n_texts_sent = sum(texts_res)
-    if len(texts_res) > 0 and n_texts_sent == 0:
-        log_error("Failed to send texts")
+        monitor.update_live_notifs_state_countdown()
 
-    total = n_emails_sent + n_texts_sent
-    duration = round(time() - tic)
 
-    if total > 0:
-        db._add_admin_log(
-            f"sent {total} notifs in {duration} seconds ({n_sections} sections):{names[:-1]}",
-            print_=False,
-        )
-        db.add_stats_notif_log(
-            f"{total} notif{'s'[:total^1]} sent for {n_sections} section{'s'[:n_sections^1]}:{names[:-1]}"
-        )
-        db._add_system_log(
-            "cron",
-            {
-                "message": f"sent {total} notifs in {duration} seconds ({n_sections} sections):{names[:-1]}"
-            },
-            log_fn=log_notifs,
-        )
-        db.increment_email_counter(total)
-    elif total == 0:
-        db._add_system_log(
-            "cron",
-            {"message": f"sent 0 notifs in {duration} seconds ({n_sections} sections)"},
-            log_fn=log_notifs,
-        )
-    stdout.flush()
-
-    if datetime.now(TZ) >= end_time:
-        _db.set_live_notifs_status("inactive", "")
-        return
-
-    monitor.update_live_notifs_state_countdown()
+# runs one notifications cycle using a new NotificationEngine (see
+# send_notifs_cron.py for the long-lived engine used by the notifs dyno)
+def cronjob(end_time):
+    engine = NotificationEngine()
+    try:
+        engine.run_cycle(end_time)
+    finally:
+        engine.close()
 
 
 def update_live_notifs_countdown(sched_job):
@@ -329,8 +511,7 @@ def update_stats():
             f"{(datetime.now(TZ)).strftime('%b %-d, %Y @ %-I:%M %p ET')}"
         )
 
-        _db._db.admin.update_one(
-            {},
+        _db._update_admin(
             {
                 "$set": {
                     "stats_top_subs": stats_top_subs,
@@ -0,0 +1,168 @@
+# ----------------------------------------------------------------------
+# systemlog.py
+# Contains SystemLogWriter, which writes the system log events of
+# Database._add_system_log() in the background: events are queued in
+# memory and inserted SYSTEM_LOG_BATCH_SIZE at a time, or at least every
+# SYSTEM_LOG_FLUSH_SECS seconds, with one insert_many. The queue holds
+# at most SYSTEM_LOG_MAX_QUEUE events; events beyond that are dropped
+# (and counted), so that logging never blocks a request or a cycle.
+# Queued events are flushed when the process exits. Key functions:
+# get_system_log_writer(), flush_system_logs(), get_system_log_stats()
+# ----------------------------------------------------------------------
+
+import atexit
+from os import getpid
+from queue import Empty, Full, Queue
+from sys import stderr
+from threading import Lock, Thread
+from time import monotonic
+
+from config import SYSTEM_LOG_BATCH_SIZE, SYSTEM_LOG_FLUSH_SECS, SYSTEM_LOG_MAX_QUEUE
+from log_utils import *
+
+
+class SystemLogWriter:
+    # writes events to the pymongo collection coll
+
+    def __init__(
+        self,
+        coll,
+        batch_size=SYSTEM_LOG_BATCH_SIZE,
+        flush_secs=SYSTEM_LOG_FLUSH_SECS,
+        max_queue=SYSTEM_LOG_MAX_QUEUE,
+    ):
+        self._coll = coll
+        self._batch_size = batch_size
+        self._flush_secs = flush_secs
+        self._queue = Queue(maxsize=max_queue)
+        self._write_lock = Lock()
+        self._start_lock = Lock()
+        self._stats_lock = Lock()
+        self._stats = {"written": 0, "dropped": 0, "failed": 0}
+        self._thread = None
+        self._closed = False
+
+    # queues the event doc to be written, or drops it if the queue is full.
+    # never blocks
+
+    def add(self, doc):
+        try:
+            self._queue.put_nowait(doc)
+        except Full:
+            self._count("dropped", 1)
+            return
+        if self._thread is None:
+            self._start()
+
+    # writes all queued events now, and waits for the events being written
+    # by the background writer
+
+    def flush(self):
+        while self._write_batch(self._take_batch(block=False)):
+            pass
+        self._queue.join()
+
+    # flushes the queued events and stops the background writer
+
+    def close(self):
+        self._closed = True
+        self.flush()
+
+    # returns {"queued", "written", "dropped", "failed"} event counts
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {"queued": self._queue.qsize(), **self._stats}
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = Thread(
+                target=self._run, name="system-log-writer", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._write_batch(self._take_batch(block=True))
+
+    # returns up to batch_size queued events. if block, waits for a first
+    # event (for up to flush_secs) and then for more until flush_secs have
+    # passed since it
+
+    def _take_batch(self, block):
+        batch = []
+        deadline = monotonic() + self._flush_secs
+        while len(batch) < self._batch_size:
+            timeout = deadline - monotonic()
+            try:
+                if block and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    # inserts the events batch and returns the number of events in it
+
+    def _write_batch(self, batch):
+        if len(batch) == 0:
+            return 0
+        with self._write_lock:
+            try:
+                self._coll.insert_many(batch, ordered=False)
+                self._count("written", len(batch))
+            except Exception as e:
+                self._count("failed", len(batch))
+                log_error(f"Failed to write {len(batch)} system log events")
+                print(e, file=stderr)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        return len(batch)
+
+    def _count(self, key, n):
+        with self._stats_lock:
+            self._stats[key] += n
+
+
+_writers = {}
+_writers_lock = Lock()
+_writers_pid = None
+
+
+# returns the SystemLogWriter of this process for the pymongo collection
+# coll, creating it on first use (a forked process gets its own, since
+# the writer thread does not survive a fork)
+def get_system_log_writer(coll):
+    global _writers_pid
+    with _writers_lock:
+        if _writers_pid != getpid():
+            _writers.clear()
+            _writers_pid = getpid()
+        if coll.full_name not in _writers:
+            _writers[coll.full_name] = SystemLogWriter(coll)
+        return _writers[coll.full_name]
+
+
+# writes the queued events of all SystemLogWriters of this process
+@atexit.register
+def flush_system_logs():
+    with _writers_lock:
+        writers = list(_writers.values()) if _writers_pid == getpid() else []
+    for writer in writers:
+        writer.flush()
+
+
+# returns the summed stats (see SystemLogWriter.get_stats()) of all
+# SystemLogWriters of this process
+def get_system_log_stats():
+    res = {"queued": 0, "written": 0, "dropped": 0, "failed": 0}
+    with _writers_lock:
+        writers = list(_writers.values()) if _writers_pid == getpid() else []
+    for writer in writers:
+        for key, n in writer.get_stats().items():
+            res[key] += n
+    return res
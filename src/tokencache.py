@@ -0,0 +1,155 @@
+# ----------------------------------------------------------------------
+# tokencache.py
+# Contains TokenCache, a class that caches the OAuth bearer token used
+# for the Princeton OIT APIs (MobileApp and ActiveDirectory). The token
+# is kept in memory and shared with other processes (web workers and the
+# notifs dyno) through the tokens collection, and is refreshed shortly
+# before it expires.
+# ----------------------------------------------------------------------
+
+import base64
+import json
+from sys import stderr
+from threading import Lock
+from time import sleep, time
+
+from config import (
+    CONSUMER_KEY,
+    CONSUMER_SECRET,
+    OIT_BASE_URL,
+    TOKEN_REFRESH_LOCK_SECS,
+    TOKEN_REFRESH_MARGIN_SECS,
+)
+from log_utils import *
+from transport import get_transport
+
+REFRESH_TOKEN_URL = OIT_BASE_URL + "/token"
+TOKEN_NAME = "oit"
+
+# token lifetime assumed if the token endpoint does not return expires_in
+DEFAULT_EXPIRES_IN_SECS = 3600
+
+# interval on which a process waiting for another process to refresh the
+# shared token checks for the new token
+_REFRESH_POLL_SECS = 0.25
+
+# tokens cached in this process (shared by all TokenCache objects), in
+# the form {name: {"access_token": str, "expires_at": float}}
+_local_tokens = {}
+_local_tokens_lock = Lock()
+
+
+class TokenCache:
+    # db is the Database used to share the token with other processes (if
+    # None, the token is only cached in this process). transport is the
+    # Transport used to request new tokens from url (this process's shared
+    # Transport if not given)
+
+    def __init__(self, db=None, transport=None, url=REFRESH_TOKEN_URL, name=TOKEN_NAME):
+        self._db = db
+        self._transport = transport if transport is not None else get_transport()
+        self._url = url
+        self._name = name
+
+    # returns an access token that is valid for at least another
+    # TOKEN_REFRESH_MARGIN_SECS seconds (when possible), refreshing it if
+    # needed. only one process requests a new token at a time; the others
+    # pick it up from the tokens collection
+
+    def get_token(self):
+        token = _local_tokens.get(self._name)
+        if _is_fresh(token):
+            return token["access_token"]
+
+        with _local_tokens_lock:
+            token = _local_tokens.get(self._name)
+            if not _is_fresh(token):
+                token = self._get_shared_token()
+                _local_tokens[self._name] = token
+            return token["access_token"]
+
+    # discards access_token (e.g. after the API rejected it) so that the
+    # next get_token() call returns a new token. does nothing if the
+    # cached token has already been replaced
+
+    def invalidate(self, access_token):
+        with _local_tokens_lock:
+            token = _local_tokens.get(self._name)
+            if token is not None and token["access_token"] == access_token:
+                del _local_tokens[self._name]
+
+        if self._db is None:
+            return
+        try:
+            self._db.invalidate_oauth_token(self._name, access_token)
+        except Exception as e:
+            log_error("Failed to invalidate shared OIT API token")
+            print(e, file=stderr)
+
+    # returns the token cached in the tokens collection if it is fresh,
+    # otherwise requests a new one (or waits for the process that holds
+    # the refresh lock to do so) and caches it there
+
+    def _get_shared_token(self):
+        if self._db is None:
+            return self._request_token()
+
+        try:
+            deadline = time() + TOKEN_REFRESH_LOCK_SECS
+            while True:
+                token = self._db.get_oauth_token(self._name)
+                if _is_fresh(token):
+                    return token
+                if self._db.lock_oauth_token_refresh(
+                    self._name, TOKEN_REFRESH_LOCK_SECS
+                ):
+                    break
+                # another process is refreshing the token: keep using the
+                # current one while it has not expired yet
+                if _is_fresh(token, margin=0):
+                    return token
+                if time() >= deadline:
+                    break
+                sleep(_REFRESH_POLL_SECS)
+        except Exception as e:
+            log_error("Failed to read shared OIT API token - requesting a new one")
+            print(e, file=stderr)
+            return self._request_token()
+
+        token = self._request_token()
+        try:
+            self._db.set_oauth_token(
+                self._name, token["access_token"], token["expires_at"]
+            )
+        except Exception as e:
+            log_error("Failed to store shared OIT API token")
+            print(e, file=stderr)
+        return token
+
+    # requests a new token from the token endpoint
+
+    def _request_token(self):
+        req = self._transport.post(
+            self._url,
+            data={"grant_type": "client_credentials"},
+            headers={
+                "Authorization": "Basic "
+                + base64.b64encode(
+                    bytes(CONSUMER_KEY + ":" + CONSUMER_SECRET, "utf-8")
+                ).decode("utf-8")
+            },
+        )
+        response = json.loads(req.text)
+        return {
+            "access_token": response["access_token"],
+            "expires_at": time()
+            + float(response.get("expires_in", DEFAULT_EXPIRES_IN_SECS)),
+        }
+
+
+# returns whether token (a token document or None) is valid for at least
+# another margin seconds
+def _is_fresh(token, margin=TOKEN_REFRESH_MARGIN_SECS):
+    if not token or "access_token" not in token:
+        return False
+    return time() < token["expires_at"] - margin
@@ -0,0 +1,300 @@
+# ----------------------------------------------------------------------
+# transport.py
+# Contains Transport, the HTTP layer shared by the Princeton OIT API
+# clients (MobileApp, ActiveDirectory, and TokenCache). Requests go
+# through a pooled keep-alive session with per-endpoint timeouts, are
+# retried with jittered exponential backoff on 5xx/429 responses and
+# connection errors, and fail fast through a circuit breaker while the
+# API is down. Key function: get_transport()
+# ----------------------------------------------------------------------
+
+from os import getpid
+from random import uniform
+from threading import Lock
+from time import sleep, time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    OIT_BACKOFF_BASE_SECS,
+    OIT_BACKOFF_MAX_SECS,
+    OIT_CIRCUIT_FAILURE_THRESHOLD,
+    OIT_CIRCUIT_RESET_SECS,
+    OIT_CONNECT_TIMEOUT_SECS,
+    OIT_MAX_RETRIES,
+    OIT_POOL_MAXSIZE,
+    OIT_READ_TIMEOUT_SECS,
+)
+from cycletrace import record_http_request
+from log_utils import *
+
+# read timeouts (in seconds) of endpoints that differ from
+# OIT_READ_TIMEOUT_SECS. courses/courses responses for whole departments
+# are large; users lookups happen while a user waits on a page load
+ENDPOINT_READ_TIMEOUTS = {
+    "/courses/courses": 20,
+    "/users": 5,
+}
+
+# number of retries of endpoints that differ from OIT_MAX_RETRIES.
+# courses/seats requests are already retried chunk by chunk by
+# monitor_utils.get_seats_chunked(), so a failing chunk is not also
+# retried here (which would multiply the attempts past a notifications
+# cycle)
+ENDPOINT_MAX_RETRIES = {
+    "/courses/seats": 0,
+}
+
+
+# raised instead of sending a request while the circuit breaker is open
+class CircuitOpenError(Exception):
+    pass
+
+
+class Transport:
+    def __init__(self):
+        self._session = requests.Session()
+        self._adapter = HTTPAdapter(pool_maxsize=OIT_POOL_MAXSIZE, max_retries=0)
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+
+        self._lock = Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._stats = {
+            "since": time(),
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "fast_failures": 0,
+            "circuit_opens": 0,
+            "endpoints": {},
+        }
+
+    # sends a GET request to url (see request())
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request("GET", url, endpoint=endpoint, **kwargs)
+
+    # sends a POST request to url (see request())
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request("POST", url, endpoint=endpoint, **kwargs)
+
+    # sends a request and returns its response. endpoint (the path of url
+    # if not given) determines the timeout and groups the stats. 5xx/429
+    # responses and connection errors are retried up to OIT_MAX_RETRIES
+    # times (see get_max_retries()); the last response is returned (or the last error raised) if
+    # they all fail. raises CircuitOpenError without sending anything if
+    # the API has been failing
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        if endpoint is None:
+            endpoint = urlparse(url).path
+        kwargs.setdefault("timeout", get_timeout(endpoint))
+        self.before_request()
+
+        attempt = 0
+        while True:
+            tic = time()
+            res, error = None, None
+            try:
+                res = self._session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                error = e
+            delay = self.after_attempt(
+                endpoint,
+                attempt,
+                time() - tic,
+                status=None if res is None else res.status_code,
+                retry_after=None if res is None else res.headers.get("Retry-After"),
+                error=error,
+            )
+            if delay is None:
+                if error is not None:
+                    raise error
+                return res
+
+            attempt += 1
+            sleep(delay)
+
+    # returns a JSON-serializable snapshot of this process's transport
+    # stats: request/retry/failure counts (in total and per endpoint),
+    # circuit breaker state, and connection pool usage
+
+    def get_stats(self):
+        with self._lock:
+            stats = {k: v for k, v in self._stats.items() if k != "endpoints"}
+            stats["endpoints"] = {
+                endpoint: dict(endpoint_stats)
+                for endpoint, endpoint_stats in self._stats["endpoints"].items()
+            }
+            stats["circuit_state"] = self._circuit_state()
+
+        connections_opened, pooled_requests = 0, 0
+        for key in list(self._adapter.poolmanager.pools.keys()):
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            connections_opened += pool.num_connections
+            pooled_requests += pool.num_requests
+        stats["pid"] = getpid()
+        stats["pool_maxsize"] = OIT_POOL_MAXSIZE
+        stats["connections_opened"] = connections_opened
+        stats["connections_reused"] = max(pooled_requests - connections_opened, 0)
+        stats["time"] = time()
+        return stats
+
+    # the methods below implement the circuit breaker and stats for
+    # request() and for clients that send requests through another HTTP
+    # library (see AsyncMobileApp)
+
+    # records attempt number attempt (starting at 0) of a request to
+    # endpoint, which took secs seconds and got a response with status
+    # code status (and Retry-After header retry_after) or raised error.
+    # returns the number of seconds to wait before retrying the request,
+    # or None if it is done: it succeeded, or it failed and has no
+    # retries left (see get_max_retries()), which counts toward opening
+    # the circuit breaker
+
+    def after_attempt(
+        self, endpoint, attempt, secs, status=None, retry_after=None, error=None
+    ):
+        self.record(endpoint, "requests", secs)
+        if error is None and not is_retryable_status(status):
+            self.on_success()
+            return None
+        if attempt >= get_max_retries(endpoint):
+            self.on_failure(endpoint)
+            return None
+        self.record(endpoint, "retries")
+        return backoff_secs(attempt + 1, status, retry_after)
+
+    # raises CircuitOpenError if requests should fail fast. once
+    # OIT_CIRCUIT_RESET_SECS seconds have passed since the circuit opened,
+    # a single trial request is let through
+
+    def before_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if (
+                time() - self._opened_at < OIT_CIRCUIT_RESET_SECS
+                or self._trial_in_flight
+            ):
+                self._stats["fast_failures"] += 1
+                raise CircuitOpenError("OIT API circuit breaker is open")
+            self._trial_in_flight = True
+
+    # records that a request (after any retries) succeeded
+
+    def on_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    # records that a request to endpoint failed after all its retries
+
+    def on_failure(self, endpoint):
+        with self._lock:
+            self._consecutive_failures += 1
+            self._stats["failures"] += 1
+            self._endpoint_stats(endpoint)["failures"] += 1
+            if (
+                self._trial_in_flight
+                or self._consecutive_failures >= OIT_CIRCUIT_FAILURE_THRESHOLD
+            ):
+                if self._opened_at is None or self._trial_in_flight:
+                    self._stats["circuit_opens"] += 1
+                    log_error(
+                        f"OIT API failing - failing fast for {OIT_CIRCUIT_RESET_SECS} seconds"
+                    )
+                self._opened_at = time()
+                self._trial_in_flight = False
+
+    # increments stat key (and adds secs to the total request time) for
+    # endpoint and in total. requests are also counted for CycleTrace
+
+    def record(self, endpoint, key, secs=None):
+        if key == "requests":
+            record_http_request()
+        with self._lock:
+            self._stats[key] += 1
+            endpoint_stats = self._endpoint_stats(endpoint)
+            endpoint_stats[key] += 1
+            if secs is not None:
+                endpoint_stats["total_secs"] += secs
+
+    # must be called with self._lock held
+
+    def _endpoint_stats(self, endpoint):
+        if endpoint not in self._stats["endpoints"]:
+            self._stats["endpoints"][endpoint] = {
+                "requests": 0,
+                "retries": 0,
+                "failures": 0,
+                "total_secs": 0.0,
+            }
+        return self._stats["endpoints"][endpoint]
+
+    # must be called with self._lock held
+
+    def _circuit_state(self):
+        if self._opened_at is None:
+            return "closed"
+        if self._trial_in_flight:
+            return "half-open"
+        return "open"
+
+
+# returns the (connect, read) timeout in seconds for requests to endpoint
+def get_timeout(endpoint):
+    return (
+        OIT_CONNECT_TIMEOUT_SECS,
+        ENDPOINT_READ_TIMEOUTS.get(endpoint, OIT_READ_TIMEOUT_SECS),
+    )
+
+
+# returns the number of times a failed request to endpoint is retried
+def get_max_retries(endpoint):
+    return ENDPOINT_MAX_RETRIES.get(endpoint, OIT_MAX_RETRIES)
+
+
+# returns whether a response with HTTP status code status is retried
+def is_retryable_status(status):
+    return status >= 500 or status == 429
+
+
+# returns the number of seconds to wait before retry number attempt
+# (starting at 1): a random duration up to an exponentially growing cap
+# ("full jitter"), or the Retry-After of a 429 response (status) if it
+# asks for longer
+def backoff_secs(attempt, status=None, retry_after=None):
+    cap = min(OIT_BACKOFF_MAX_SECS, OIT_BACKOFF_BASE_SECS * 2 ** (attempt - 1))
+    delay = uniform(0, cap)
+    if status == 429 and retry_after is not None:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return min(delay, OIT_BACKOFF_MAX_SECS)
+
+
+_transport = None
+_transport_pid = None
+_transport_lock = Lock()
+
+
+# returns the Transport shared by all OIT API clients in this process (a
+# forked process gets its own, since connections cannot be shared)
+def get_transport():
+    global _transport, _transport_pid
+    with _transport_lock:
+        if _transport is None or _transport_pid != getpid():
+            _transport = Transport()
+            _transport_pid = getpid()
+        return _transport
@@ -0,0 +1,78 @@
+# ----------------------------------------------------------------------
+# writebuffer.py
+# Contains WriteBuffer, a class that collects the database writes made
+# during a notifications cycle and flushes them as one ordered
+# bulk_write per collection.
+# ----------------------------------------------------------------------
+
+from database import Database
+
+
+class WriteBuffer:
+    def __init__(self, db: Database):
+        self._db = db
+        self._ops = {}
+
+    # queues write operations ops for collection coll
+
+    def add(self, coll, ops):
+        if len(ops) == 0:
+            return
+        if coll not in self._ops:
+            self._ops[coll] = []
+        self._ops[coll].extend(ops)
+
+    # buffered version of Database.update_users_notifs_history()
+
+    def update_users_notifs_history(
+        self, netids, classid, n_open_spots, reserved_seats=False
+    ):
+        self.add(
+            "notifs",
+            self._db.notifs_history_ops(netids, classid, n_open_spots, reserved_seats),
+        )
+
+    # buffered version of Database.update_prev_enrollment_RESERVED_SEATS_ONLY()
+
+    def update_prev_enrollment_RESERVED_SEATS_ONLY(self, classid, enrollment):
+        self.add(
+            "enrollments",
+            [self._db.prev_enrollment_op_RESERVED_SEATS_ONLY(classid, enrollment)],
+        )
+
+    # buffered version of Database.update_user_waitlist_log()
+
+    def update_user_waitlist_log(self, netid, entry):
+        self.add("logs", [self._db.waitlist_log_op(netid, entry)])
+
+    # buffered version of Database.update_time_of_last_notif()
+
+    def update_time_of_last_notif(self, classid):
+        self.add("enrollments", [self._db.time_of_last_notif_op(classid)])
+
+    # queues the storing of the seats fingerprint of class classid
+    # (see Database.seats_fingerprint_op())
+
+    def update_seats_fingerprint(self, classid, fingerprint, time):
+        self.add(
+            "enrollments", [self._db.seats_fingerprint_op(classid, fingerprint, time)]
+        )
+
+    # buffered version of Database._add_system_log() (never prints)
+
+    def add_system_log(self, type, meta, netid=None):
+        self.add("system", [self._db.system_log_op(type, meta, netid=netid)])
+
+    # writes all queued operations (one bulk_write per collection) and
+    # returns the number of operations written
+
+    def flush(self):
+        n_ops = 0
+        ops, self._ops = self._ops, {}
+        for coll, coll_ops in ops.items():
+            self._db.bulk_write(coll, coll_ops)
+            n_ops += len(coll_ops)
+        return n_ops
+
+    def __len__(self):
+        return sum(len(ops) for ops in self._ops.values())
@@ -676,6 +676,32 @@ let getUsageSummaryListener = function () {
   });
 };
 
+// listens for Performance Summary button on admin panel
+let getPerformanceSummaryListener = function () {
+  let helper = function (res, label) {
+    if (res["data"] === "error") {
+      enableAdminFunction();
+      return;
+    }
+    let data = res["data"].split("{");
+
+    dataHTML = "";
+    for (let d of data) dataHTML += `<p class="my-1">&#8594; ${d}</p>`;
+
+    $("#modal-body-performance-summary").html(dataHTML);
+    $("#performance-summary-modal").modal("show");
+  };
+
+  $("#performance-summary").on("click", function (e) {
+    e.preventDefault();
+    disableAdminFunction();
+    $.post(`/get_performance_summary`, function (res) {
+      helper(res, "performance-summary");
+      enableAdminFunction();
+    });
+  });
+};
+
 // listens for All Subscriptions button on admin panel
 let getAllSubscriptionsListener = function () {
   let helper = function (res, label) {
@@ -708,6 +734,7 @@ let enableAdminFunction = function () {
   $(".btn-user-info").attr("disabled", false);
   $("#notifs-sheet-link").attr("disabled", false);
   $("#usage-summary").attr("disabled", false);
+  $("#performance-summary").attr("disabled", false);
   $("#all-subscriptions").attr("disabled", false);
   $("#disable-course-input").attr("disabled", false);
   $("#disable-course-submit").attr("disabled", false);
@@ -731,6 +758,7 @@ let disableAdminFunction = function () {
   $(".btn-user-info").attr("disabled", true);
   $("#notifs-sheet-link").attr("disabled", true);
   $("#usage-summary").attr("disabled", true);
+  $("#performance-summary").attr("disabled", true);
   $("#all-subscriptions").attr("disabled", true);
   $("#disable-course-input").attr("disabled", true);
   $("#disable-course-submit").attr("disabled", true);
@@ -1253,6 +1281,7 @@ let adminFunctions = function () {
   disableCourseListener();
   enableCourseListener();
   getUsageSummaryListener();
+  getPerformanceSummaryListener();
   getAllSubscriptionsListener();
   getUserDataListener();
   getUserInfoListener();
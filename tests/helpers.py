@@ -0,0 +1,45 @@
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+class ModulePatch:
+    def __init__(self, modules):
+        self.modules = modules
+        self.originals = {}
+
+    def __enter__(self):
+        for name, module in self.modules.items():
+            self.originals[name] = sys.modules.get(name)
+            sys.modules[name] = module
+
+    def __exit__(self, exc_type, exc, tb):
+        for name in self.modules:
+            original = self.originals[name]
+            if original is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = original
+
+
+def make_module(name, **attrs):
+    module = types.ModuleType(name)
+    for key, value in attrs.items():
+        setattr(module, key, value)
+    return module
+
+
+def load_module(name, path):
+    sys.modules.pop(name, None)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def noop(*args, **kwargs):
+    return None
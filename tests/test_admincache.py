@@ -0,0 +1,191 @@
+import queue
+import re
+import threading
+import time
+import unittest
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeOperationFailure(Exception):
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeChangeStream:
+    def __init__(self, coll):
+        self.coll = coll
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __iter__(self):
+        while True:
+            event = self.coll.events.get()
+            if event is None:
+                return
+            yield event
+
+
+class FakeAdminCollection:
+    def __init__(self, doc, watch_error=None):
+        self.full_name = "tigersnatch.admin"
+        self.doc = doc
+        self.n_reads = 0
+        self.watch_error = watch_error
+        self.watch_pipeline = None
+        self.events = queue.Queue()
+        self.watching = threading.Event()
+
+    def find_one(self, filter, projection):
+        self.n_reads += 1
+        return {
+            k: v
+            for k, v in self.doc.items()
+            if projection.get(k, 1) != 0 and k != "_id"
+        }
+
+    def watch(self, pipeline=None):
+        self.watch_pipeline = pipeline
+        if self.watch_error is not None:
+            self.watching.set()
+            raise self.watch_error
+        self.watching.set()
+        return FakeChangeStream(self)
+
+
+class AdminCacheTests(unittest.TestCase):
+    def load_admincache(self):
+        modules = {
+            "pymongo": make_module("pymongo"),
+            "pymongo.errors": make_module(
+                "pymongo.errors", OperationFailure=FakeOperationFailure
+            ),
+            "config": make_module(
+                "config", ADMIN_CACHE_TTL_SECS=60, ADMIN_CACHE_WATCH=False
+            ),
+            "log_utils": make_module("log_utils", log_error=noop, log_info=noop),
+        }
+        with ModulePatch(modules):
+            return load_module("admincache_under_test", ROOT / "src" / "admincache.py")
+
+    def admin_doc(self):
+        return {
+            "_id": 1,
+            "admins": ["admin1"],
+            "disabled_courses": ["000001"],
+            "logs": ["a log"],
+            "live_notifs_status": {"state": "countdown", "countdown": 30},
+        }
+
+    def test_snapshot_is_read_once_and_excludes_logs(self):
+        admincache = self.load_admincache()
+        coll = FakeAdminCollection(self.admin_doc())
+        cache = admincache.AdminCache(coll, ttl_secs=60, watch=False)
+
+        for _ in range(8):
+            doc = cache.get()
+
+        self.assertEqual(coll.n_reads, 1)
+        self.assertEqual(doc, {"admins": ["admin1"], "disabled_courses": ["000001"]})
+        self.assertEqual(cache.get_stats()["hits"], 7)
+
+    def test_snapshot_cannot_be_changed_by_callers(self):
+        admincache = self.load_admincache()
+        coll = FakeAdminCollection(self.admin_doc())
+        cache = admincache.AdminCache(coll, ttl_secs=60, watch=False)
+
+        cache.get()["admins"].append("intruder")
+
+        self.assertEqual(cache.get()["admins"], ["admin1"])
+
+    def test_invalidate_and_expiry_read_again(self):
+        admincache = self.load_admincache()
+        coll = FakeAdminCollection(self.admin_doc())
+        cache = admincache.AdminCache(coll, ttl_secs=60, watch=False)
+        cache.get()
+
+        coll.doc["admins"] = ["admin2"]
+        cache.invalidate()
+        self.assertEqual(cache.get()["admins"], ["admin2"])
+
+        expired = admincache.AdminCache(coll, ttl_secs=0, watch=False)
+        expired.get()
+        expired.get()
+        self.assertEqual(coll.n_reads, 4)
+
+    def test_change_stream_invalidates_snapshot(self):
+        admincache = self.load_admincache()
+        coll = FakeAdminCollection(self.admin_doc())
+        cache = admincache.AdminCache(coll, ttl_secs=60, watch=True)
+        cache.get()
+        self.assertTrue(coll.watching.wait(1))
+        cache.get()
+        n_reads = coll.n_reads
+
+        coll.doc["disabled_courses"] = []
+        coll.events.put({"operationType": "update"})
+        for _ in range(100):
+            if cache.get_stats()["invalidations"] >= 2:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(cache.get()["disabled_courses"], [])
+        self.assertEqual(coll.n_reads, n_reads + 1)
+        coll.events.put(None)
+
+    def test_change_stream_ignores_writes_to_uncached_fields(self):
+        admincache = self.load_admincache()
+        coll = FakeAdminCollection(self.admin_doc())
+        cache = admincache.AdminCache(coll, ttl_secs=60, watch=True)
+        cache.get()
+        self.assertTrue(coll.watching.wait(1))
+
+        self.assertEqual(coll.watch_pipeline, admincache.watch_pipeline())
+        (match,) = coll.watch_pipeline
+        filter_ = match["$match"]["$or"][1]["$expr"]["$gt"][0]["$size"]["$filter"]
+        uncached = re.compile(filter_["cond"]["$eq"][0]["$regexMatch"]["regex"])
+        for field in ("logs", "logs.7", "live_notifs_status.countdown"):
+            self.assertTrue(uncached.search(field), field)
+        for field in ("admins", "disabled_courses.0", "logsx"):
+            self.assertFalse(uncached.search(field), field)
+        coll.events.put(None)
+
+    def test_standalone_server_falls_back_to_ttl(self):
+        admincache = self.load_admincache()
+        coll = FakeAdminCollection(
+            self.admin_doc(),
+            watch_error=FakeOperationFailure(
+                "$changeStream is only supported on replica sets",
+                code=admincache.CHANGE_STREAM_UNSUPPORTED_CODE,
+            ),
+        )
+        cache = admincache.AdminCache(coll, ttl_secs=60, watch=True)
+
+        cache.get()
+        self.assertTrue(coll.watching.wait(1))
+        for _ in range(100):
+            if not cache.get_stats()["watching"]:
+                break
+            time.sleep(0.01)
+
+        self.assertFalse(cache.get_stats()["watching"])
+        self.assertEqual(cache.get()["admins"], ["admin1"])
+
+    def test_one_cache_per_collection(self):
+        admincache = self.load_admincache()
+        coll = FakeAdminCollection(self.admin_doc())
+
+        self.assertIs(
+            admincache.get_admin_cache(coll), admincache.get_admin_cache(coll)
+        )
+        admincache.get_admin_cache(coll).get()
+        self.assertEqual(admincache.get_admin_cache_stats()["reads"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.broadcasts = {}
+
+    def get_broadcast(self, broadcast_id):
+        return self.broadcasts.get(broadcast_id)
+
+    def start_broadcast(self, broadcast_id, subject, n_recipients):
+        self.broadcasts.setdefault(broadcast_id, {"sent_emails": []})
+        self.broadcasts[broadcast_id]["status"] = "running"
+
+    def add_broadcast_emails(self, broadcast_id, emails):
+        self.broadcasts[broadcast_id]["sent_emails"].extend(emails)
+
+    def finish_broadcast(self, broadcast_id):
+        self.broadcasts[broadcast_id]["status"] = "done"
+
+
+def load_broadcast(send_email):
+    modules = {
+        "config": make_module(
+            "config",
+            BROADCAST_BATCH_SIZE=2,
+            BROADCAST_MAX_WORKERS=2,
+            TS_EMAIL="tigersnatch@princeton.edu",
+        ),
+        "database": make_module("database", Database=object),
+        "log_utils": make_module("log_utils", log_info=noop),
+        "notify": make_module("notify", send_email=send_email),
+    }
+    with ModulePatch(modules):
+        return load_module("broadcast", ROOT / "src" / "broadcast.py")
+
+
+def recipients(data):
+    return [p["to"][0]["email"] for p in data["personalizations"]]
+
+
+class BroadcastTests(unittest.TestCase):
+    def test_recipients_are_batched_into_multi_personalization_requests(self):
+        sent = []
+        broadcast = load_broadcast(
+            lambda data: sent.append(recipients(data)) or ["id"] * len(sent[-1])
+        )
+
+        n_sent, failed = broadcast.send_broadcast(
+            "Hi", "Hello", ["c@x.edu", "a@x.edu", "b@x.edu", "a@x.edu"]
+        )
+
+        self.assertEqual((n_sent, failed), (3, []))
+        self.assertEqual(sorted(sent), [["a@x.edu", "b@x.edu"], ["c@x.edu"]])
+
+    def test_interrupted_broadcast_resumes_with_unsent_recipients(self):
+        emails = ["a@x.edu", "b@x.edu", "c@x.edu", "d@x.edu", "e@x.edu"]
+        db = FakeDatabase()
+
+        def flaky_send_email(data):
+            # SendGrid is down for the second request
+            if recipients(data)[0] == "c@x.edu":
+                return [None] * len(data["personalizations"])
+            return ["id"] * len(data["personalizations"])
+
+        broadcast = load_broadcast(flaky_send_email)
+        n_sent, failed = broadcast.send_broadcast("Hi", "Hello", emails, db=db)
+
+        self.assertEqual((n_sent, failed), (3, ["c@x.edu", "d@x.edu"]))
+        (progress,) = db.broadcasts.values()
+        self.assertEqual(progress["status"], "running")
+
+        sent = []
+        broadcast = load_broadcast(
+            lambda data: sent.append(recipients(data)) or ["id"] * len(sent[-1])
+        )
+        n_pending, _ = broadcast.send_broadcast(
+            "Hi", "Hello", emails, db=db, dry_run=True
+        )
+        self.assertEqual((n_pending, sent), (2, []))
+
+        n_sent, failed = broadcast.send_broadcast("Hi", "Hello", emails, db=db)
+
+        self.assertEqual((n_sent, failed), (2, []))
+        self.assertEqual(sent, [["c@x.edu", "d@x.edu"]])
+        self.assertEqual(progress["status"], "done")
+
+    def test_resume_after_recipients_changed_skips_those_sent_to(self):
+        db = FakeDatabase()
+
+        def failing_after_first_request(data):
+            if "a@x.edu" in recipients(data):
+                return ["id"] * len(data["personalizations"])
+            return [None] * len(data["personalizations"])
+
+        broadcast = load_broadcast(failing_after_first_request)
+        broadcast.send_broadcast(
+            "Hi", "Hello", ["a@x.edu", "b@x.edu", "c@x.edu", "d@x.edu"], db=db
+        )
+
+        # a@x.edu deleted their account and 0@x.edu signed up before the
+        # broadcast was run again
+        sent = []
+        broadcast = load_broadcast(
+            lambda data: sent.append(recipients(data)) or ["id"] * len(sent[-1])
+        )
+        n_sent, failed = broadcast.send_broadcast(
+            "Hi", "Hello", ["0@x.edu", "b@x.edu", "c@x.edu", "d@x.edu"], db=db
+        )
+
+        self.assertEqual((n_sent, failed), (3, []))
+        self.assertEqual(sorted(sent), [["0@x.edu", "c@x.edu"], ["d@x.edu"]])
+        (progress,) = db.broadcasts.values()
+        self.assertEqual(progress["status"], "done")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+from datetime import datetime
+
+import pytz
+from helpers import ROOT, ModulePatch, load_module
+from test_database_client import fake_database_modules
+from test_subscriptions import FakeMongoDatabase
+
+
+class CourseViewTests(unittest.TestCase):
+    def load_database(self):
+        modules = fake_database_modules(object)
+        modules["pytz"] = pytz
+        with ModulePatch(modules):
+            database = load_module(
+                "database_course_view_under_test", ROOT / "src" / "database.py"
+            )
+        db = database.Database.__new__(database.Database)
+        db._db = FakeMongoDatabase()
+        return db
+
+    def course_view(self):
+        return {
+            "courseid": "000001",
+            "displayname": "COS333",
+            "has_reserved_seats": False,
+            "class_40001": {
+                "classid": "40001",
+                "section": "P01",
+                "status_is_open": True,
+            },
+            "class_40002": {
+                "classid": "40002",
+                "section": "P02",
+                "status_is_open": True,
+            },
+            "_enrollments": [
+                {
+                    "classid": "40001",
+                    "enrollment": 10,
+                    "capacity": 10,
+                    "last_notif": datetime(2024, 1, 5, 13, 30),
+                },
+                {"classid": "40002", "enrollment": 3, "capacity": 10},
+            ],
+            "_waitlists": [
+                {"classid": "40001", "waitlist": ["user1", "user2", "user3", "gone"]}
+            ],
+            "_netids": ["user1", "user2", "user3", "gone"],
+            "_users": [
+                {"netid": "user1", "year": "2026"},
+                {"netid": "user2", "year": ""},
+                {"netid": "user3"},
+            ],
+        }
+
+    def test_course_view_is_one_aggregation(self):
+        db = self.load_database()
+        db._db.results[("courses", "aggregate")] = [self.course_view()]
+
+        course = db.get_course_view("000001")
+
+        self.assertEqual(
+            [call[:2] for call in db._db.calls], [("courses", "aggregate")]
+        )
+        (pipeline,) = db._db.calls[0][2]
+        (users_lookup,) = [
+            stage["$lookup"]
+            for stage in pipeline
+            if stage.get("$lookup", {}).get("from") == "users"
+        ]
+        self.assertEqual(
+            users_lookup["pipeline"], [{"$project": {"_id": 0, "netid": 1, "year": 1}}]
+        )
+        self.assertFalse([key for key in course if key.startswith("_")])
+        full = course["class_40001"]
+        self.assertEqual((full["enrollment"], full["capacity"]), (10, 10))
+        self.assertTrue(full["isFull"])
+        self.assertEqual(full["wl_size"], 4)
+        self.assertEqual(full["time_of_last_notif"], "1/5 @ 8:30 AM")
+        self.assertEqual(full["subscribers"], {"2026": ["user1"], "Other": ["user2"]})
+        open_class = course["class_40002"]
+        self.assertFalse(open_class["isFull"])
+        self.assertEqual(open_class["wl_size"], 0)
+        self.assertIsNone(open_class["time_of_last_notif"])
+        self.assertEqual(open_class["subscribers"], {})
+
+    def test_missing_course_returns_none(self):
+        db = self.load_database()
+
+        self.assertIsNone(db.get_course_view("000001"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from helpers import ROOT, load_module
+
+
+def load_cycletrace():
+    return load_module("cycletrace", ROOT / "src" / "cycletrace.py")
+
+
+class CycleTraceTests(unittest.TestCase):
+    def setUp(self):
+        self.cycletrace = load_cycletrace()
+
+    def test_span_records_counts_and_calls(self):
+        trace = self.cycletrace.CycleTrace()
+        self.cycletrace.record_http_request()
+
+        with trace.span("seat_fetch") as counts:
+            counts["courses"] = 3
+            self.cycletrace.DB_COMMAND_COUNTER.started(None)
+            self.cycletrace.DB_COMMAND_COUNTER.started(None)
+            self.cycletrace.record_http_request()
+
+        doc = trace.to_doc(async_cycle=True)
+        self.assertTrue(doc["async_cycle"])
+        self.assertEqual(len(doc["spans"]), 1)
+        span = doc["spans"][0]
+        self.assertEqual(span["name"], "seat_fetch")
+        self.assertEqual(span["counts"], {"courses": 3})
+        self.assertEqual(span["db_calls"], 2)
+        self.assertEqual(span["http_calls"], 1)
+        self.assertGreaterEqual(span["duration_secs"], 0)
+
+    def test_span_is_recorded_when_phase_raises(self):
+        trace = self.cycletrace.CycleTrace()
+
+        with self.assertRaises(RuntimeError):
+            with trace.span("email_send"):
+                raise RuntimeError("send failed")
+
+        self.assertEqual(
+            [span["name"] for span in trace.to_doc()["spans"]], ["email_send"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import unittest
+from unittest import mock
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeMongoDatabase:
+    def __init__(self, names):
+        self.names = names
+        self.n_list_calls = 0
+
+    def list_collection_names(self):
+        self.n_list_calls += 1
+        return list(self.names)
+
+
+class FakeMongoClient:
+    instances = []
+
+    def __init__(self, connection_str, **kwargs):
+        self.kwargs = kwargs
+        self.admin = mock.Mock()
+        if FakeMongoClient.unavailable:
+            self.admin.command.side_effect = FakeConnectionFailure()
+        self.tigersnatch = FakeMongoDatabase(FakeMongoClient.names)
+        FakeMongoClient.instances.append(self)
+
+
+class FakeConnectionFailure(Exception):
+    pass
+
+
+# returns fake modules for everything database.py imports
+def fake_database_modules(mongo_client, subscription_transactions=False):
+    return {
+        "certifi": make_module("certifi", where=lambda: "ca.pem"),
+        "heroku3": make_module("heroku3"),
+        "pytz": make_module("pytz", timezone=lambda name: None),
+        "bson": make_module("bson", ObjectId=object),
+        "pymongo": make_module(
+            "pymongo",
+            InsertOne=object,
+            MongoClient=mongo_client,
+            UpdateMany=object,
+            UpdateOne=object,
+        ),
+        "pymongo.errors": make_module(
+            "pymongo.errors",
+            BulkWriteError=Exception,
+            ConnectionFailure=FakeConnectionFailure,
+        ),
+        "activedirectory": make_module("activedirectory", ActiveDirectory=object),
+        "admincache": make_module(
+            "admincache", get_admin_cache=noop, get_admin_cache_stats=noop
+        ),
+        "config": make_module(
+            "config",
+            COLLECTIONS={"users", "system"},
+            DB_CONNECTION_STR="mongodb://x",
+            DB_MAX_POOL_SIZE=20,
+            DB_MIN_POOL_SIZE=2,
+            DELIVERY_DEDUPE_WINDOW_SECS=60,
+            DELIVERY_STATS_HOURS=24,
+            HEROKU_API_KEY="x",
+            HEROKU_APP_NAME="x",
+            LAZY_COLLECTIONS={"outbox", "metrics"},
+            MAX_ADMIN_LOG_LENGTH=10,
+            MAX_AUTO_RESUB_NOTIFS=10,
+            MAX_LOG_LENGTH=10,
+            MAX_WAITLIST_SIZE=10,
+            METRICS_SUMMARY_CYCLES=10,
+            NOTIFS_INTERVAL_SECS=10,
+            OUTBOX_LEASE_SECS=10,
+            OUTBOX_MAX_ATTEMPTS=3,
+            OUTBOX_RETENTION_DAYS=10,
+            SUBSCRIPTION_TRANSACTIONS=subscription_transactions,
+            TS_DOMAIN="x",
+        ),
+        "cycletrace": make_module("cycletrace", DB_COMMAND_COUNTER=object()),
+        "log_utils": make_module(
+            "log_utils", log_error=noop, log_info=noop, log_system=noop
+        ),
+        "schema": make_module(
+            "schema",
+            CLASS_SCHEMA={},
+            COURSES_SCHEMA={},
+            ENROLLMENTS_SCHEMA={},
+            MAPPINGS_SCHEMA={},
+        ),
+        "systemlog": make_module(
+            "systemlog",
+            get_system_log_stats=noop,
+            get_system_log_writer=noop,
+        ),
+    }
+
+
+class DatabaseClientTests(unittest.TestCase):
+    def setUp(self):
+        FakeMongoClient.instances = []
+        FakeMongoClient.names = {"users", "system", "outbox"}
+        FakeMongoClient.unavailable = False
+
+    def load_database(self):
+        modules = fake_database_modules(FakeMongoClient)
+        with ModulePatch(modules):
+            return load_module(
+                "database_client_under_test", ROOT / "src" / "database.py"
+            )
+
+    def test_database_objects_share_one_client_per_process(self):
+        database = self.load_database()
+
+        first = database.Database()
+        second = database.Database()
+
+        self.assertEqual(len(FakeMongoClient.instances), 1)
+        client = FakeMongoClient.instances[0]
+        self.assertIs(first._db, client.tigersnatch)
+        self.assertIs(second._db, client.tigersnatch)
+        self.assertEqual(client.tigersnatch.n_list_calls, 1)
+        client.admin.command.assert_called_once_with("ismaster")
+        self.assertEqual(client.kwargs["maxPoolSize"], 20)
+        self.assertEqual(client.kwargs["minPoolSize"], 2)
+
+    def test_forked_process_gets_its_own_client(self):
+        database = self.load_database()
+        db = database.Database()
+
+        with mock.patch.object(database, "getpid", return_value=-1):
+            forked_db = db._db
+
+        self.assertEqual(len(FakeMongoClient.instances), 2)
+        self.assertIs(forked_db, FakeMongoClient.instances[1].tigersnatch)
+
+    def test_assigned_database_is_used_instead_of_shared_one(self):
+        database = self.load_database()
+        db = database.Database.__new__(database.Database)
+        scratch = FakeMongoDatabase(set())
+
+        db._db = scratch
+
+        self.assertIs(db._db, scratch)
+        self.assertEqual(FakeMongoClient.instances, [])
+
+    def test_failed_integrity_check_does_not_publish_client(self):
+        FakeMongoClient.names = {"users"}
+        database = self.load_database()
+
+        with self.assertRaises(RuntimeError):
+            database.Database()
+        FakeMongoClient.names = {"users", "system"}
+        database.Database()
+
+        self.assertEqual(len(FakeMongoClient.instances), 2)
+
+    def test_unavailable_server_raises(self):
+        database = self.load_database()
+        FakeMongoClient.unavailable = True
+
+        with self.assertRaisesRegex(Exception, "server unavailable"):
+            database.Database()
+        self.assertEqual(FakeMongoClient.instances[0].tigersnatch.n_list_calls, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import threading
+import unittest
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeTrace:
+    def __init__(self):
+        self.spans = {}
+
+    def span(self, name):
+        trace = self
+
+        class Span:
+            def __enter__(self):
+                trace.spans[name] = {}
+                return trace.spans[name]
+
+            def __exit__(self, *args):
+                return False
+
+        return Span()
+
+
+def load_delivery(send_email, send_text):
+    modules = {
+        "config": make_module("config", EMAIL_MAX_WORKERS=4, SMS_MAX_WORKERS=2),
+        "cycletrace": make_module("cycletrace", CycleTrace=FakeTrace),
+        "log_utils": make_module("log_utils", log_error=noop),
+        "notify": make_module("notify", send_email=send_email, send_text=send_text),
+        "providers": make_module(
+            "providers",
+            get_send_rate=lambda name: {"sendgrid": 2.5, "twilio": 1.0}[name],
+        ),
+    }
+    with ModulePatch(modules):
+        return load_module("delivery", ROOT / "src" / "delivery.py")
+
+
+class DeliveryExecutorTests(unittest.TestCase):
+    def test_results_are_per_message_and_in_order(self):
+        def send_email(data):
+            if data["fail"]:
+                raise RuntimeError("sendgrid down")
+            return data["ids"]
+
+        delivery = load_delivery(
+            send_email, lambda phone, msg: [None if phone == "bad" else "SM1"]
+        )
+        executor = delivery.DeliveryExecutor()
+        trace = FakeTrace()
+
+        emails_res, texts_res = executor.deliver(
+            [
+                [{"ids": ["m1", "m1", None], "fail": False}],
+                [{"ids": [None], "fail": False}],
+                [{"ids": ["m2"], "fail": True}],
+            ],
+            [["6095550100", "hi"], ["bad", "hi"]],
+            trace,
+        )
+        executor.shutdown()
+
+        self.assertEqual(emails_res, [["m1", "m1", None], [None], None])
+        self.assertEqual(texts_res, [["SM1"], [None]])
+        self.assertEqual(delivery.count_sent(emails_res), 2)
+        self.assertEqual(trace.spans["email_send"], {"requests": 3, "sent": 2})
+        self.assertEqual(trace.spans["sms_send"], {"texts": 2, "sent": 1})
+
+    def test_emails_and_texts_are_sent_concurrently(self):
+        # the email only completes once the text has started, which would
+        # deadlock if texts waited for all emails to be sent
+        text_started = threading.Event()
+
+        def send_email(data):
+            return [text_started.wait(timeout=5)]
+
+        def send_text(phone, msg):
+            text_started.set()
+            return ["SM1"]
+
+        delivery = load_delivery(send_email, send_text)
+        executor = delivery.DeliveryExecutor()
+
+        emails_res, texts_res = executor.deliver([[{}]], [["6095550100", "hi"]])
+        executor.shutdown()
+
+        self.assertEqual(emails_res, [[True]])
+        self.assertEqual(texts_res, [["SM1"]])
+
+    def test_status_reports_send_rate_and_queue_depth(self):
+        release = threading.Event()
+        delivery = load_delivery(
+            lambda data: release.wait(timeout=5), lambda phone, msg: True
+        )
+        executor = delivery.DeliveryExecutor(email_max_workers=1)
+
+        futures = [executor.submit("email", [{}]) for _ in range(3)]
+
+        self.assertEqual(executor.get_status(), {"email": (2.5, 3), "sms": (1.0, 0)})
+
+        release.set()
+        for future in futures:
+            future.result()
+        executor.shutdown()
+
+        self.assertEqual(executor.get_status()["email"], (2.5, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
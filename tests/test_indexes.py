@@ -0,0 +1,271 @@
+import unittest
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeOperationFailure(Exception):
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeCursor:
+    def __init__(self, plan):
+        self.plan = plan
+        self.sorted_by = None
+
+    def sort(self, sort):
+        self.sorted_by = sort
+        return self
+
+    def explain(self):
+        return {"queryPlanner": {"winningPlan": self.plan}}
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def create_index(self, keys, **options):
+        self.db.created.append((self.name, keys, options))
+        error = self.db.create_errors.get((self.name, tuple(keys)))
+        if error is not None:
+            raise error
+        return "_".join(f"{key}_{direction}" for key, direction in keys)
+
+    def find(self, filter):
+        return FakeCursor(self.db.plans.get(self.name, {"stage": "IXSCAN"}))
+
+    def aggregate(self, pipeline):
+        groups = {}
+        for doc in sorted(self.db.docs[self.name], key=lambda doc: doc["_id"]):
+            group = groups.setdefault(
+                doc["classid"], {"_id": doc["classid"], "ids": [], "waitlists": []}
+            )
+            group["ids"].append(doc["_id"])
+            group["waitlists"].append(doc["waitlist"])
+        return iter(group for group in groups.values() if len(group["ids"]) > 1)
+
+    def update_one(self, filter, update):
+        for doc in self.db.docs[self.name]:
+            if doc["_id"] == filter["_id"]:
+                doc.update(update["$set"])
+
+    def delete_many(self, filter):
+        self.db.docs[self.name] = [
+            doc
+            for doc in self.db.docs[self.name]
+            if doc["_id"] not in filter["_id"]["$in"]
+        ]
+
+    def index_information(self):
+        return self.db.index_info.get(self.name, {})
+
+    def drop_index(self, name):
+        self.db.dropped.append((self.name, name))
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.created = []
+        self.create_errors = {}
+        self.commands = []
+        self.plans = {}
+        self.docs = {}
+        self.index_info = {}
+        self.dropped = []
+
+    def __getitem__(self, name):
+        return FakeCollection(self, name)
+
+    def __getattr__(self, name):
+        return FakeCollection(self, name)
+
+    def command(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+
+
+class IndexesTests(unittest.TestCase):
+    def load_indexes(self, errors=None):
+        errors = errors if errors is not None else []
+        modules = {
+            "pymongo": make_module("pymongo"),
+            "pymongo.errors": make_module(
+                "pymongo.errors", OperationFailure=FakeOperationFailure
+            ),
+            "config": make_module(
+                "config",
+                DELIVERY_RETENTION_DAYS=14,
+                METRICS_TTL_DAYS=30,
+                OUTBOX_RETENTION_DAYS=7,
+            ),
+            "log_utils": make_module(
+                "log_utils",
+                log_error=lambda message: errors.append(message),
+                log_info=noop,
+            ),
+        }
+        with ModulePatch(modules):
+            return load_module("indexes_under_test", ROOT / "src" / "indexes.py")
+
+    def test_ensure_indexes_creates_every_declared_index(self):
+        indexes = self.load_indexes()
+        db = FakeDatabase()
+
+        names = indexes.ensure_indexes(db)
+
+        self.assertEqual(len(names), len(indexes.INDEXES))
+        self.assertEqual(
+            [(coll, keys, options) for coll, keys, options in db.created],
+            indexes.INDEXES,
+        )
+        self.assertIn(("users", [("netid", 1)], {}), db.created)
+        self.assertIn(("api_keys", [("key", 1)], {}), db.created)
+        self.assertIn(
+            ("metrics", [("time", 1)], {"expireAfterSeconds": 30 * 24 * 60 * 60}),
+            db.created,
+        )
+
+    def test_changed_ttl_is_updated_in_place(self):
+        indexes = self.load_indexes()
+        db = FakeDatabase()
+        db.create_errors[("metrics", (("time", 1),))] = FakeOperationFailure(
+            "IndexOptionsConflict", code=85
+        )
+
+        names = indexes.ensure_indexes(db)
+
+        self.assertIn("time_1", names)
+        self.assertEqual(
+            db.commands,
+            [
+                (
+                    ("collMod", "metrics"),
+                    {
+                        "index": {
+                            "keyPattern": {"time": 1},
+                            "expireAfterSeconds": 30 * 24 * 60 * 60,
+                        }
+                    },
+                )
+            ],
+        )
+
+    def test_failed_index_is_logged_and_skipped(self):
+        errors = []
+        indexes = self.load_indexes(errors)
+        db = FakeDatabase()
+        db.create_errors[("users", (("netid", 1),))] = FakeOperationFailure(
+            "IndexOptionsConflict", code=85
+        )
+
+        names = indexes.ensure_indexes(db)
+
+        self.assertEqual(len(names), len(indexes.INDEXES) - 1)
+        self.assertEqual(db.commands, [])
+        self.assertEqual(len(errors), 1)
+
+    def test_existing_non_unique_index_is_not_ensured(self):
+        errors = []
+        indexes = self.load_indexes(errors)
+        db = FakeDatabase()
+        db.create_errors[("waitlists", (("classid", 1),))] = FakeOperationFailure(
+            "Index already exists with a different name", code=86
+        )
+
+        names = indexes.ensure_indexes(db)
+
+        self.assertEqual(len(names), len(indexes.INDEXES) - 1)
+        self.assertEqual(db.commands, [])
+        self.assertEqual(len(errors), 1)
+
+    def test_waitlists_index_is_migrated_to_unique(self):
+        indexes = self.load_indexes()
+        db = FakeDatabase()
+        db.docs["waitlists"] = [
+            {"_id": 1, "classid": "40001", "waitlist": ["user1", "user2"]},
+            {"_id": 2, "classid": "40002", "waitlist": ["user3"]},
+            {"_id": 3, "classid": "40001", "waitlist": ["user2", "user4"]},
+        ]
+        db.index_info["waitlists"] = {
+            "_id_": {"key": [("_id", 1)]},
+            "classid_1": {"key": [("classid", 1)]},
+        }
+
+        self.assertEqual(indexes.migrate_waitlists_index(db), "classid_1")
+
+        self.assertEqual(
+            db.docs["waitlists"],
+            [
+                {
+                    "_id": 1,
+                    "classid": "40001",
+                    "waitlist": ["user1", "user2", "user4"],
+                },
+                {"_id": 2, "classid": "40002", "waitlist": ["user3"]},
+            ],
+        )
+        self.assertEqual(db.dropped, [("waitlists", "classid_1")])
+        self.assertEqual(
+            db.created, [("waitlists", [("classid", 1)], {"unique": True})]
+        )
+
+    def test_unique_waitlists_index_is_kept(self):
+        indexes = self.load_indexes()
+        db = FakeDatabase()
+        db.docs["waitlists"] = [{"_id": 1, "classid": "40001", "waitlist": []}]
+        db.index_info["waitlists"] = {
+            "classid_1": {"key": [("classid", 1)], "unique": True}
+        }
+
+        indexes.migrate_waitlists_index(db)
+
+        self.assertEqual(db.dropped, [])
+        self.assertEqual(len(db.created), 1)
+
+    def test_verify_indexes_reports_collscans(self):
+        errors = []
+        indexes = self.load_indexes(errors)
+        db = FakeDatabase()
+        db.plans["api_keys"] = {
+            "stage": "PROJECTION_SIMPLE",
+            "inputStage": {"stage": "COLLSCAN", "filter": {"key": {"$eq": "x"}}},
+        }
+        db.plans["outbox"] = {
+            "stage": "SORT",
+            "inputStage": {
+                "stage": "OR",
+                "inputStages": [
+                    {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+                    {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+                ],
+            },
+        }
+
+        collscans = indexes.verify_indexes(db)
+
+        self.assertEqual(collscans, [("api_keys", {"key": "x"})])
+        self.assertEqual(len(errors), 1)
+
+    def test_plan_stages_walks_nested_plans(self):
+        indexes = self.load_indexes()
+
+        stages = indexes.plan_stages(
+            {
+                "queryPlan": {
+                    "stage": "FETCH",
+                    "inputStage": {
+                        "stage": "OR",
+                        "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}],
+                    },
+                },
+                "slotBasedPlan": {"slots": "..."},
+            }
+        )
+
+        self.assertEqual(stages, {"FETCH", "OR", "IXSCAN", "COLLSCAN"})
+
+
+if __name__ == "__main__":
+    unittest.main()
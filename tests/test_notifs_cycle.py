@@ -0,0 +1,155 @@
+import contextlib
+import unittest
+from datetime import datetime
+
+import pytz
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeTrace:
+    cycle_id = "cycle"
+
+    @contextlib.contextmanager
+    def span(self, name):
+        yield {}
+
+    def to_doc(self, **kwargs):
+        return {}
+
+
+class FakeNotify:
+    def __init__(self, classid, netids, fail=False):
+        self.classid = classid
+        self.netids = netids
+        self.fail = fail
+        self.n_new_slots = 1
+
+    def get_netids(self):
+        return self.netids
+
+    def get_classid(self):
+        return self.classid
+
+    def get_priority(self):
+        return 1
+
+    def get_name(self):
+        return self.classid
+
+    def send_emails_html(self):
+        if self.fail:
+            raise RuntimeError("no email for user")
+        return [{"netids": self.netids}]
+
+    def send_sms(self):
+        return []
+
+    def get_text_netids(self):
+        return []
+
+
+class FakeMonitor:
+    def __init__(self):
+        self.saved = None
+
+    def get_classes_with_changed_enrollments(self, trace):
+        return {"40001": 1, "40002": 1, "40003": 1}, 1
+
+    def save_fingerprints(self, notified_classids):
+        self.saved = set(notified_classids)
+
+    clear_cache = update_live_notifs_state_active = noop
+    update_live_notifs_state_countdown = noop
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.outbox = []
+
+    def get_maintenance_status(self):
+        return False
+
+    def add_outbox_messages(self, msgs):
+        self.outbox.extend(msgs)
+
+    def __getattr__(self, name):
+        return noop
+
+
+def load_send_notifs(notifies):
+    class FakeNotifyBatch:
+        def __init__(self, new_slots, db):
+            pass
+
+        def get_notifies(self):
+            return notifies
+
+        flush = noop
+
+    modules = {
+        "pandas": make_module("pandas"),
+        "requests": make_module("requests"),
+        "icalendar": make_module("icalendar", Calendar=object),
+        "asyncmobileapp": make_module("asyncmobileapp", AsyncMobileApp=object),
+        "config": make_module(
+            "config",
+            ASYNC_NOTIFS_CYCLE=False,
+            AUTO_GENERATE_NOTIF_SCHEDULE=False,
+            NOTIFS_INTERVAL_SECS=120,
+            OIT_NOTIFS_OFFSET_MINS=0,
+            OUTBOX_INLINE_DELIVERY=False,
+        ),
+        "cycletrace": make_module("cycletrace", CycleTrace=FakeTrace),
+        "database": make_module("database", Database=FakeDatabase),
+        "delivery": make_module("delivery", DeliveryExecutor=object, count_sent=len),
+        "log_utils": make_module(
+            "log_utils", log_error=noop, log_info=noop, log_notifs=noop
+        ),
+        "mobileapp": make_module("mobileapp", MobileApp=object),
+        "monitor": make_module("monitor", Monitor=object),
+        "notify": make_module(
+            "notify",
+            NotifyBatch=FakeNotifyBatch,
+            count_email_recipients=lambda args: len(args["netids"]),
+            get_email_netids=lambda args: args["netids"],
+        ),
+        "outbox": make_module(
+            "outbox",
+            OutboxWorker=object,
+            outbox_message=lambda cycle_id, classid, *args: classid,
+        ),
+        "providers": make_module("providers", get_provider_stats=noop),
+        "systemlog": make_module("systemlog", flush_system_logs=noop),
+        "transport": make_module(
+            "transport", get_transport=lambda: make_module("t", get_stats=noop)
+        ),
+    }
+    with ModulePatch(modules):
+        return load_module("send_notifs_under_test", ROOT / "src" / "send_notifs.py")
+
+
+class NotifsCycleTests(unittest.TestCase):
+    def test_failed_sections_are_not_saved_as_seen(self):
+        send_notifs = load_send_notifs(
+            [
+                FakeNotify("40001", ["user1"]),
+                # every subscriber was notified recently
+                FakeNotify("40002", []),
+                FakeNotify("40003", ["user3"], fail=True),
+            ]
+        )
+        db = FakeDatabase()
+        engine = send_notifs.NotificationEngine(
+            db=db, use_async=False, inline_delivery=False
+        )
+        engine._monitor = FakeMonitor()
+
+        engine.run_cycle(pytz.utc.localize(datetime(2000, 1, 1)))
+
+        self.assertEqual(db.outbox, ["40001"])
+        self.assertEqual(engine._monitor.saved, {"40001", "40002"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,48 +1,9 @@
-import importlib.util
-import sys
-import types
 import unittest
 from datetime import datetime, timedelta
-from pathlib import Path
 
 import pytz
 
-ROOT = Path(__file__).resolve().parents[1]
-
-
-class ModulePatch:
-    def __init__(self, modules):
-        self.modules = modules
-        self.originals = {}
-
-    def __enter__(self):
-        for name, module in self.modules.items():
-            self.originals[name] = sys.modules.get(name)
-            sys.modules[name] = module
-
-    def __exit__(self, exc_type, exc, tb):
-        for name in self.modules:
-            original = self.originals[name]
-            if original is None:
-                sys.modules.pop(name, None)
-            else:
-                sys.modules[name] = original
-
-
-def make_module(name, **attrs):
-    module = types.ModuleType(name)
-    for key, value in attrs.items():
-        setattr(module, key, value)
-    return module
-
-
-def load_module(name, path):
-    sys.modules.pop(name, None)
-    spec = importlib.util.spec_from_file_location(name, path)
-    module = importlib.util.module_from_spec(spec)
-    sys.modules[name] = module
-    spec.loader.exec_module(module)
-    return module
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
 
 
 class FakeScheduler:
@@ -67,10 +28,6 @@ class FakeScheduler:
         self.actions.append("shutdown")
 
 
-def noop(*args, **kwargs):
-    return None
-
-
 class NotifsCronRegressionTests(unittest.TestCase):
     def load_cron(self):
         FakeScheduler.actions = []
@@ -82,6 +39,7 @@ class NotifsCronRegressionTests(unittest.TestCase):
             "send_notifs",
             AUTO_GENERATE_NOTIF_SCHEDULE=True,
             cronjob=noop,
+            NotificationEngine=object,
             update_live_notifs_countdown=noop,
             update_stats=noop,
             set_status_indicator_to_on=lambda: actions.append("status_on"),
@@ -171,13 +129,20 @@ class SendNotifsRegressionTests(unittest.TestCase):
                 return None
 
         modules = {
+            "asyncmobileapp": make_module("asyncmobileapp", AsyncMobileApp=object),
             "config": make_module(
                 "config",
+                ASYNC_NOTIFS_CYCLE=False,
                 AUTO_GENERATE_NOTIF_SCHEDULE=True,
                 NOTIFS_INTERVAL_SECS=120,
                 OIT_NOTIFS_OFFSET_MINS=5,
+                OUTBOX_INLINE_DELIVERY=True,
             ),
+            "cycletrace": make_module("cycletrace", CycleTrace=object),
             "database": make_module("database", Database=FakeDatabase),
+            "delivery": make_module(
+                "delivery", DeliveryExecutor=object, count_sent=noop
+            ),
             "icalendar": make_module("icalendar", Calendar=FakeCalendar),
             "log_utils": make_module(
                 "log_utils",
@@ -185,14 +150,19 @@ class SendNotifsRegressionTests(unittest.TestCase):
                 log_warning=lambda message: warnings.append(message),
                 log_notifs=noop,
             ),
+            "mobileapp": make_module("mobileapp", MobileApp=object),
             "monitor": make_module("monitor", Monitor=object),
-            "multiprocess": make_module("multiprocess", Pool=object),
             "notify": make_module(
                 "notify",
                 Notify=object,
-                send_email=noop,
-                send_text=noop,
+                NotifyBatch=object,
+                count_email_recipients=noop,
+                get_email_netids=noop,
             ),
+            "outbox": make_module("outbox", OutboxWorker=object, outbox_message=noop),
+            "providers": make_module("providers", get_provider_stats=noop),
+            "systemlog": make_module("systemlog", flush_system_logs=noop),
+            "transport": make_module("transport", get_transport=noop),
             "requests": make_module("requests", get=lambda url: FakeResponse()),
         }
         with ModulePatch(modules):
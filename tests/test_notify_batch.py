@@ -0,0 +1,218 @@
+import unittest
+from datetime import datetime, timedelta
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeThrottledError(Exception):
+    pass
+
+
+class FakeWriteBuffer:
+    def __init__(self, db):
+        self.db = db
+
+    def update_users_notifs_history(self, netids, classid, n_open_spots, **kwargs):
+        self.db.writes.append(("notifs_history", classid, list(netids), n_open_spots))
+
+    def update_user_waitlist_log(self, netid, entry):
+        self.db.writes.append(("waitlist_log", netid))
+
+    def update_time_of_last_notif(self, classid):
+        self.db.writes.append(("last_notif", classid))
+
+    def add_system_log(self, type, meta, netid=None):
+        self.db.writes.append((type, netid))
+
+    def flush(self):
+        self.db.writes.append(("flush",))
+
+
+class FakeDatabase:
+    def __init__(self, waitlists, users, histories, reserved=False):
+        self.waitlists = waitlists
+        self.users = users
+        self.histories = histories
+        self.reserved = reserved
+        self.writes = []
+        self.removals = None
+
+    def classids_to_classinfo(self, classids):
+        return {
+            classid: ("COS126", "Intro", "P01", "002054", self.reserved)
+            for classid in classids
+        }
+
+    def get_class_waitlists(self, classids):
+        return {c: w for c, w in self.waitlists.items() if c in classids}
+
+    def get_users_by_netid(self, netids, keys):
+        return {n: u for n, u in self.users.items() if n in netids}
+
+    def get_users_notifs_histories(self, netids, classids):
+        return self.histories
+
+    def remove_from_waitlists_bulk(self, removals):
+        self.removals = removals
+
+
+def user(netid, auto_resub=False, phone=""):
+    return {
+        "netid": netid,
+        "email": f"{netid}@x.edu",
+        "phone": phone,
+        "auto_resub": auto_resub,
+    }
+
+
+def history(n_open_spots, mins_ago, num_notifs=0):
+    return {
+        "n_open_spots": n_open_spots,
+        "last_notif": datetime.utcnow() - timedelta(minutes=mins_ago),
+        "num_notifs": num_notifs,
+    }
+
+
+class NotifyBatchTests(unittest.TestCase):
+    def load_notify(self):
+        modules = {
+            "config": make_module(
+                "config",
+                MAX_AUTO_RESUB_NOTIFS=3,
+                MIN_NOTIFS_DELAY_MINS=10,
+                TS_DOMAIN="https://ts",
+                TS_EMAIL="ts@x.edu",
+            ),
+            "log_utils": make_module("log_utils", log_info=noop, log_warning=noop),
+            "providers": make_module(
+                "providers", ThrottledError=FakeThrottledError, get_provider=noop
+            ),
+            "writebuffer": make_module("writebuffer", WriteBuffer=FakeWriteBuffer),
+        }
+        with ModulePatch(modules):
+            return load_module("notify", ROOT / "src" / "notify.py")
+
+    def test_auto_resub_users_are_filtered_by_history(self):
+        notify = self.load_notify()
+        db = FakeDatabase(
+            waitlists={"100": ["a", "b", "c", "d"]},
+            users={
+                "a": user("a"),
+                "b": user("b", auto_resub=True),
+                "c": user("c", auto_resub=True),
+                "d": user("d", auto_resub=True),
+            },
+            histories={
+                "b": {"100": history(2, mins_ago=1)},
+                "c": {"100": history(1, mins_ago=1)},
+                "d": {"100": history(2, mins_ago=30)},
+            },
+        )
+
+        batch = notify.NotifyBatch({"100": 2, "200": 0}, db)
+        (section,) = batch.get_notifies()
+
+        # b was already notified of 2 spots recently; c saw a different count
+        self.assertEqual(section.get_netids(), ["a", "c", "d"])
+        self.assertIn(("notifs_history", "200", [], 0), db.writes)
+        self.assertIn(("notifs_history", "100", ["a", "c", "d"], 2), db.writes)
+        self.assertIn(("last_notif", "100"), db.writes)
+
+    def test_non_auto_resub_and_maxed_out_users_are_unsubscribed_on_flush(self):
+        notify = self.load_notify()
+        db = FakeDatabase(
+            waitlists={"100": ["a", "b", "c"]},
+            users={
+                "a": user("a", phone="6095550100"),
+                "b": user("b", auto_resub=True),
+                "c": user("c", auto_resub=True),
+            },
+            histories={
+                "b": {"100": history(0, mins_ago=1, num_notifs=2)},
+                "c": {"100": history(0, mins_ago=1, num_notifs=0)},
+            },
+        )
+
+        batch = notify.NotifyBatch({"100": 1}, db)
+        (section,) = batch.get_notifies()
+        emails = section.send_emails_html()
+        texts = section.send_sms()
+
+        # a and b share a template; c is auto-resubscribed
+        self.assertEqual(len(emails), 2)
+        self.assertEqual([len(args[0]["personalizations"]) for args in emails], [2, 1])
+        self.assertEqual(len(texts), 1)
+        self.assertIn("Resubscribe", texts[0][1])
+        self.assertEqual(section.get_text_netids(), ["a"])
+        self.assertIsNone(db.removals)
+
+        batch.flush()
+
+        # b reaches MAX_AUTO_RESUB_NOTIFS with this notification
+        self.assertEqual(db.removals, {"100": ["a", "b"]})
+
+    def test_sections_with_fewest_spots_per_subscriber_come_first(self):
+        notify = self.load_notify()
+        db = FakeDatabase(
+            waitlists={"100": ["a"], "200": ["a", "b", "c"], "300": ["b", "c"]},
+            users={"a": user("a"), "b": user("b"), "c": user("c")},
+            histories={},
+        )
+
+        batch = notify.NotifyBatch({"100": 1, "200": 1, "300": 4}, db)
+
+        self.assertEqual(
+            [section.get_classid() for section in batch.get_notifies()],
+            ["200", "100", "300"],
+        )
+
+    def test_failed_email_batch_falls_back_to_per_recipient_sends(self):
+        notify = self.load_notify()
+        posted = []
+
+        class FakeSendGridClient:
+            def send(self, data):
+                emails = [p["to"][0]["email"] for p in data["personalizations"]]
+                posted.append(emails)
+                if len(emails) > 1 or emails == ["bad@x.edu"]:
+                    raise RuntimeError("400 Bad Request")
+                return f"id-{emails[0]}"
+
+        notify.get_provider = lambda name: FakeSendGridClient()
+        data = {
+            "personalizations": [
+                {"to": [{"email": email}]}
+                for email in ["a@x.edu", "bad@x.edu", "c@x.edu"]
+            ],
+            "template_id": "d-1",
+        }
+
+        self.assertEqual(notify.send_email(data), ["id-a@x.edu", None, "id-c@x.edu"])
+        self.assertEqual(
+            posted,
+            [
+                ["a@x.edu", "bad@x.edu", "c@x.edu"],
+                ["a@x.edu"],
+                ["bad@x.edu"],
+                ["c@x.edu"],
+            ],
+        )
+
+    def test_throttled_email_batch_is_not_sent_per_recipient(self):
+        notify = self.load_notify()
+        posted = []
+
+        class FakeSendGridClient:
+            def send(self, data):
+                posted.append(data)
+                raise FakeThrottledError()
+
+        notify.get_provider = lambda name: FakeSendGridClient()
+        data = {"personalizations": [{"to": [{"email": "a@x.edu"}]}] * 2}
+
+        self.assertEqual(notify.send_email(data), [None, None])
+        self.assertEqual(len(posted), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
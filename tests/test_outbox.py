@@ -0,0 +1,194 @@
+import unittest
+from concurrent.futures import Future
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeDatabase:
+    def __init__(self, batches, delivered=()):
+        self.batches = list(batches)
+        self.delivered = set(delivered)
+        self.updates = {}
+        self.records = {}
+        self.n_counted = 0
+
+    def claim_outbox_messages(self, worker_id, n):
+        return self.batches.pop(0) if self.batches else []
+
+    def outbox_update_op(self, msg, fields):
+        return (msg["_id"], fields)
+
+    def bulk_write(self, coll, ops):
+        self.updates.update(ops)
+
+    def increment_email_counter(self, n):
+        self.n_counted += n
+
+    def get_delivered_keys(self, record_ids, keys):
+        return self.delivered & set(keys)
+
+    def add_delivery_records(self, records):
+        self.records.update((record["_id"], record) for record in records)
+
+
+class FakeDelivery:
+    # emails are sent to the recipients with a message ID in their "ids";
+    # texts to "bad" fail
+
+    def __init__(self):
+        self.submitted = []
+
+    def deliver(self, emails_args, texts_args, trace=None):
+        self.submitted.extend(emails_args + texts_args)
+        return (
+            [args[0]["ids"] for args in emails_args],
+            [send_text(*args) for args in texts_args],
+        )
+
+    def submit(self, channel, args):
+        self.submitted.append(channel)
+        future = Future()
+        future.set_result(args[0]["ids"] if channel == "email" else send_text(*args))
+        return future
+
+
+def send_text(phone, msg):
+    return [None if phone == "bad" else "SM1"]
+
+
+def count_sent(results):
+    return sum(len([i for i in res if i is not None]) for res in results if res)
+
+
+def wait_for_results(email_futures, text_futures, trace=None):
+    return (
+        [future.result() for future in email_futures],
+        [future.result() for future in text_futures],
+    )
+
+
+class FakeTrace:
+    def elapsed(self):
+        return 1.5
+
+
+def load_outbox():
+    modules = {
+        "config": make_module(
+            "config",
+            OUTBOX_CLAIM_BATCH=10,
+            OUTBOX_LEASE_SECS=60,
+            OUTBOX_MAX_ATTEMPTS=3,
+            OUTBOX_RETRY_DELAY_SECS=30,
+            OUTBOX_RETRY_MAX_DELAY_SECS=100,
+        ),
+        "cycletrace": make_module("cycletrace", CycleTrace=object),
+        "database": make_module("database", Database=object),
+        "delivery": make_module(
+            "delivery",
+            DeliveryExecutor=object,
+            count_sent=count_sent,
+            wait_for_results=wait_for_results,
+        ),
+        "log_utils": make_module("log_utils", log_error=noop, log_notifs=noop),
+    }
+    with ModulePatch(modules):
+        return load_module("outbox", ROOT / "src" / "outbox.py")
+
+
+def email(outbox, cycle_id, netids, ids):
+    data = {"personalizations": [{"to": netid} for netid in netids], "ids": ids}
+    return outbox.outbox_message(cycle_id, "100", "email", [data], netids, 1)
+
+
+def text(outbox, cycle_id, netid, phone):
+    return outbox.outbox_message(cycle_id, "100", "sms", [phone, "hi"], [netid], 1)
+
+
+def leased(msg, attempts):
+    msg.update({"status": "leased", "lease": "w:1", "attempts": attempts})
+    return msg
+
+
+class OutboxTests(unittest.TestCase):
+    def setUp(self):
+        self.outbox = load_outbox()
+
+    def test_same_notification_gets_same_idempotency_key_within_a_cycle(self):
+        key = text(self.outbox, "c1", "a", "6095550100")["_id"]
+
+        self.assertEqual(text(self.outbox, "c1", "a", "6095550100")["_id"], key)
+        self.assertNotEqual(text(self.outbox, "c2", "a", "6095550100")["_id"], key)
+        self.assertNotEqual(text(self.outbox, "c1", "b", "6095550101")["_id"], key)
+
+    def test_drain_records_sent_retried_and_dead_messages(self):
+        sent = leased(email(self.outbox, "c1", ["a", "b"], ["m1", "m1"]), attempts=1)
+        retried = leased(text(self.outbox, "c1", "c", "bad"), attempts=2)
+        dead = leased(email(self.outbox, "c1", ["d"], [None]), attempts=3)
+        db = FakeDatabase([[sent, retried], [dead]])
+        worker = self.outbox.OutboxWorker(db, FakeDelivery())
+
+        emails_res, texts_res = worker.drain()
+
+        self.assertEqual(emails_res, [["m1", "m1"], [None]])
+        self.assertEqual(texts_res, [[None]])
+        self.assertEqual(db.updates[sent["_id"]]["status"], "sent")
+        self.assertEqual(db.updates[sent["_id"]]["n_sent"], 2)
+        self.assertEqual(db.updates[retried["_id"]]["status"], "pending")
+        self.assertIn("available_at", db.updates[retried["_id"]])
+        self.assertEqual(db.updates[dead["_id"]]["status"], "dead")
+        self.assertEqual(db.n_counted, 2)
+
+        record = db.records["c1:email:a:100:1"]
+        self.assertEqual(record["status"], "sent")
+        self.assertEqual(record["provider_message_id"], "m1")
+        self.assertGreaterEqual(record["latency_secs"], 0)
+        self.assertEqual(db.records["c1:sms:c:100:1"]["status"], "failed")
+
+    def test_already_notified_recipients_are_skipped(self):
+        partly = leased(email(self.outbox, "c2", ["a", "b"], ["m2"]), attempts=1)
+        fully = leased(text(self.outbox, "c2", "a", "6095550100"), attempts=1)
+        db = FakeDatabase([[partly, fully]], delivered={"email:a:100:1", "sms:a:100:1"})
+        delivery = FakeDelivery()
+
+        self.outbox.OutboxWorker(db, delivery).drain()
+
+        self.assertEqual(len(delivery.submitted), 1)
+        self.assertEqual(delivery.submitted[0][0]["personalizations"], [{"to": "b"}])
+        self.assertEqual(db.updates[partly["_id"]]["status"], "sent")
+        self.assertEqual(db.updates[fully["_id"]]["status"], "skipped")
+        self.assertEqual(list(db.records), ["c2:email:b:100:1"])
+
+    def test_stream_stores_leased_messages_and_sends_them_right_away(self):
+        db = FakeDatabase([])
+        stored = []
+        db.add_outbox_messages = stored.extend
+        delivery = FakeDelivery()
+        stream = self.outbox.OutboxWorker(db, delivery).stream(FakeTrace())
+        sent = email(self.outbox, "c1", ["a", "b", "c"], ["m1"] * 3)
+        failed = text(self.outbox, "c1", "d", "bad")
+
+        stream.send([sent, failed])
+        stream.send([sent])
+
+        self.assertEqual(delivery.submitted, ["email", "sms"])
+        self.assertEqual([msg["status"] for msg in stored], ["leased", "leased"])
+        self.assertEqual(stream.first_sent_secs, 1.5)
+
+        emails_res, texts_res = stream.finish()
+
+        self.assertEqual((emails_res, texts_res), ([["m1"] * 3], [[None]]))
+        self.assertEqual(db.updates[sent["_id"]]["status"], "sent")
+        self.assertEqual(db.updates[failed["_id"]]["status"], "pending")
+        self.assertEqual(db.n_counted, 3)
+        self.assertEqual(len(db.records), 4)
+
+    def test_retry_delay_doubles_up_to_max(self):
+        self.assertEqual(
+            [self.outbox.retry_delay_secs(attempts) for attempts in (1, 2, 3, 4)],
+            [30, 60, 100, 100],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import threading
+import unittest
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+        self.n_throttled = 0
+
+    def send(self, *args):
+        if args[0] == "bad":
+            raise RuntimeError("provider rejected message")
+        if args[0] == "throttled" and self.n_throttled < 2:
+            self.n_throttled += 1
+            raise self.throttled_error("twilio", retry_after=0.01)
+        self.sent.append(args)
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.n_acquired = 0
+        self.pauses = []
+
+    def acquire(self):
+        self.n_acquired += 1
+
+    def pause(self, secs):
+        self.pauses.append(secs)
+
+    def get_rate(self):
+        return self.n_acquired
+
+
+def load_providers(limiters):
+    modules = {
+        "config": make_module(
+            "config",
+            PROVIDER_THROTTLE_BACKOFF_SECS=5,
+            PROVIDER_THROTTLE_RETRIES=2,
+            PROVIDER_TIMEOUT_SECS=1,
+            SENDGRID_API_KEY="",
+            SENDGRID_BASE_URL="https://api.sendgrid.com",
+            SENDGRID_BURST=1,
+            SENDGRID_RATE_PER_SEC=1,
+            TWILIO_BASE_URL="https://api.twilio.com",
+            TWILIO_BURST=1,
+            TWILIO_PHONE="",
+            TWILIO_RATE_PER_SEC=1,
+            TWILIO_SID="",
+            TWILIO_TOKEN="",
+        ),
+        "cycletrace": make_module("cycletrace", record_http_request=noop),
+        "log_utils": make_module("log_utils", log_warning=noop),
+        "ratelimit": make_module(
+            "ratelimit",
+            get_rate_limiter=lambda provider, account, rate, burst: limiters.setdefault(
+                provider, FakeLimiter()
+            ),
+        ),
+        "twilio": make_module("twilio"),
+        "twilio.base": make_module("twilio.base"),
+        "twilio.base.exceptions": make_module(
+            "twilio.base.exceptions", TwilioRestException=Exception
+        ),
+        "twilio.http": make_module("twilio.http"),
+        "twilio.http.http_client": make_module(
+            "twilio.http.http_client", TwilioHttpClient=object
+        ),
+        "twilio.rest": make_module("twilio.rest", Client=object),
+    }
+    with ModulePatch(modules):
+        module = load_module("providers", ROOT / "src" / "providers.py")
+    module._PROVIDERS = {"sendgrid": FakeClient, "twilio": FakeClient}
+    FakeClient.throttled_error = module.ThrottledError
+    return module
+
+
+class ProviderRegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.limiters = {}
+        self.providers = load_providers(self.limiters)
+
+    def test_clients_are_reused_within_a_thread(self):
+        client = self.providers.get_provider("sendgrid")
+
+        self.assertIs(self.providers.get_provider("sendgrid"), client)
+        self.assertIsNot(self.providers.get_provider("twilio"), client)
+
+    def test_each_thread_gets_its_own_client(self):
+        client = self.providers.get_provider("twilio")
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(self.providers.get_provider("twilio"))
+        )
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(other[0], client)
+
+    def test_calls_and_failures_are_recorded(self):
+        client = self.providers.get_provider("twilio")
+
+        client.send("6095550100", "hi")
+        with self.assertRaises(RuntimeError):
+            client.send("bad", "hi")
+
+        stats = self.providers.get_provider_stats()
+        self.assertEqual(stats["twilio"]["calls"], 2)
+        self.assertEqual(stats["twilio"]["failures"], 1)
+        self.assertGreaterEqual(stats["twilio"]["max_secs"], 0)
+        self.assertNotIn("sendgrid", stats)
+
+    def test_sends_are_rate_limited_and_throttled_sends_retried(self):
+        client = self.providers.get_provider("twilio")
+
+        client.send("throttled", "hi")
+
+        limiter = self.limiters["twilio"]
+        self.assertEqual(limiter.n_acquired, 3)
+        self.assertEqual(limiter.pauses, [0.01, 0.01])
+        self.assertEqual(self.providers.get_send_rate("twilio"), 3)
+        stats = self.providers.get_provider_stats()["twilio"]
+        self.assertEqual((stats["calls"], stats["throttled"]), (3, 2))
+        self.assertEqual(stats["failures"], 0)
+
+    def test_retry_after_is_read_from_sendgrid_headers(self):
+        self.assertEqual(self.providers._get_retry_after({"Retry-After": "3"}), 3)
+        self.assertIsNone(self.providers._get_retry_after({}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+from helpers import ROOT, load_module
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.slept.append(round(secs, 6))
+        self.now += secs
+
+
+def load_ratelimit(clock):
+    ratelimit = load_module("ratelimit", ROOT / "src" / "ratelimit.py")
+    ratelimit.monotonic = clock.monotonic
+    ratelimit.sleep = clock.sleep
+    return ratelimit
+
+
+class TokenBucketTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.ratelimit = load_ratelimit(self.clock)
+
+    def test_burst_is_sent_at_once_then_rate_is_kept(self):
+        bucket = self.ratelimit.TokenBucket(rate_per_sec=2, burst=3)
+
+        for _ in range(5):
+            bucket.acquire()
+
+        self.assertEqual(self.clock.slept, [0.5, 0.5])
+        self.assertEqual(bucket.get_rate(), 5 / self.ratelimit.RATE_WINDOW_SECS)
+
+    def test_pause_blocks_until_retry_after_has_passed(self):
+        bucket = self.ratelimit.TokenBucket(rate_per_sec=0, burst=1)
+
+        bucket.pause(7)
+        bucket.acquire()
+
+        self.assertEqual(self.clock.slept, [7])
+
+    def test_bucket_refills_from_the_end_of_a_pause(self):
+        bucket = self.ratelimit.TokenBucket(rate_per_sec=2, burst=4)
+
+        bucket.pause(10)
+        for _ in range(3):
+            bucket.acquire()
+
+        self.assertEqual(self.clock.slept, [10, 0.5, 0.5, 0.5])
+
+    def test_acquisitions_outside_the_rate_window_are_dropped(self):
+        bucket = self.ratelimit.TokenBucket(rate_per_sec=0, burst=1)
+
+        for _ in range(1000):
+            bucket.acquire()
+            self.clock.now += 1
+
+        self.assertLessEqual(len(bucket._acquired), self.ratelimit.RATE_WINDOW_SECS + 1)
+
+    def test_buckets_are_shared_per_provider_account(self):
+        bucket = self.ratelimit.get_rate_limiter("twilio", "AC1", 1, 1)
+
+        self.assertIs(self.ratelimit.get_rate_limiter("twilio", "AC1", 5, 5), bucket)
+        self.assertIsNot(self.ratelimit.get_rate_limiter("twilio", "AC2", 1, 1), bucket)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import unittest
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeMobileApp:
+    def __init__(self, fail_times=None):
+        # maps a comma-joined chunk of courseids to the number of times
+        # a request for that chunk should fail before succeeding
+        self.fail_times = dict(fail_times or {})
+        self.requests = []
+        self.lock = threading.Lock()
+        self.configs = make_module("configs", COURSE_SEATS="/courses/seats")
+
+    def get_seats(self, term, course_ids):
+        with self.lock:
+            self.requests.append(course_ids)
+            if self.fail_times.get(course_ids, 0) > 0:
+                self.fail_times[course_ids] -= 1
+                raise ValueError("bad response")
+        return {"course": [{"course_id": c} for c in course_ids.split(",")]}
+
+
+class FakeAsyncMobileApp(FakeMobileApp):
+    async def get_seats(self, term, course_ids):
+        await asyncio.sleep(0)
+        return FakeMobileApp.get_seats(self, term, course_ids)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.system_logs = []
+
+    def _add_system_log(self, type, meta, **kwargs):
+        self.system_logs.append((type, meta))
+
+
+class SeatsChunkingTests(unittest.TestCase):
+    def load_monitor_utils(self, errors):
+        modules = {
+            "config": make_module(
+                "config",
+                MIN_NOTIFS_DELAY_MINS=15,
+                SEATS_CHUNK_RETRIES=2,
+                SEATS_CHUNK_SIZE=2,
+                SEATS_MAX_IN_FLIGHT=3,
+                SEATS_MAX_WORKERS=3,
+                SEATS_RETRY_DELAY_SECS=0,
+            ),
+            "asyncmobileapp": make_module("asyncmobileapp", AsyncMobileApp=object),
+            "database": make_module("database", Database=FakeDatabase),
+            "log_utils": make_module(
+                "log_utils",
+                log_error=lambda message: errors.append(message),
+                log_notifs=noop,
+            ),
+            "mobileapp": make_module("mobileapp", MobileApp=FakeMobileApp),
+            "writebuffer": make_module("writebuffer", WriteBuffer=object),
+        }
+        with ModulePatch(modules):
+            return load_module("monitor_utils", ROOT / "src" / "monitor_utils.py")
+
+    def test_chunks_are_merged(self):
+        monitor_utils = self.load_monitor_utils([])
+        api = FakeMobileApp()
+
+        data = monitor_utils.get_seats_chunked(
+            api, FakeDatabase(), "1234", ["1", "2", "3", "4", "5"]
+        )
+
+        self.assertEqual(sorted(api.requests), ["1,2", "3,4", "5"])
+        self.assertEqual(
+            sorted(c["course_id"] for c in data["course"]), ["1", "2", "3", "4", "5"]
+        )
+
+    def test_failed_chunk_is_retried_on_its_own(self):
+        monitor_utils = self.load_monitor_utils([])
+        api = FakeMobileApp(fail_times={"3,4": 2})
+        db = FakeDatabase()
+
+        data = monitor_utils.get_seats_chunked(api, db, "1234", ["1", "2", "3", "4"])
+
+        self.assertEqual(api.requests.count("1,2"), 1)
+        self.assertEqual(api.requests.count("3,4"), 3)
+        self.assertEqual(len(data["course"]), 4)
+        self.assertEqual(len(db.system_logs), 2)
+
+    def test_chunk_failing_every_attempt_is_dropped(self):
+        errors = []
+        monitor_utils = self.load_monitor_utils(errors)
+        api = FakeMobileApp(fail_times={"1,2": 10})
+
+        data = monitor_utils.get_seats_chunked(
+            api, FakeDatabase(), "1234", ["1", "2", "3"]
+        )
+
+        self.assertEqual(api.requests.count("1,2"), 3)
+        self.assertEqual([c["course_id"] for c in data["course"]], ["3"])
+        self.assertEqual(len(errors), 1)
+
+    def test_no_courseids_makes_no_requests(self):
+        monitor_utils = self.load_monitor_utils([])
+        api = FakeMobileApp()
+
+        self.assertEqual(
+            monitor_utils.get_seats_chunked(api, FakeDatabase(), "1234", []), {}
+        )
+        self.assertEqual(api.requests, [])
+
+    def test_async_chunks_are_merged_and_retried(self):
+        errors = []
+        monitor_utils = self.load_monitor_utils(errors)
+        api = FakeAsyncMobileApp(fail_times={"3,4": 1, "5": 10})
+        db = FakeDatabase()
+
+        data = asyncio.run(
+            monitor_utils.get_seats_chunked_async(
+                api, db, "1234", ["1", "2", "3", "4", "5"]
+            )
+        )
+
+        self.assertEqual(api.requests.count("3,4"), 2)
+        self.assertEqual(api.requests.count("5"), 3)
+        self.assertEqual(
+            sorted(c["course_id"] for c in data["course"]), ["1", "2", "3", "4"]
+        )
+        self.assertEqual(len(db.system_logs), 4)
+        self.assertEqual(len(errors), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+from datetime import datetime, timedelta
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+
+def load_monitor_utils():
+    modules = {
+        "config": make_module(
+            "config",
+            MIN_NOTIFS_DELAY_MINS=15,
+            SEATS_CHUNK_RETRIES=0,
+            SEATS_CHUNK_SIZE=50,
+            SEATS_MAX_IN_FLIGHT=1,
+            SEATS_MAX_WORKERS=1,
+            SEATS_RETRY_DELAY_SECS=0,
+        ),
+        "asyncmobileapp": make_module("asyncmobileapp", AsyncMobileApp=object),
+        "database": make_module("database", Database=object),
+        "log_utils": make_module("log_utils", log_error=noop, log_notifs=noop),
+        "mobileapp": make_module("mobileapp", MobileApp=object),
+        "writebuffer": make_module("writebuffer", WriteBuffer=object),
+    }
+    with ModulePatch(modules):
+        return load_module("monitor_utils", ROOT / "src" / "monitor_utils.py")
+
+
+class FakeFingerprintDatabase:
+    def __init__(self):
+        self.stored = {}
+
+    def get_seats_fingerprints(self, classids):
+        return {
+            classid: self.stored[classid]
+            for classid in classids
+            if classid in self.stored
+        }
+
+    def seats_fingerprint_op(self, classid, fingerprint, time):
+        return (classid, fingerprint, time)
+
+    def bulk_write(self, coll, ops):
+        for classid, fingerprint, time in ops:
+            self.stored[classid] = {"fingerprint": fingerprint, "time": time}
+
+
+def load_monitor():
+    monitor_utils = load_monitor_utils()
+    database = make_module("database", Database=object)
+    with ModulePatch({"database": database}):
+        writebuffer = load_module("writebuffer", ROOT / "src" / "writebuffer.py")
+    modules = {
+        "asyncmobileapp": make_module("asyncmobileapp", AsyncMobileApp=object),
+        "config": make_module("config", COURSE_UPDATE_INTERVAL_MINS=2),
+        "coursewrapper": make_module("coursewrapper", CourseWrapper=object),
+        "cycletrace": make_module("cycletrace", CycleTrace=object),
+        "database": database,
+        "log_utils": make_module("log_utils", log_error=noop, log_notifs=noop),
+        "mobileapp": make_module("mobileapp", MobileApp=object),
+        "monitor_utils": monitor_utils,
+        "writebuffer": writebuffer,
+    }
+    with ModulePatch(modules):
+        return load_module("monitor_under_test", ROOT / "src" / "monitor.py")
+
+
+class SeatsFingerprintTests(unittest.TestCase):
+    def setUp(self):
+        self.monitor_utils = load_monitor_utils()
+
+    def prev(self, fingerprint, mins_ago):
+        return {"fingerprint": fingerprint, "time": NOW - timedelta(minutes=mins_ago)}
+
+    def test_unrecorded_section_is_changed(self):
+        self.assertFalse(
+            self.monitor_utils.is_section_unchanged(None, [10, 20, "Open"], NOW)
+        )
+
+    def test_same_fingerprint_within_window_is_unchanged(self):
+        prev = self.prev([10, 20, "Open"], 5)
+        self.assertTrue(
+            self.monitor_utils.is_section_unchanged(prev, [10, 20, "Open"], NOW)
+        )
+
+    def test_same_fingerprint_after_window_is_changed(self):
+        prev = self.prev([10, 20, "Open"], 15)
+        self.assertFalse(
+            self.monitor_utils.is_section_unchanged(prev, [10, 20, "Open"], NOW)
+        )
+
+    def test_any_field_change_is_changed(self):
+        for fingerprint in ([11, 20, "Open"], [10, 21, "Open"], [10, 20, "Closed"]):
+            prev = self.prev([10, 20, "Open"], 1)
+            self.assertFalse(
+                self.monitor_utils.is_section_unchanged(prev, fingerprint, NOW)
+            )
+
+
+class SaveFingerprintsTests(unittest.TestCase):
+    def setUp(self):
+        self.monitor_module = load_monitor()
+        self.db = FakeFingerprintDatabase()
+
+    # runs the open spots step of a cycle in which classes 40001 (with
+    # open spots) and 40002 (full) are observed with the same seats
+    def find_open_spots(self, monitor):
+        monitor.clear_cache()
+        monitor._pending_fingerprints = {}
+        monitor._observed = {
+            "40001": [9, 10, "Open"],
+            "40002": [10, 10, "Closed"],
+        }
+        monitor._changed_enrollments = monitor._skip_unchanged_sections(
+            {"40001": 1, "40002": 0}
+        )
+        return monitor._changed_enrollments
+
+    def test_fingerprints_are_stored_only_when_saved(self):
+        monitor = self.monitor_module.Monitor(self.db)
+
+        self.find_open_spots(monitor)
+
+        self.assertEqual(self.db.stored, {})
+
+    def test_failed_notify_does_not_suppress_next_cycle(self):
+        monitor = self.monitor_module.Monitor(self.db)
+
+        self.assertIn("40001", self.find_open_spots(monitor))
+        # the notifications of 40001 could not be stored
+        monitor.save_fingerprints(set())
+        self.assertEqual(list(self.db.stored), ["40002"])
+
+        self.assertEqual(self.find_open_spots(monitor), {"40001": 1})
+        # nor by a restarted Monitor, which loads the stored fingerprints
+        restarted = self.monitor_module.Monitor(self.db)
+        self.assertEqual(self.find_open_spots(restarted), {"40001": 1})
+
+    def test_notified_section_is_skipped_next_cycle(self):
+        monitor = self.monitor_module.Monitor(self.db)
+
+        self.find_open_spots(monitor)
+        monitor.save_fingerprints({"40001"})
+
+        self.assertEqual(sorted(self.db.stored), ["40001", "40002"])
+        self.assertEqual(self.find_open_spots(monitor), {})
+        restarted = self.monitor_module.Monitor(self.db)
+        self.assertEqual(self.find_open_spots(restarted), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
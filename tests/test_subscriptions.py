@@ -0,0 +1,252 @@
+import sys
+import types
+import unittest
+
+from helpers import ROOT, ModulePatch, load_module, noop
+from test_database_client import fake_database_modules
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def _call(self, method, *args, **kwargs):
+        self.db.calls.append((self.name, method, args, kwargs))
+        return self.db.results.get((self.name, method))
+
+    def find_one(self, *args, **kwargs):
+        return self._call("find_one", *args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        return self._call("find", *args, **kwargs) or []
+
+    def aggregate(self, *args, **kwargs):
+        return iter(self._call("aggregate", *args, **kwargs) or [])
+
+    def update_one(self, *args, **kwargs):
+        res = self._call("update_one", *args, **kwargs)
+        return res if res is not None else types.SimpleNamespace(matched_count=1)
+
+    def delete_one(self, *args, **kwargs):
+        res = self._call("delete_one", *args, **kwargs)
+        return res if res is not None else types.SimpleNamespace(deleted_count=0)
+
+
+class FakeSession:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def with_transaction(self, callback):
+        self.db.transactions += 1
+        return callback(self)
+
+
+class FakeMongoDatabase:
+    def __init__(self):
+        self.calls = []
+        self.results = {}
+        self.transactions = 0
+        self.client = types.SimpleNamespace(start_session=lambda: FakeSession(self))
+
+    def __getattr__(self, name):
+        return FakeCollection(self, name)
+
+    def writes(self):
+        return [
+            (coll, method)
+            for coll, method, _, _ in self.calls
+            if method in ("update_one", "delete_one")
+        ]
+
+
+class SubscriptionTests(unittest.TestCase):
+    def load_database(self, subscription_transactions=False):
+        modules = fake_database_modules(
+            object, subscription_transactions=subscription_transactions
+        )
+        with ModulePatch(modules):
+            database = load_module(
+                "database_subscriptions_under_test", ROOT / "src" / "database.py"
+            )
+        db = database.Database.__new__(database.Database)
+        db._db = FakeMongoDatabase()
+        db._get_admin = lambda: {"disabled_courses": []}
+        db._add_system_log = noop
+        return db
+
+    def set_class(self, db, status_is_open=False, has_reserved_seats=False):
+        db._db.results[("enrollments", "find_one")] = {
+            "classid": "40001",
+            "courseid": "000001",
+            "enrollment": 10,
+            "capacity": 10,
+        }
+        db._db.results[("courses", "find_one")] = {
+            "displayname": "COS333/ECE333",
+            "has_reserved_seats": has_reserved_seats,
+            "class_40001": {"status_is_open": status_is_open},
+        }
+
+    def test_subscribe_uses_conditional_set_operators(self):
+        db = self.load_database()
+        self.set_class(db)
+
+        self.assertEqual(db.add_to_waitlist("user1 ", "40001"), 1)
+
+        self.assertEqual(len(db._db.calls), 5)
+        users_update = db._db.calls[2]
+        self.assertEqual(users_update[:2], ("users", "update_one"))
+        user_filter, user_update = users_update[2]
+        self.assertEqual(user_filter["netid"], "user1")
+        self.assertEqual(user_filter["waitlists"], {"$ne": "40001"})
+        self.assertEqual(user_filter["$expr"], {"$lt": [{"$size": "$waitlists"}, 10]})
+        self.assertEqual(user_update, {"$addToSet": {"waitlists": "40001"}})
+        _, method, args, kwargs = db._db.calls[3]
+        self.assertEqual(
+            args, ({"classid": "40001"}, {"$addToSet": {"waitlist": "user1"}})
+        )
+        self.assertTrue(kwargs["upsert"])
+        self.assertEqual(db._db.calls[4][:2], ("notifs", "update_one"))
+
+    def test_subscribe_over_waitlist_limit_returns_0(self):
+        db = self.load_database()
+        self.set_class(db)
+        db._db.results[("users", "update_one")] = types.SimpleNamespace(matched_count=0)
+        db._db.results[("users", "find_one")] = {
+            "waitlists": [str(i) for i in range(10)]
+        }
+
+        self.assertEqual(db.add_to_waitlist("user1", "40001"), 0)
+        self.assertEqual(db._db.writes(), [("users", "update_one")])
+
+    def test_subscribe_twice_raises_without_writing_waitlist(self):
+        db = self.load_database()
+        self.set_class(db)
+        db._db.results[("users", "update_one")] = types.SimpleNamespace(matched_count=0)
+        db._db.results[("users", "find_one")] = {"waitlists": ["40001"]}
+
+        with self.assertRaisesRegex(Exception, "already in waitlist"):
+            db.add_to_waitlist("user1", "40001")
+        self.assertEqual(db._db.writes(), [("users", "update_one")])
+
+    def test_subscribe_to_open_class_raises_before_writing(self):
+        db = self.load_database()
+        self.set_class(db, status_is_open=True)
+
+        with self.assertRaisesRegex(Exception, "is not Closed"):
+            db.add_to_waitlist("user1", "40001")
+        self.assertEqual(db._db.writes(), [])
+
+    def test_unsubscribe_pulls_and_deletes_emptied_waitlist(self):
+        db = self.load_database()
+        db._db.results[("enrollments", "find")] = [
+            {"classid": "40001", "courseid": "000001", "section": "P01"}
+        ]
+        db._db.results[("courses", "find")] = [
+            {
+                "courseid": "000001",
+                "displayname": "COS333/ECE333",
+                "title": "Advanced Programming Techniques",
+                "has_reserved_seats": True,
+            }
+        ]
+        db._db.results[("waitlists", "delete_one")] = types.SimpleNamespace(
+            deleted_count=1
+        )
+
+        db.remove_from_waitlist("user1", "40001")
+
+        updates = {
+            coll: args
+            for coll, method, args, _ in db._db.calls
+            if method == "update_one"
+        }
+        self.assertEqual(
+            updates["users"],
+            (
+                {"netid": "user1", "waitlists": "40001"},
+                {"$pull": {"waitlists": "40001"}},
+            ),
+        )
+        self.assertEqual(
+            updates["waitlists"],
+            ({"classid": "40001"}, {"$pull": {"waitlist": "user1"}}),
+        )
+        self.assertEqual(
+            updates["enrollments"],
+            ({"classid": "40001"}, {"$set": {"prev_enrollment": 0}}),
+        )
+        deletes = [
+            args for coll, method, args, _ in db._db.calls if method == "delete_one"
+        ]
+        self.assertEqual(deletes, [({"classid": "40001", "waitlist": {"$size": 0}},)])
+
+    def test_unsubscribe_when_not_subscribed_raises(self):
+        db = self.load_database()
+        db._db.results[("enrollments", "find")] = [
+            {"classid": "40001", "courseid": "000001", "section": "P01"}
+        ]
+        db._db.results[("courses", "find")] = [
+            {"courseid": "000001", "displayname": "COS333", "title": "APT"}
+        ]
+        db._db.results[("users", "update_one")] = types.SimpleNamespace(matched_count=0)
+        db._db.results[("users", "find_one")] = {"netid": "user1"}
+
+        with self.assertRaisesRegex(Exception, "not in waitlist"):
+            db.remove_from_waitlist("user1", "40001")
+        self.assertEqual(db._db.writes(), [("users", "update_one")])
+
+    def remove_in_bulk(self, deleted_count):
+        db = self.load_database()
+        database = sys.modules["database_subscriptions_under_test"]
+        database.UpdateOne = database.UpdateMany = lambda *args: args
+        writes = []
+        db.bulk_write = lambda coll, ops: writes.append((coll, ops))
+        db.classids_to_classinfo = lambda classids: {
+            "40001": ("COS333", "APT", "P01", "000001", True)
+        }
+        db.system_log_op = lambda *args, **kwargs: args
+        db._db.results[("waitlists", "find")] = [{"classid": "40001"}]
+        db._db.results[("waitlists", "delete_one")] = types.SimpleNamespace(
+            deleted_count=deleted_count
+        )
+
+        db.remove_from_waitlists_bulk({"40001": ["user1"]})
+
+        deletes = [
+            args for coll, method, args, _ in db._db.calls if method == "delete_one"
+        ]
+        self.assertEqual(deletes, [({"classid": "40001", "waitlist": {"$size": 0}},)])
+        return [coll for coll, _ in writes]
+
+    def test_bulk_unsubscribe_deletes_emptied_waitlist(self):
+        self.assertIn("enrollments", self.remove_in_bulk(deleted_count=1))
+
+    def test_bulk_unsubscribe_keeps_waitlist_subscribed_to_meanwhile(self):
+        self.assertNotIn("enrollments", self.remove_in_bulk(deleted_count=0))
+
+    def test_writes_share_a_transaction_if_enabled(self):
+        db = self.load_database(subscription_transactions=True)
+        self.set_class(db)
+
+        self.assertEqual(db.add_to_waitlist("user1", "40001"), 1)
+
+        self.assertEqual(db._db.transactions, 1)
+        sessions = [
+            kwargs.get("session")
+            for _, method, _, kwargs in db._db.calls
+            if method == "update_one"
+        ]
+        self.assertEqual(len(sessions), 3)
+        self.assertTrue(all(isinstance(s, FakeSession) for s in sessions))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import threading
+import unittest
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeCollection:
+    full_name = "tigersnatch.system"
+
+    def __init__(self, fail=False):
+        self.inserts = []
+        self.fail = fail
+        self.inserted = threading.Event()
+
+    def insert_many(self, docs, ordered=True):
+        if self.fail:
+            raise RuntimeError("mongo down")
+        self.inserts.append(list(docs))
+        self.inserted.set()
+
+
+def load_systemlog():
+    modules = {
+        "config": make_module(
+            "config",
+            SYSTEM_LOG_BATCH_SIZE=3,
+            SYSTEM_LOG_FLUSH_SECS=0.05,
+            SYSTEM_LOG_MAX_QUEUE=5,
+        ),
+        "log_utils": make_module("log_utils", log_error=noop),
+    }
+    with ModulePatch(modules):
+        return load_module("systemlog", ROOT / "src" / "systemlog.py")
+
+
+class SystemLogWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.systemlog = load_systemlog()
+
+    def test_events_are_written_in_batches_in_the_background(self):
+        coll = FakeCollection()
+        writer = self.systemlog.SystemLogWriter(coll)
+
+        for i in range(4):
+            writer.add({"i": i})
+
+        self.assertTrue(coll.inserted.wait(timeout=5))
+        writer.close()
+        self.assertEqual(
+            [[doc["i"] for doc in docs] for docs in coll.inserts][0], [0, 1, 2]
+        )
+        self.assertEqual(sum(len(docs) for docs in coll.inserts), 4)
+        self.assertEqual(writer.get_stats()["written"], 4)
+
+    def test_events_beyond_the_queue_bound_are_dropped_without_blocking(self):
+        coll = FakeCollection()
+        writer = self.systemlog.SystemLogWriter(coll, max_queue=2)
+        writer._start = noop  # no background writer: the queue stays full
+
+        for i in range(5):
+            writer.add({"i": i})
+        writer.flush()
+
+        self.assertEqual(writer.get_stats()["dropped"], 3)
+        self.assertEqual([doc["i"] for docs in coll.inserts for doc in docs], [0, 1])
+
+    def test_failed_writes_are_counted(self):
+        writer = self.systemlog.SystemLogWriter(FakeCollection(fail=True))
+        writer._start = noop
+
+        writer.add({"i": 0})
+        writer.flush()
+
+        self.assertEqual(writer.get_stats()["failed"], 1)
+        self.assertEqual(writer.get_stats()["queued"], 0)
+
+    def test_writers_are_shared_per_collection_and_flushed_together(self):
+        coll = FakeCollection()
+        writer = self.systemlog.get_system_log_writer(coll)
+        writer._start = noop
+
+        self.assertIs(self.systemlog.get_system_log_writer(coll), writer)
+        writer.add({"i": 0})
+        self.systemlog.flush_system_logs()
+
+        self.assertEqual(coll.inserts, [[{"i": 0}]])
+        self.assertEqual(self.systemlog.get_system_log_stats()["written"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import json
+import unittest
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.text = json.dumps(body)
+
+
+class FakeTransport:
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self.n_posts = 0
+
+    def post(self, url, data=None, headers=None):
+        self.n_posts += 1
+        return FakeResponse(
+            {"access_token": f"token{self.n_posts}", "expires_in": self.expires_in}
+        )
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.tokens = {}
+
+    def get_oauth_token(self, name):
+        token = self.tokens.get(name)
+        if token is None:
+            return None
+        return {k: v for k, v in token.items() if k != "refreshing_until"}
+
+    def lock_oauth_token_refresh(self, name, lock_secs):
+        token = self.tokens.setdefault(name, {"refreshing_until": 0})
+        if token["refreshing_until"]:
+            return False
+        token["refreshing_until"] = lock_secs
+        return True
+
+    def set_oauth_token(self, name, access_token, expires_at):
+        self.tokens[name] = {
+            "access_token": access_token,
+            "expires_at": expires_at,
+            "refreshing_until": 0,
+        }
+
+    def invalidate_oauth_token(self, name, access_token):
+        token = self.tokens.get(name)
+        if token is not None and token.get("access_token") == access_token:
+            token["expires_at"] = 0
+
+
+def load_tokencache():
+    modules = {
+        "config": make_module(
+            "config",
+            CONSUMER_KEY="key",
+            CONSUMER_SECRET="secret",
+            OIT_BASE_URL="https://oit",
+            TOKEN_REFRESH_LOCK_SECS=10,
+            TOKEN_REFRESH_MARGIN_SECS=300,
+        ),
+        "log_utils": make_module("log_utils", log_error=noop),
+        "transport": make_module("transport", get_transport=FakeTransport),
+    }
+    with ModulePatch(modules):
+        return load_module("tokencache", ROOT / "src" / "tokencache.py")
+
+
+class TokenCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tokencache = load_tokencache()
+        self.db = FakeDatabase()
+
+    # simulates a fresh process (web worker or dyno) sharing self.db
+    def new_process(self):
+        self.tokencache._local_tokens.clear()
+
+    def test_token_is_cached_in_process(self):
+        transport = FakeTransport()
+        cache = self.tokencache.TokenCache(self.db, transport)
+
+        self.assertEqual(cache.get_token(), "token1")
+        self.assertEqual(cache.get_token(), "token1")
+        self.assertEqual(transport.n_posts, 1)
+
+    def test_token_is_shared_across_processes(self):
+        self.tokencache.TokenCache(self.db, FakeTransport()).get_token()
+        self.new_process()
+        transport = FakeTransport()
+
+        self.assertEqual(
+            self.tokencache.TokenCache(self.db, transport).get_token(), "token1"
+        )
+        self.assertEqual(transport.n_posts, 0)
+
+    def test_token_is_refreshed_before_expiry(self):
+        transport = FakeTransport(expires_in=200)
+        cache = self.tokencache.TokenCache(self.db, transport)
+
+        self.assertEqual(cache.get_token(), "token1")
+        self.assertEqual(cache.get_token(), "token2")
+        self.assertEqual(transport.n_posts, 2)
+
+    def test_invalidated_token_is_replaced_once(self):
+        transport = FakeTransport()
+        cache = self.tokencache.TokenCache(self.db, transport)
+        cache.get_token()
+
+        cache.invalidate("token1")
+        self.assertEqual(cache.get_token(), "token2")
+        # a stale rejection must not discard the replacement token
+        cache.invalidate("token1")
+        self.new_process()
+        self.assertEqual(cache.get_token(), "token2")
+        self.assertEqual(transport.n_posts, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
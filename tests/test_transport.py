@@ -0,0 +1,135 @@
+import unittest
+
+import requests
+
+from helpers import ROOT, ModulePatch, load_module, make_module, noop
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSession:
+    def __init__(self, results):
+        # each result is a status code or an exception to raise
+        self.results = list(results)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return FakeResponse(result)
+
+
+def load_transport():
+    modules = {
+        "config": make_module(
+            "config",
+            OIT_BACKOFF_BASE_SECS=0,
+            OIT_BACKOFF_MAX_SECS=0,
+            OIT_CIRCUIT_FAILURE_THRESHOLD=2,
+            OIT_CIRCUIT_RESET_SECS=60,
+            OIT_CONNECT_TIMEOUT_SECS=1,
+            OIT_MAX_RETRIES=2,
+            OIT_POOL_MAXSIZE=4,
+            OIT_READ_TIMEOUT_SECS=10,
+        ),
+        "cycletrace": make_module("cycletrace", record_http_request=noop),
+        "log_utils": make_module("log_utils", log_error=noop),
+    }
+    with ModulePatch(modules):
+        return load_module("transport", ROOT / "src" / "transport.py")
+
+
+class TransportTests(unittest.TestCase):
+    def setUp(self):
+        self.transport_module = load_transport()
+
+    def make_transport(self, results):
+        transport = self.transport_module.Transport()
+        transport._session = FakeSession(results)
+        return transport
+
+    def test_5xx_and_429_are_retried(self):
+        transport = self.make_transport([503, 429, 200])
+
+        res = transport.get("https://api/student-app/courses/seats", endpoint="/seats")
+
+        self.assertEqual(res.status_code, 200)
+        stats = transport.get_stats()
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["retries"], 2)
+        self.assertEqual(stats["failures"], 0)
+
+    def test_seats_requests_are_not_retried(self):
+        transport = self.make_transport([503])
+
+        res = transport.get("https://api/courses/seats", endpoint="/courses/seats")
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(len(transport._session.calls), 1)
+        self.assertEqual(transport.get_stats()["failures"], 1)
+
+    def test_after_attempt_decides_retries(self):
+        transport = self.make_transport([])
+
+        self.assertIsNone(transport.after_attempt("/x", 0, 0.1, status=200))
+        self.assertEqual(transport.after_attempt("/x", 0, 0.1, status=503), 0)
+        self.assertEqual(
+            transport.after_attempt("/x", 1, 0.1, error=requests.ConnectionError()), 0
+        )
+        self.assertIsNone(transport.after_attempt("/x", 2, 0.1, status=503))
+        stats = transport.get_stats()
+        self.assertEqual(
+            (stats["requests"], stats["retries"], stats["failures"]), (4, 2, 1)
+        )
+
+    def test_client_errors_are_not_retried(self):
+        transport = self.make_transport([404])
+
+        self.assertEqual(transport.get("https://api/x").status_code, 404)
+        self.assertEqual(transport.get_stats()["retries"], 0)
+
+    def test_endpoint_timeouts(self):
+        transport = self.make_transport([200, 200])
+
+        transport.get("https://api/courses/courses", endpoint="/courses/courses")
+        transport.get("https://api/courses/seats", endpoint="/courses/seats")
+
+        timeouts = [kwargs["timeout"] for _, _, kwargs in transport._session.calls]
+        self.assertEqual(timeouts, [(1, 20), (1, 10)])
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        error = requests.ConnectionError("down")
+        transport = self.make_transport([error] * 6)
+
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                transport.get("https://api/x")
+        with self.assertRaises(self.transport_module.CircuitOpenError):
+            transport.get("https://api/x")
+
+        stats = transport.get_stats()
+        self.assertEqual(stats["circuit_state"], "open")
+        self.assertEqual(stats["circuit_opens"], 1)
+        self.assertEqual(stats["fast_failures"], 1)
+        self.assertEqual(len(transport._session.calls), 6)
+
+    def test_trial_request_closes_circuit(self):
+        error = requests.ConnectionError("down")
+        transport = self.make_transport([error] * 6 + [200])
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                transport.get("https://api/x")
+
+        transport._opened_at -= 60
+        self.assertEqual(transport.get("https://api/x").status_code, 200)
+        self.assertEqual(transport.get_stats()["circuit_state"], "closed")
+
+
+if __name__ == "__main__":
+    unittest.main()